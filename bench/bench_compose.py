@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+Spanned image benchmark: composing one image per monitor over a generated
+layout (three 4K monitors by default), from originals bigger than the
+monitors and from prescaled variants, cold and from the composite cache
+"""
+
+from __future__ import print_function
+
+import os
+import argparse
+import statistics
+
+import benchutil
+
+DEFAULT_LAYOUT = "3840x2160+0+0,3840x2160+3840+0,3840x2160+7680+0"
+ORIGINAL_SIZE = (5120, 2880)
+RUNS = 3
+
+
+def make_images(directory, count, size):
+    """count noisy JPEGs, about as hard to decode as a photo"""
+    from PIL import Image  # pylint: disable=import-outside-toplevel
+
+    paths = []
+    for num in range(count):
+        bands = [Image.effect_noise(size, 40 + num * 10) for _ in range(3)]
+        path = os.path.join(directory, f"original-{num}.jpg")
+        Image.merge("RGB", bands).save(path, "JPEG", quality=90)
+        paths.append(path)
+    return paths
+
+
+def compose_cold(compose, tiles, cache_dir, workers=None):
+    """seconds of RUNS compositions with an empty cache every time"""
+    timings = []
+    for _ in range(RUNS):
+        for name in os.listdir(cache_dir) if os.path.isdir(cache_dir) else []:
+            os.remove(os.path.join(cache_dir, name))
+        seconds, _ = benchutil.timed(
+            compose.compose, tiles, cache_dir, workers=workers
+        )
+        timings.append(seconds)
+    return timings
+
+
+def main():
+    """print the JSON report"""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--layout", default=DEFAULT_LAYOUT, help="WxH+X+Y,...")
+    parser.add_argument("--workers", type=int, help="tile processes, default one each")
+    parser.add_argument("--out", help="also write the JSON report here")
+    args = parser.parse_args()
+
+    home = benchutil.sandbox()
+    try:
+        import compose  # pylint: disable=import-outside-toplevel
+        import monitors  # pylint: disable=import-outside-toplevel
+        import prescale  # pylint: disable=import-outside-toplevel
+
+        layout = monitors.layout(args.layout)
+        originals = make_images(home, len(layout), ORIGINAL_SIZE)
+        cache_dir = os.path.join(home, "spans")
+        variant_dir = os.path.join(home, "variants")
+        results = {"layout": args.layout, "original_size": list(ORIGINAL_SIZE)}
+
+        tiles = list(zip(originals, layout))
+        timings = compose_cold(compose, tiles, cache_dir, args.workers)
+        results["originals_cold_s"] = statistics.median(timings)
+        results["cached_s"], _ = benchutil.timed(compose.compose, tiles, cache_dir)
+
+        variants = []
+        os.makedirs(variant_dir)
+        for path, monitor in tiles:
+            size = (monitor["width"], monitor["height"])
+            content_hash, _ = prescale.make_variants(path, [size], variant_dir)
+            variants.append(prescale.variant_path(variant_dir, content_hash, size))
+        timings = compose_cold(
+            compose, list(zip(variants, layout)), cache_dir, args.workers
+        )
+        results["variants_cold_s"] = statistics.median(timings)
+        results["cpus"] = os.cpu_count()
+    finally:
+        benchutil.remove_sandbox(home)
+    benchutil.write_results("compose", results, args.out)
+
+
+if __name__ == "__main__":
+    main()
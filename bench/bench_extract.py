@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark of socwall link extraction on the saved fixture pages:
+full lxml parse + XPath (the old way) against the streaming selectors
+"""
+
+from __future__ import print_function
+
+import os
+import sys
+import json
+import timeit
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, "..", "src"))
+
+# pylint: disable=wrong-import-position
+import extract
+
+FIXTURES = os.path.join(HERE, "fixtures")
+CHUNK_SIZE = 8 * 1024
+REPEAT = 200
+
+
+def chunks_of(body, consumed):
+    """body in network sized chunks, counting what was handed out"""
+    for start in range(0, len(body), CHUNK_SIZE):
+        chunk = body[start : start + CHUNK_SIZE]
+        consumed[0] += len(chunk)
+        yield chunk
+
+
+def bench_streaming(body, selector):
+    """(seconds per page, bytes read, hrefs)"""
+    consumed = [0]
+    found = selector.extract(chunks_of(body, consumed))
+    seconds = timeit.timeit(
+        lambda: selector.extract(chunks_of(body, [0])), number=REPEAT
+    )
+    return seconds / REPEAT, consumed[0], found
+
+
+def bench_lxml(body, xpath):
+    """(seconds per page, bytes read, hrefs), None without lxml"""
+    try:
+        from lxml import html
+    except ImportError:
+        return None
+
+    def run():
+        return [a.attrib["href"] for a in html.fromstring(body).xpath(xpath)]
+
+    found = run()
+    return timeit.timeit(run, number=REPEAT) / REPEAT, len(body), found
+
+
+def main():
+    """run both pages through both extractors"""
+    cases = [
+        (
+            "listing",
+            "socwall_listing.html",
+            extract.AnchorSelector("images", "image"),
+            "//a[@class='image']",
+        ),
+        (
+            "detail",
+            "socwall_detail.html",
+            extract.AnchorSelector("download", "download", limit=1),
+            "//a[@class='download']",
+        ),
+    ]
+    results = {}
+    for name, fixture, selector, xpath in cases:
+        with open(os.path.join(FIXTURES, fixture), "rb") as fixturef:
+            body = fixturef.read()
+        streaming = bench_streaming(body, selector)
+        results[name] = {
+            "page_bytes": len(body),
+            "streaming_us": streaming[0] * 1e6,
+            "streaming_bytes_read": streaming[1],
+            "links": len(streaming[2]),
+        }
+        full = bench_lxml(body, xpath)
+        if full is not None:
+            if full[2][: len(streaming[2])] != streaming[2]:
+                print(f"{name}: extractors disagree", file=sys.stderr)
+            results[name]["lxml_us"] = full[0] * 1e6
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
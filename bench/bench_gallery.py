@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+Gallery benchmark over generated galleries: importing a large
+used_images.log, get_existing_images cold and warm, get_random_wallpaper
+and remove_used
+"""
+
+from __future__ import print_function
+
+import os
+import argparse
+import statistics
+
+import benchutil
+import standin
+
+IMAGE_BYTES = 256
+RANDOM_PICKS = 20
+
+
+def make_gallery(home, files, static_share, used_share, log_repeat):
+    """
+    N tiny but complete JPEGs in Wallpapers, a share of that in
+    Static-Wallpapers, and a used_images.log naming the used ones
+    log_repeat times over like an old log that was never cleaned
+    """
+    wallpaper_dir = os.path.join(home, "Wallpapers")
+    static_dir = os.path.join(home, "Static-Wallpapers")
+    config_dir = os.path.join(os.environ["XDG_CONFIG_HOME"], "wallpaper")
+    for directory in (wallpaper_dir, static_dir, config_dir):
+        os.makedirs(directory, exist_ok=True)
+    used = []
+    statics = int(files * static_share)
+    for num in range(files):
+        if num < statics:
+            path = os.path.join(static_dir, f"static-{num}.jpg")
+        else:
+            path = os.path.join(wallpaper_dir, f"socwall-{num}.jpg")
+        with open(path, "wb") as imgf:
+            imgf.write(standin.jpeg_body(num, IMAGE_BYTES))
+        if num % round(1 / used_share) == 0:
+            used.append(path)
+    with open(os.path.join(config_dir, "used_images.log"), "w", encoding="utf-8") as logf:
+        for _ in range(log_repeat):
+            logf.writelines(path + "\n" for path in used)
+    return len(used)
+
+
+def run_size(files, args):
+    """every measurement on one generated gallery"""
+    home = benchutil.sandbox()
+    try:
+        seconds, used = benchutil.timed(
+            make_gallery, home, files, args.static_share, args.used_share, args.log_repeat
+        )
+        result = {"files": files, "used": used, "generate_s": seconds}
+        import wallpaper  # pylint: disable=import-outside-toplevel
+
+        result["init_import_log_s"], wm = benchutil.timed(wallpaper.Wallpaper)
+        result["get_existing_images_cold_s"], unused = benchutil.timed(
+            wm.get_existing_images
+        )
+        result["unused"] = len(unused)
+        result["get_existing_images_warm_s"], _ = benchutil.timed(
+            wm.get_existing_images
+        )
+        picks = [
+            benchutil.timed(wm.get_random_wallpaper)[0] for _ in range(RANDOM_PICKS)
+        ]
+        result["get_random_wallpaper_median_s"] = statistics.median(picks)
+        result["get_random_wallpaper_max_s"] = max(picks)
+        result["remove_used_s"], removed = benchutil.timed(wm.remove_used)
+        result["removed"] = len(removed)
+        wm.index.close()
+        return result
+    finally:
+        benchutil.remove_sandbox(home)
+
+
+def main():
+    """run every gallery size"""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--sizes", default="1000,10000,100000", help="comma separated file counts"
+    )
+    parser.add_argument("--static-share", type=float, default=0.1)
+    parser.add_argument("--used-share", type=float, default=0.5)
+    parser.add_argument(
+        "--log-repeat", type=int, default=3, help="times every used path is logged"
+    )
+    parser.add_argument("--out", help="also write the JSON report here")
+    args = parser.parse_args()
+    results = {"settings": vars(args), "galleries": []}
+    for files in [int(size) for size in args.sizes.split(",")]:
+        results["galleries"].append(run_size(files, args))
+    benchutil.write_results("gallery", results, args.out)
+
+
+if __name__ == "__main__":
+    main()
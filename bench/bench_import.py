@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+Import time budget of the cron path (cli set-next): imports the modules in
+a fresh interpreter with -X importtime, fails when they take longer than
+the budget or pull in a module that only other subcommands need
+"""
+
+from __future__ import print_function
+
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+
+import benchutil
+
+# what set-next loads, see cli.cmd_set_next
+STARTUP_MODULES = ["cli", "wallpaper", "refill"]
+# only refills, dedup, prescaling or the GUI may load these
+FORBIDDEN = ["requests", "lxml", "xdg", "tkinter", "PIL", "asyncio", "socwall"]
+DEFAULT_BUDGET_MS = 50.0
+RUNS = 7
+
+
+def measure():
+    """(milliseconds spent importing our modules, modules loaded) for one run"""
+    code = (
+        f"import sys, json; import {', '.join(STARTUP_MODULES)};"
+        " print(json.dumps(sorted(sys.modules)))"
+    )
+    env = dict(os.environ, PYTHONPATH=os.path.abspath(benchutil.SRC))
+    done = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        capture_output=True,
+        text=True,
+        env=env,
+        check=True,
+    )
+    microseconds = 0
+    for line in done.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|")
+        # top level entries only, their cumulative time covers the rest
+        if name.strip() in STARTUP_MODULES and name == " " + name.strip():
+            microseconds += int(cumulative)
+    return microseconds / 1000.0, json.loads(done.stdout)
+
+
+def forbidden_loaded(modules):
+    """the FORBIDDEN modules and submodules among modules"""
+    return sorted(
+        name
+        for name in modules
+        if any(name == f or name.startswith(f + ".") for f in FORBIDDEN)
+    )
+
+
+def main():
+    """exit status 1 when the startup path is over budget"""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--budget-ms", type=float, default=DEFAULT_BUDGET_MS)
+    parser.add_argument("--runs", type=int, default=RUNS)
+    parser.add_argument("--out", help="also write the JSON report here")
+    args = parser.parse_args()
+
+    timings = []
+    loaded = set()
+    for _ in range(args.runs):
+        milliseconds, modules = measure()
+        timings.append(milliseconds)
+        loaded.update(modules)
+    median = statistics.median(timings)
+    forbidden = forbidden_loaded(loaded)
+    results = {
+        "modules": STARTUP_MODULES,
+        "median_ms": median,
+        "min_ms": min(timings),
+        "max_ms": max(timings),
+        "budget_ms": args.budget_ms,
+        "forbidden_loaded": forbidden,
+        "ok": median <= args.budget_ms and not forbidden,
+    }
+    benchutil.write_results("import", results, args.out)
+    if not results["ok"]:
+        print(
+            f"startup path over budget: {median:.1f}ms of {args.budget_ms:.1f}ms,"
+            f" forbidden modules {forbidden}",
+            file=sys.stderr,
+        )
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+Refill benchmark against the local stand-in server: throughput of
+dl_random_images, dl_page and a refill from several providers at once,
+plus cold and warm dl_one latency
+"""
+
+from __future__ import print_function
+
+import os
+import argparse
+
+import benchutil
+import standin
+
+# pylint: disable=wrong-import-position,wrong-import-order
+HOME = benchutil.sandbox()
+
+import socwall
+import session
+import providers
+
+
+def gallery_dir(name):
+    """a fresh download folder in the sandbox"""
+    path = os.path.join(HOME, name)
+    os.makedirs(path)
+    return path
+
+
+def cold_start():
+    """forget pooled connections and cached pages"""
+    session.close_all()
+    os.environ["XDG_CACHE_HOME"] = os.path.join(HOME, f".cache-{os.urandom(4).hex()}")
+
+
+def throughput(server, func, path):
+    """run one refill, returns its numbers"""
+    before = server.stats()
+    seconds, paths = benchutil.timed(func, path)
+    after = server.stats()
+    paths = [p for p in paths if p]
+    image_bytes = sum(os.path.getsize(p) for p in paths)
+    return {
+        "seconds": seconds,
+        "images": len(paths),
+        "bytes": image_bytes,
+        "images_per_s": len(paths) / seconds if seconds else None,
+        "bytes_per_s": image_bytes / seconds if seconds else None,
+        "requests": after["requests"] - before["requests"],
+        "errors_injected": after["errors_injected"] - before["errors_injected"],
+    }
+
+
+def main():
+    """run every case against one server"""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--images", type=int, default=20, help="refill size")
+    # dl_one guesses pages up to SOCWALL_MAX before the real count is known
+    parser.add_argument(
+        "--pages", type=int, default=socwall.SOCWALL_MAX, help="listing pages served"
+    )
+    parser.add_argument("--image-kb", type=int, default=256, help="image size")
+    parser.add_argument("--latency", type=float, default=0.02, help="seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="0..1")
+    parser.add_argument(
+        "--rate", type=float, help="socwall requests per second, default as shipped"
+    )
+    parser.add_argument("--out", help="also write the JSON report here")
+    args = parser.parse_args()
+
+    server = standin.StandIn(
+        args.pages, args.image_kb * 1024, args.latency, args.error_rate
+    )
+    socwall.SOCWALL_DOMAIN = server.start()
+    socwall.SOCWALL_VERBOSE = False
+    if args.rate:
+        socwall.SocwallProvider.rate = args.rate
+    standin.register_fakes(server.url)
+
+    results = {"settings": vars(args)}
+    try:
+        cold_start()
+        results["dl_random_images"] = throughput(
+            server,
+            lambda path: socwall.dl_random_images(path, args.images),
+            gallery_dir("random"),
+        )
+        cold_start()
+        results["dl_page"] = throughput(
+            server, lambda path: socwall.dl_page(1, path), gallery_dir("page")
+        )
+        results["all_providers"] = throughput(
+            server,
+            lambda path: [
+                p
+                for _, p in providers.fetch_all(
+                    providers.enabled(["socwall", "alpha", "beta"], path),
+                    args.images,
+                )
+            ],
+            gallery_dir("providers"),
+        )
+        cold_start()
+        one = gallery_dir("one")
+        results["dl_one_cold"] = throughput(
+            server, lambda path: [socwall.dl_one(path)], one
+        )
+        results["dl_one_warm"] = throughput(
+            server, lambda path: [socwall.dl_one(path)], one
+        )
+        results["server"] = server.stats()
+    finally:
+        server.stop()
+        session.close_all()
+        benchutil.remove_sandbox(HOME)
+    benchutil.write_results("refill", results, args.out)
+
+
+if __name__ == "__main__":
+    main()
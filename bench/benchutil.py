@@ -0,0 +1,78 @@
+"""
+Shared bits of the benchmarks: a throwaway home, timers and JSON output
+"""
+
+from __future__ import print_function
+
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import tempfile
+import subprocess
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SRC = os.path.join(HERE, "..", "src")
+sys.path.insert(0, SRC)
+
+
+def sandbox(prefix="wallpaper-bench-"):
+    """
+    Point HOME and the XDG dirs at a fresh temporary directory so nothing
+    touches the real galleries or caches. Call before importing config.
+    """
+    home = tempfile.mkdtemp(prefix=prefix)
+    os.environ["HOME"] = home
+    for name, sub in (
+        ("XDG_CONFIG_HOME", ".config"),
+        ("XDG_CACHE_HOME", ".cache"),
+        ("XDG_DATA_HOME", os.path.join(".local", "share")),
+    ):
+        os.environ[name] = os.path.join(home, sub)
+        os.makedirs(os.environ[name], exist_ok=True)
+    return home
+
+
+def remove_sandbox(home):
+    """drop a sandbox made by sandbox()"""
+    shutil.rmtree(home, ignore_errors=True)
+
+
+def timed(func, *args, **kwargs):
+    """(seconds, result)"""
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return time.perf_counter() - start, result
+
+
+def revision():
+    """git commit of the tree being measured, None outside a checkout"""
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=HERE,
+            stderr=subprocess.DEVNULL,
+            text=True,
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def write_results(name, results, out=None):
+    """print the results as JSON, and write them to out if given"""
+    report = {
+        "bench": name,
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "revision": revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "results": results,
+    }
+    text = json.dumps(report, indent=2, sort_keys=True)
+    print(text)
+    if out:
+        with open(out, "w", encoding="utf-8") as outf:
+            outf.write(text + "\n")
+    return report
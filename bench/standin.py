@@ -0,0 +1,242 @@
+"""
+Local stand-in for socwall.com and two fake image providers, replaying the
+fixture pages with configurable latency and error injection
+"""
+
+from __future__ import print_function
+
+import os
+import re
+import sys
+import time
+import random
+import hashlib
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, "..", "src"))
+
+# pylint: disable=wrong-import-position
+import providers
+import session
+import utils
+
+FIXTURES = os.path.join(HERE, "fixtures")
+LISTING_ID = re.compile(rb"/desktop-wallpaper/(\d+)/")
+DOWNLOAD_HREF = re.compile(rb'href="[^"]*"(?= class="download")')
+PAGE = re.compile(r"^/wallpapers/page:(\d+)/$")
+DETAIL = re.compile(r"^/desktop-wallpaper/(\d+)/")
+IMAGE = re.compile(r"^/images/(\d+)\.jpg$")
+FAKE = re.compile(r"^/fake/(\w+)/(page|image)/(\d+)$")
+# ids of one listing page are page * PAGE_STRIDE + position
+PAGE_STRIDE = 1000
+
+
+def read_fixture(name):
+    """bytes of a fixture page"""
+    with open(os.path.join(FIXTURES, name), "rb") as fixturef:
+        return fixturef.read()
+
+
+def jpeg_body(image_id, size):
+    """a complete JPEG of about size bytes, different for every id"""
+    seed = hashlib.sha256(str(image_id).encode("utf-8")).digest()
+    padding = (seed * (size // len(seed) + 1))[: max(size - 64, 0)]
+    body = bytearray(utils.JPEG_START)
+    # comment segments can carry anything, up to 65533 bytes each
+    for start in range(0, len(padding), 65533):
+        chunk = padding[start : start + 65533]
+        body += b"\xff\xfe" + (len(chunk) + 2).to_bytes(2, "big") + chunk
+    # a 1x1 grey baseline frame
+    body += b"\xff\xc0\x00\x0b\x08\x00\x01\x00\x01\x01\x01\x11\x00"
+    return bytes(body + utils.JPEG_END)
+
+
+class StandIn:
+    """
+    Server settings and counters. latency is seconds added to every
+    response, error_rate the share of requests answered with a 503.
+    """
+
+    def __init__(self, pages=50, image_bytes=256 * 1024, latency=0.0, error_rate=0.0):
+        self.pages = pages
+        self.image_bytes = image_bytes
+        self.latency = latency
+        self.error_rate = error_rate
+        self.listing = read_fixture("socwall_listing.html")
+        self.detail = read_fixture("socwall_detail.html")
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+        self.bytes_sent = 0
+        self.server = None
+
+    def listing_page(self, num):
+        """the fixture listing with ids belonging to page num"""
+        position = iter(range(PAGE_STRIDE))
+        return LISTING_ID.sub(
+            lambda match: b"/desktop-wallpaper/%d/"
+            % (num * PAGE_STRIDE + next(position)),
+            self.listing,
+        )
+
+    def detail_page(self, image_id):
+        """the fixture detail page pointing at the image of image_id"""
+        return DOWNLOAD_HREF.sub(
+            b'href="/images/%d.jpg"' % image_id, self.detail, count=1
+        )
+
+    def fake_page(self, name, num):
+        """listing of a fake provider, one image link per line"""
+        return b"".join(
+            b"/fake/%s/image/%d\n" % (name.encode("utf-8"), num * PAGE_STRIDE + i)
+            for i in range(20)
+        )
+
+    def route(self, path):
+        """(status, body) for a request path"""
+        path = re.sub("/+", "/", path)
+        match = PAGE.match(path)
+        if match:
+            num = int(match.group(1))
+            if 1 <= num <= self.pages:
+                return 200, self.listing_page(num)
+            return 404, b"no such page"
+        match = DETAIL.match(path)
+        if match:
+            return 200, self.detail_page(int(match.group(1)))
+        match = IMAGE.match(path)
+        if match:
+            return 200, jpeg_body(int(match.group(1)), self.image_bytes)
+        match = FAKE.match(path)
+        if match:
+            name, kind, num = match.group(1), match.group(2), int(match.group(3))
+            if kind == "page":
+                return 200, self.fake_page(name, num)
+            return 200, jpeg_body(f"{name}-{num}", self.image_bytes)
+        return 404, b"not found"
+
+    def handler(self):
+        """request handler class bound to this server"""
+        standin = self
+
+        class Handler(BaseHTTPRequestHandler):
+            """GET only, ETag revalidation, latency and errors injected"""
+
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):  # pylint: disable=invalid-name
+                """answer one request"""
+                if standin.latency:
+                    time.sleep(standin.latency)
+                with standin.lock:
+                    standin.requests += 1
+                    failing = random.random() < standin.error_rate
+                    if failing:
+                        standin.errors += 1
+                if failing:
+                    status, body = 503, b"try again later"
+                else:
+                    status, body = standin.route(self.path)
+                etag = '"' + hashlib.md5(body).hexdigest() + '"'
+                if status == 200 and self.headers.get("If-None-Match") == etag:
+                    self.send_response(304)
+                    self.send_header("ETag", etag)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                self.send_response(status)
+                self.send_header("Content-Length", str(len(body)))
+                self.send_header("ETag", etag)
+                self.end_headers()
+                self.wfile.write(body)
+                with standin.lock:
+                    standin.bytes_sent += len(body)
+
+            def log_message(self, *_):
+                """quiet"""
+
+        return Handler
+
+    def start(self):
+        """serve on a free local port in a thread, returns the base url"""
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), self.handler())
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self.url
+
+    @property
+    def url(self):
+        """http://127.0.0.1:<port>/"""
+        return f"http://127.0.0.1:{self.server.server_address[1]}/"
+
+    def stop(self):
+        """shut the server down"""
+        self.server.shutdown()
+        self.server.server_close()
+
+    def stats(self):
+        """requests served so far"""
+        with self.lock:
+            return {
+                "requests": self.requests,
+                "errors_injected": self.errors,
+                "bytes_sent": self.bytes_sent,
+            }
+
+
+class FakeProvider(providers.Provider):
+    """provider backed by the stand-in's /fake/<name>/ pages"""
+
+    base_url = ""
+    pages_to_list = 5
+
+    def __init__(self, path):
+        super().__init__(path)
+        self.session = session.get_session(self.base_url + self.name, self.concurrency)
+
+    def pages(self):
+        return list(range(1, self.pages_to_list + 1))
+
+    def list_page(self, page):
+        response = self.session.get(f"{self.base_url}fake/{self.name}/page/{page}")
+        response.raise_for_status()
+        return response.text.split()
+
+    def resolve(self, ref):
+        return self.base_url + ref.lstrip("/")
+
+    def fetch(self, job):
+        dest = os.path.join(self.path, f"{self.name}-{job.rsplit('/', 1)[1]}.jpg")
+        return self.session.download(job, dest, validate=utils.is_complete_jpeg)
+
+
+class FakeAlpha(FakeProvider):
+    """first fake provider"""
+
+    name = "alpha"
+
+
+class FakeBeta(FakeProvider):
+    """second fake provider, slower to start with"""
+
+    name = "beta"
+    concurrency = 2
+    rate = 2.0
+
+
+def register_fakes(base_url):
+    """make the fake providers loadable by name"""
+    FakeProvider.base_url = base_url
+    providers.PROVIDERS["alpha"] = "standin.FakeAlpha"
+    providers.PROVIDERS["beta"] = "standin.FakeBeta"
+
+
+if __name__ == "__main__":
+    SERVER = StandIn()
+    print(f"serving on {SERVER.start()}, ctrl-c to stop")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        SERVER.stop()
@@ -0,0 +1,97 @@
+"""
+Content addressed image store: every picture is kept once under its sha256,
+the galleries hold hardlinks to it (symlinks across file systems)
+"""
+
+import os
+import shutil
+
+import prescale
+
+LINK_SUFFIX = ".link"
+
+
+class BlobStore:
+    """blob directory laid out as <root>/<first two hex digits>/<hash>.jpg"""
+
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def path_of(self, content_hash, ext=".jpg"):
+        """where the blob of some content lives"""
+        return os.path.join(self.root, content_hash[:2], content_hash + ext)
+
+    def link(self, blob, dest):
+        """point dest at blob, atomically replacing whatever dest was"""
+        partial = dest + LINK_SUFFIX
+        if os.path.lexists(partial):
+            os.remove(partial)
+        try:
+            os.link(blob, partial)
+        except OSError:
+            # another file system, or links not allowed there
+            os.symlink(blob, partial)
+        os.replace(partial, dest)
+
+    def is_linked(self, blob, file_path):
+        """True if file_path already is the blob"""
+        try:
+            return os.path.samefile(blob, file_path)
+        except FileNotFoundError:
+            return False
+
+    def ingest(self, file_path, content_hash=None):
+        """
+        Move a gallery file into the store leaving a link in its place. A
+        file with the same content as a stored one just becomes a link to
+        it. Returns the content hash.
+        """
+        content_hash = content_hash or prescale.file_sha256(file_path)
+        blob = self.path_of(content_hash, os.path.splitext(file_path)[1] or ".jpg")
+        if self.is_linked(blob, file_path):
+            return content_hash
+        if os.path.exists(blob):
+            self.link(blob, file_path)
+            return content_hash
+        os.makedirs(os.path.dirname(blob), exist_ok=True)
+        try:
+            # the gallery file itself becomes the blob, nothing is copied
+            os.link(file_path, blob)
+        except OSError:
+            shutil.copy2(file_path, blob + LINK_SUFFIX)
+            os.replace(blob + LINK_SUFFIX, blob)
+            self.link(blob, file_path)
+        return content_hash
+
+    def symlinked(self, directories):
+        """blobs some gallery symlink points at"""
+        targets = set()
+        for directory in directories:
+            try:
+                with os.scandir(directory) as found:
+                    for entry in found:
+                        if entry.is_symlink():
+                            targets.add(os.path.realpath(entry.path))
+            except FileNotFoundError:
+                continue
+        return targets
+
+    def collect(self, directories):
+        """remove blobs no gallery file links to anymore, returns their paths"""
+        kept = self.symlinked(directories)
+        removed = []
+        for prefix in os.listdir(self.root):
+            shard = os.path.join(self.root, prefix)
+            if not os.path.isdir(shard):
+                continue
+            with os.scandir(shard) as found:
+                for entry in found:
+                    if entry.name.endswith(LINK_SUFFIX):
+                        os.remove(entry.path)
+                    elif entry.stat().st_nlink == 1 and (
+                        os.path.realpath(entry.path) not in kept
+                    ):
+                        os.remove(entry.path)
+                        removed.append(entry.path)
+        return removed
@@ -0,0 +1,170 @@
+"""
+Local, incrementally grown catalog of provider image ids
+"""
+
+import time
+import random
+import sqlite3
+import threading
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS pages (
+    page INTEGER PRIMARY KEY,
+    last_seen REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS items (
+    item_id TEXT PRIMARY KEY,
+    page INTEGER NOT NULL,
+    downloaded INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS items_downloaded ON items (downloaded);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL,
+    updated REAL NOT NULL
+);
+"""
+
+# rediscover the number of pages once a week
+PAGE_COUNT_TTL = 7 * 24 * 3600
+# listing pages older than this are listed again when growing the catalog
+PAGE_REFRESH_AGE = 30 * 24 * 3600
+
+
+def discover_page_count(probe, hint):
+    """
+    Last page for which probe(page) is true. Gallops up from hint then
+    bisects, about 2*log2(pages) probes. Raises IOError when page 1 is
+    missing too, probe errors are passed on.
+    """
+    if probe(hint):
+        low, high = hint, hint * 2
+        while probe(high):
+            low, high = high, high * 2
+    elif hint > 1 and probe(1):
+        low, high = 1, hint
+    else:
+        raise IOError("not even the first listing page exists")
+    # probe(low) is true, probe(high) is false
+    while high - low > 1:
+        middle = (low + high) // 2
+        if probe(middle):
+            low = middle
+        else:
+            high = middle
+    return low
+
+
+class Catalog:
+    """page number -> image ids of one provider, with download state"""
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.lock = threading.RLock()
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        with self.lock, self.conn:
+            self.conn.executescript(SCHEMA)
+
+    def close(self):
+        """close the database"""
+        with self.lock:
+            self.conn.close()
+
+    def get_meta(self, key, max_age=None):
+        """stored value, None if missing or older than max_age seconds"""
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT value, updated FROM meta WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None or (max_age is not None and time.time() - row[1] > max_age):
+            return None
+        return row[0]
+
+    def set_meta(self, key, value):
+        """store a value"""
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO meta (key, value, updated) VALUES (?, ?, ?)",
+                (key, str(value), time.time()),
+            )
+
+    def page_count(self, probe, hint, errors=(OSError,)):
+        """
+        cached number of listing pages, probing for it when stale. When the
+        probes fail with one of errors the last known count, or hint, is
+        used for now and nothing is stored.
+        """
+        cached = self.get_meta("page_count", PAGE_COUNT_TTL)
+        if cached is not None:
+            return int(cached)
+        previous = self.get_meta("page_count")
+        known = int(previous) if previous else hint
+        try:
+            count = discover_page_count(probe, known)
+        except errors:
+            return known
+        self.set_meta("page_count", count)
+        return count
+
+    def add_page(self, page, item_ids):
+        """record the ids found on a listing page"""
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO pages (page, last_seen) VALUES (?, ?)",
+                (page, time.time()),
+            )
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO items (item_id, page) VALUES (?, ?)",
+                [(item_id, page) for item_id in item_ids],
+            )
+
+    def is_downloaded(self, item_id):
+        """True if the item was downloaded before"""
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT downloaded FROM items WHERE item_id = ?", (item_id,)
+            ).fetchone()
+        return bool(row and row[0])
+
+    def mark_downloaded(self, item_id, page=0):
+        """flag an item as downloaded"""
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT OR IGNORE INTO items (item_id, page) VALUES (?, ?)",
+                (item_id, page),
+            )
+            self.conn.execute(
+                "UPDATE items SET downloaded = 1 WHERE item_id = ?", (item_id,)
+            )
+
+    def sample_unseen(self, count):
+        """up to count random ids not downloaded yet"""
+        with self.lock:
+            return [
+                row[0]
+                for row in self.conn.execute(
+                    "SELECT item_id FROM items WHERE downloaded = 0"
+                    " ORDER BY random() LIMIT ?",
+                    (count,),
+                )
+            ]
+
+    def listed_pages(self, max_age=None):
+        """pages listed, only the ones fresher than max_age seconds if given"""
+        query = "SELECT page FROM pages"
+        params = ()
+        if max_age is not None:
+            query += " WHERE last_seen >= ?"
+            params = (time.time() - max_age,)
+        with self.lock:
+            return {row[0] for row in self.conn.execute(query, params)}
+
+    def pages_to_list(self, page_count):
+        """random unlisted pages first, then the stale ones"""
+        listed = self.listed_pages()
+        fresh = self.listed_pages(PAGE_REFRESH_AGE)
+        unlisted = [p for p in range(1, page_count + 1) if p not in listed]
+        stale = [p for p in listed if p not in fresh and p <= page_count]
+        random.shuffle(unlisted)
+        random.shuffle(stale)
+        return unlisted + stale
@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+"""
+Command line entry point: set-next, refill, evict, status, dedupe, keep, gui.
+
+Only what a subcommand needs gets imported, a cron run of set-next with a
+filled ready queue never loads the providers, HTTP, Pillow or Tk.
+"""
+
+from __future__ import print_function
+
+import os
+import sys
+import json
+import argparse
+
+import metrics
+
+# pylint: disable=import-outside-toplevel
+
+
+def cmd_set_next(args):
+    """set the next wallpaper, refill in the background when the queue runs low"""
+    import wallpaper
+
+    wm = wallpaper.Wallpaper()
+    wm.rotate()
+    if args.no_refill:
+        return 0
+    if wm.needs_refill():
+        import refill
+
+        refill.request_refill(wm.conf.config_dir)
+    return 0
+
+
+def cmd_refill(args):
+    """refill the gallery and the ready queue"""
+    import refill
+
+    if args.background:
+        import config
+
+        refill.request_refill(config.Config().config_dir)
+        return 0
+    import wallpaper
+
+    wm = wallpaper.Wallpaper()
+    refill.mark_pending(wm.conf.config_dir)
+    if not refill.refill_locked(wm):
+        print("A refill is already running, it will pick this request up")
+    return 0
+
+
+def cmd_evict(args):
+    """trim the download folder"""
+    import wallpaper
+
+    wm = wallpaper.Wallpaper()
+    if args.used:
+        wm.remove_used()
+    if args.max_bytes is None and args.max_files is None:
+        removed = wm.enforce_budget()
+    else:
+        removed = wm.evict(args.max_bytes, args.max_files, args.policy)
+    print(f"Removed {len(removed)} images")
+    return 0
+
+
+def cmd_status(_args):
+    """gallery, queue and background job state as JSON"""
+    import config
+    import daemon
+    import gallery
+    import refill
+    import readyqueue
+
+    conf = config.Config()
+    index = gallery.GalleryIndex(conf.index_file_name)
+    ready = readyqueue.ReadyQueue(conf.ready_queue_file_name)
+    status = {
+        "config_dir": conf.config_dir,
+        "unused_images": index.count(used=False),
+        "used_images": index.count(used=True),
+        "downloaded": index.count(directory=conf.wallpaper_dir),
+        "static": index.count(directory=conf.wallpaper_static_dir),
+        "ready": len(ready),
+        "refill_running": refill.is_running(conf.config_dir),
+        "daemon_socket": os.path.exists(
+            os.path.join(conf.config_dir, daemon.SOCKET_NAME)
+        ),
+    }
+    index.close()
+    print(json.dumps(status, indent=2))
+    return 0
+
+
+def cmd_dedupe(args):
+    """remove downloaded near duplicates"""
+    import wallpaper
+
+    removed = wallpaper.Wallpaper().remove_duplicates(args.distance)
+    print(f"Removed {len(removed)} duplicates")
+    return 0
+
+
+def cmd_keep(args):
+    """keep images forever, or stop keeping them"""
+    import wallpaper
+
+    wm = wallpaper.Wallpaper()
+    for image_path in args.paths:
+        wm.keep_forever(os.path.abspath(image_path), not args.undo)
+    return 0
+
+
+def cmd_gui(_args):
+    """configuration window"""
+    import tkinter as tk
+    import configwindow
+
+    root = tk.Tk()
+    configwindow.ConfigWindow(master=root).mainloop()
+    return 0
+
+
+def parser():
+    """argument parser with every subcommand"""
+    main_parser = argparse.ArgumentParser(prog="wallpaper", description=__doc__)
+    commands = main_parser.add_subparsers(dest="command", required=True)
+
+    set_next = commands.add_parser("set-next", help=cmd_set_next.__doc__)
+    set_next.add_argument(
+        "--no-refill", action="store_true", help="never start a background refill"
+    )
+    set_next.set_defaults(func=cmd_set_next)
+
+    refill = commands.add_parser("refill", help=cmd_refill.__doc__)
+    refill.add_argument(
+        "--background", action="store_true", help="detach and return at once"
+    )
+    refill.set_defaults(func=cmd_refill)
+
+    evict = commands.add_parser("evict", help=cmd_evict.__doc__)
+    evict.add_argument(
+        "--max-bytes", type=int, help="disk budget, default as configured"
+    )
+    evict.add_argument(
+        "--max-files", type=int, help="file budget, default as configured"
+    )
+    evict.add_argument(
+        "--policy",
+        choices=["lru", "fifo", "largest"],
+        help="what goes first, default as configured",
+    )
+    evict.add_argument("--used", action="store_true", help="remove the used images first")
+    evict.set_defaults(func=cmd_evict)
+
+    status = commands.add_parser("status", help=cmd_status.__doc__)
+    status.set_defaults(func=cmd_status)
+
+    dedupe = commands.add_parser("dedupe", help=cmd_dedupe.__doc__)
+    dedupe.add_argument("--distance", type=int, help="hash bits that may differ")
+    dedupe.set_defaults(func=cmd_dedupe)
+
+    keep = commands.add_parser("keep", help=cmd_keep.__doc__)
+    keep.add_argument("paths", nargs="+")
+    keep.add_argument("--undo", action="store_true", help="stop keeping them")
+    keep.set_defaults(func=cmd_keep)
+
+    gui = commands.add_parser("gui", help=cmd_gui.__doc__)
+    gui.set_defaults(func=cmd_gui)
+    return main_parser
+
+
+def main(argv=None):
+    """run a subcommand, returns the exit status"""
+    args = parser().parse_args(argv)
+    try:
+        return args.func(args)
+    finally:
+        metrics.export()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
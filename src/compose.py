@@ -0,0 +1,80 @@
+"""
+One spanned image out of an image per monitor, for desktops that cannot
+set a wallpaper per monitor. Tiles are cropped and scaled in a process
+pool, the composite is cached by its sources and the monitor layout.
+"""
+
+import os
+import hashlib
+from concurrent import futures
+
+import prescale
+import monitors
+
+SPAN_QUALITY = 90
+DEFAULT_MAX_BYTES = 128 * 1024 * 1024
+
+
+def span_key(tiles):
+    """name of the composite of [(path, monitor)], one per source version"""
+    digest = hashlib.sha1()
+    for file_path, monitor in tiles:
+        try:
+            mtime = os.stat(file_path).st_mtime
+        except FileNotFoundError:
+            mtime = None
+        geometry = "{width}x{height}+{x}+{y}".format(**monitor)
+        digest.update(f"{file_path}\0{mtime}\0{geometry}\n".encode("utf-8"))
+    return digest.hexdigest()
+
+
+def make_tile(file_path, size):
+    """Worker: (size, raw RGB bytes) of the image covering size"""
+    from PIL import Image, ImageOps  # pylint: disable=import-outside-toplevel
+
+    with Image.open(file_path) as original:
+        rotated = original.getexif().get(0x0112, 1) in (5, 6, 7, 8)
+        width, height = original.size
+        if rotated:
+            width, height = height, width
+        need = prescale.cover_size(width, height, size)
+        # a prescaled variant is decoded as is, a big original at a fraction
+        original.draft("RGB", (need[1], need[0]) if rotated else need)
+        image = ImageOps.exif_transpose(original).convert("RGB")
+        if image.size != tuple(size):
+            image = prescale.cover(image, size)
+        return image.size, image.tobytes()
+
+
+def compose(tiles, cache_dir, max_bytes=DEFAULT_MAX_BYTES, workers=None):
+    """
+    tiles is a list of (path, monitor), monitors as in monitors.py. Returns
+    the path of the composite, made unless it is cached already.
+    """
+    from PIL import Image  # pylint: disable=import-outside-toplevel
+
+    os.makedirs(cache_dir, exist_ok=True)
+    target = os.path.join(cache_dir, span_key(tiles) + ".jpg")
+    try:
+        os.utime(target)
+        return target
+    except OSError:
+        pass
+    left, top, width, height = monitors.span_box([m for _, m in tiles])
+    canvas = Image.new("RGB", (width, height))
+    with futures.ProcessPoolExecutor(workers or len(tiles)) as executor:
+        made = executor.map(
+            make_tile,
+            [file_path for file_path, _ in tiles],
+            [(monitor["width"], monitor["height"]) for _, monitor in tiles],
+        )
+        for (_, monitor), (size, data) in zip(tiles, made):
+            canvas.paste(
+                Image.frombytes("RGB", size, data),
+                (monitor["x"] - left, monitor["y"] - top),
+            )
+    partial = target + ".part"
+    canvas.save(partial, "JPEG", quality=SPAN_QUALITY)
+    os.replace(partial, target)
+    prescale.evict(cache_dir, max_bytes)
+    return target
@@ -4,12 +4,39 @@ Deal with configuration file and variables
 
 
 import os
+import functools
 import desktops
-from xdg import BaseDirectory
 
 
 DEFAULT_GALLERY_SIZE = 20
+# never keep more than this in the download folder
+DEFAULT_GALLERY_MAX_FILES = 5 * DEFAULT_GALLERY_SIZE
+DEFAULT_GALLERY_BYTES = 1024 * 1024 * 1024
+DEFAULT_EVICTION_POLICY = "lru"
+# seconds between two wallpapers in daemon mode
+DEFAULT_ROTATION_INTERVAL = 300
+# image providers a refill downloads from, see providers.PROVIDERS
+DEFAULT_PROVIDERS = ["socwall"]
+# "random" among unseen images, or "fit" to prefer the ones matching the screen
+DEFAULT_SELECTION = "random"
+# display sized copies of the wallpapers, see prescale.py
+DEFAULT_VARIANT_CACHE_BYTES = 256 * 1024 * 1024
+# gallery browser thumbnails, see thumbnails.py
+DEFAULT_THUMBNAIL_CACHE_BYTES = 64 * 1024 * 1024
+# spanned multi monitor images, see compose.py
+DEFAULT_SPAN_CACHE_BYTES = 128 * 1024 * 1024
+# wallpapers picked and prescaled ahead, refilled below the low mark
+DEFAULT_READY_QUEUE_SIZE = 5
+DEFAULT_READY_QUEUE_LOW = 2
+# perceptual hash bits two images may differ by and still be the same picture
+DEFAULT_DEDUP_DISTANCE = 6
 APP_NAME = "wallpaper"
+DESKTOP_CACHE = "desktop.json"
+
+
+def lazy(getter_name):
+    """attribute computed by the named getter on first use, then kept"""
+    return functools.cached_property(lambda self: getattr(self, getter_name)())
 
 
 def get_default_home_dir():
@@ -24,20 +51,59 @@ class Config:
     """deal with configuration"""
 
     gallery_size = DEFAULT_GALLERY_SIZE
-    home_dir = ""
-    config_dir = ""
-    wallpaper_dir = ""
-    wallpaper_static_dir = ""
-    desktop_env = ""
-    logfile_name = ""
-
-    def __init__(self):
-        self.home_dir = get_default_home_dir()
-        self.config_dir = self.get_config_dir()
-        self.wallpaper_dir = self.get_wallpaper_dir()
-        self.wallpaper_static_dir = self.get_wallpaper_static_dir()
-        self.desktop_env = desktops.get_desktop_env()
-        self.logfile_name = self.get_logfile_name()
+    gallery_max_files = DEFAULT_GALLERY_MAX_FILES
+    gallery_bytes = DEFAULT_GALLERY_BYTES
+    eviction_policy = DEFAULT_EVICTION_POLICY
+    rotation_interval = DEFAULT_ROTATION_INTERVAL
+    providers = DEFAULT_PROVIDERS
+    selection = DEFAULT_SELECTION
+    # "WxH" to skip monitor detection in "fit" selection and prescaling
+    screen_size = ""
+    # a different image on every monitor, set per monitor or spanned
+    multi_monitor = False
+    # "WxH+X+Y,WxH+X+Y" to skip monitor detection, the first one is primary
+    monitor_layout = ""
+    span_cache_bytes = DEFAULT_SPAN_CACHE_BYTES
+    prescale = True
+    variant_cache_bytes = DEFAULT_VARIANT_CACHE_BYTES
+    thumbnail_cache_bytes = DEFAULT_THUMBNAIL_CACHE_BYTES
+    ready_queue_size = DEFAULT_READY_QUEUE_SIZE
+    ready_queue_low = DEFAULT_READY_QUEUE_LOW
+    # reject downloads that look like an image we have, needs Pillow
+    dedup = True
+    dedup_distance = DEFAULT_DEDUP_DISTANCE
+    # keep every picture once in blob_dir, the galleries only hold links to it
+    blob_store = False
+    # span timers and counters exported to the config dir, see metrics.py;
+    # WALLPAPER_METRICS=1 in the environment turns them on as well
+    metrics = False
+
+    # paths and the desktop are only worked out (and folders made) when used,
+    # a run that never touches a folder does not pay for it
+    home_dir = lazy("get_home_dir")
+    config_dir = lazy("get_config_dir")
+    cache_dir = lazy("get_cache_dir")
+    variant_dir = lazy("get_variant_dir")
+    thumbnail_dir = lazy("get_thumbnail_dir")
+    span_dir = lazy("get_span_dir")
+    blob_dir = lazy("get_blob_dir")
+    wallpaper_dir = lazy("get_wallpaper_dir")
+    wallpaper_static_dir = lazy("get_wallpaper_static_dir")
+    # not kept, an unknown desktop is looked for again until it is up
+    desktop_env = property(lambda self: self.get_desktop_env())
+    logfile_name = lazy("get_logfile_name")
+    index_file_name = lazy("get_index_file_name")
+    history_file_name = lazy("get_history_file_name")
+    ready_queue_file_name = lazy("get_ready_queue_file_name")
+    picture_options_file_name = lazy("get_picture_options_file_name")
+
+    def get_home_dir(self):
+        """Home dir for all platforms"""
+        return get_default_home_dir()
+
+    def get_desktop_env(self):
+        """Detected desktop, cached in the config dir for the session"""
+        return desktops.get_desktop_env(os.path.join(self.config_dir, DESKTOP_CACHE))
 
     def get_config_dir(self, app_name=APP_NAME):
         """Use XDG standard config, THIS METHOD HAS TO BE CALLED AFTER get_home_dir"""
@@ -47,6 +113,9 @@ class Config:
             confighome = os.environ["APPDATA"]
         else:
             try:
+                # pylint: disable=import-outside-toplevel
+                from xdg import BaseDirectory
+
                 confighome = BaseDirectory.xdg_config_home
             except ImportError:  # Most likely a Linux/Unix system anyway
                 confighome = os.path.join(self.home_dir, ".config")
@@ -55,6 +124,34 @@ class Config:
             os.mkdir(configdir)
         return configdir
 
+    def get_cache_dir(self, app_name=APP_NAME):
+        """XDG cache dir, for things that can be thrown away"""
+        cachehome = os.environ.get("XDG_CACHE_HOME") or os.path.join(
+            self.home_dir, ".cache"
+        )
+        cachedir = os.path.join(cachehome, app_name)
+        os.makedirs(cachedir, exist_ok=True)
+        return cachedir
+
+    def get_variant_dir(self):
+        """prescaled copies, see prescale.py"""
+        return os.path.join(self.cache_dir, "variants")
+
+    def get_thumbnail_dir(self):
+        """gallery browser thumbnails, see thumbnails.py"""
+        return os.path.join(self.cache_dir, "thumbnails")
+
+    def get_span_dir(self):
+        """spanned multi monitor images, see compose.py"""
+        return os.path.join(self.cache_dir, "spans")
+
+    def get_blob_dir(self, app_name=APP_NAME):
+        """XDG data dir for the blob store, usually on the same disk as home"""
+        datahome = os.environ.get("XDG_DATA_HOME") or os.path.join(
+            self.home_dir, ".local", "share"
+        )
+        return os.path.join(datahome, app_name, "blobs")
+
     def get_wallpaper_dir(self):
         """Images are saved in a visible folder for the user"""
         wallpaper_dir = os.path.join(self.home_dir, "Wallpapers")
@@ -70,12 +167,21 @@ class Config:
         return wallpaper_dir
 
     def get_logfile_name(self):
-        """Name of log file"""
-        ldir = self.config_dir
-        if not os.path.exists(ldir):
-            os.mkdir(ldir)
-        logname = ldir + "/used_images.log"
-        if not os.path.exists(logname):
-            with open(logname, "a+", encoding="utf-8"):
-                pass
-        return logname
+        """Name of the old used images log, imported into the history"""
+        return os.path.join(self.config_dir, "used_images.log")
+
+    def get_index_file_name(self):
+        """Name of the gallery index database"""
+        return os.path.join(self.config_dir, "gallery.db")
+
+    def get_history_file_name(self):
+        """Name of the used images history database"""
+        return os.path.join(self.config_dir, "history.db")
+
+    def get_ready_queue_file_name(self):
+        """Name of the next wallpapers queue"""
+        return os.path.join(self.config_dir, "ready.json")
+
+    def get_picture_options_file_name(self):
+        """Name of the desktop picture-options saved while spanning"""
+        return os.path.join(self.config_dir, "picture-options.json")
@@ -1,13 +1,18 @@
 #!/usr/bin/env python3
 """
-draw the configuration window that writes the conf
+draw the configuration window that writes the conf, with a gallery browser
 """
 
 
+import os
 import sys
+import threading
 import tkinter as tk
-from tkinter import filedialog
+from tkinter import filedialog, messagebox
 import config as cfg
+import gallery
+import thumbnails
+import wallpaper
 
 
 # pylint: disable=too-many-ancestors
@@ -24,10 +29,9 @@ class ConfigWindow(tk.Frame):
             # Python 3
             super().__init__(master)
 
-        self.pack()
+        self.pack(fill=tk.BOTH, expand=True)
         self.master.title("Wallpaper Configuration")
-        self.master.geometry("660x190")
-        self.master.resizable(0, 0)
+        self.master.geometry("900x720")
         self.config = cfg.Config()
         self.create_widgets()
 
@@ -75,6 +79,11 @@ class ConfigWindow(tk.Frame):
         )
         self.save.grid(row=3, columnspan=2, sticky=tk.E)
 
+        self.browser = GalleryBrowser(self, wallpaper.Wallpaper())
+        self.browser.grid(row=4, columnspan=2, sticky=tk.NSEW)
+        self.rowconfigure(4, weight=1)
+        self.columnconfigure(1, weight=1)
+
     def save_func(self):
         """save changes to config file"""
         # TODO: salvar
@@ -84,7 +93,7 @@ class ConfigWindow(tk.Frame):
         # TODO: check if folder exists
         print(folder)
         # TODO: actually save the settings
-        ROOT.destroy()
+        self.master.destroy()
 
     def size_callback(self, _):
         """set the value for the size"""
@@ -93,6 +102,255 @@ class ConfigWindow(tk.Frame):
         self.entry_gallery_folder.insert(0, directory)
 
 
+class GalleryBrowser(tk.Frame):
+    """
+    Thumbnail grid of the whole gallery. Only the rows in view get canvas
+    items, their thumbnails come from the cache or the worker pool, so the
+    grid opens at once whatever the gallery size.
+    """
+
+    cell_width = thumbnails.THUMBNAIL_SIZE[0] + 16
+    cell_height = thumbnails.THUMBNAIL_SIZE[1] + 28
+    poll_ms = 50
+
+    def __init__(self, master, wm):
+        super().__init__(master)
+        self.wm = wm
+        self.thumbs = thumbnails.Thumbnailer(
+            wm.conf.thumbnail_dir, wm.conf.thumbnail_cache_bytes
+        )
+        # (path, mtime, static, keep, used) in grid order
+        self.rows = []
+        self.position = {}
+        self.columns = 1
+        # grid position -> canvas items and PhotoImage of the drawn cells
+        self.drawn = {}
+        self.selected = None
+        self.synced = threading.Event()
+
+        self.canvas = tk.Canvas(self, highlightthickness=0, background="gray20")
+        self.scrollbar = tk.Scrollbar(
+            self, orient=tk.VERTICAL, command=self.canvas.yview
+        )
+        self.canvas.configure(yscrollcommand=self.on_scroll)
+        self.canvas.grid(row=0, column=0, sticky=tk.NSEW)
+        self.scrollbar.grid(row=0, column=1, sticky=tk.NS)
+        self.rowconfigure(0, weight=1)
+        self.columnconfigure(0, weight=1)
+
+        actions = tk.Frame(self)
+        actions.grid(row=1, columnspan=2, sticky=tk.EW)
+        tk.Button(actions, text="Favourite", command=self.favourite).pack(side=tk.LEFT)
+        tk.Button(actions, text="Ban", command=self.ban).pack(side=tk.LEFT)
+        tk.Button(actions, text="Delete", command=self.delete).pack(side=tk.LEFT)
+        self.status = tk.Label(actions, anchor=tk.W)
+        self.status.pack(side=tk.LEFT, fill=tk.X, expand=True)
+
+        self.canvas.bind("<Configure>", self.on_resize)
+        self.canvas.bind("<Button-1>", self.on_click)
+        self.canvas.bind("<MouseWheel>", self.on_wheel)
+        self.canvas.bind("<Button-4>", lambda _: self.canvas.yview_scroll(-1, "units"))
+        self.canvas.bind("<Button-5>", lambda _: self.canvas.yview_scroll(1, "units"))
+        self.bind("<Destroy>", self.on_destroy)
+
+        self.load_rows()
+        # the index may be behind the folders, catch up without blocking Tk
+        threading.Thread(target=self.sync, daemon=True).start()
+        self.after(self.poll_ms, self.poll)
+
+    def sync(self):
+        """background thread: rescan changed folders with its own connection"""
+        index = gallery.GalleryIndex(self.wm.conf.index_file_name)
+        try:
+            if index.reconcile(self.wm.gallery_dirs(), lambda: self.wm.history):
+                self.synced.set()
+        finally:
+            index.close()
+
+    def load_rows(self):
+        """read the grid from the index and draw it from the top"""
+        self.rows = self.wm.index.browse()
+        self.position = {row[0]: i for i, row in enumerate(self.rows)}
+        if self.selected not in self.position:
+            self.selected = None
+        self.relayout()
+
+    def relayout(self):
+        """new column count or rows, drop every cell and draw the visible ones"""
+        self.canvas.delete("cell")
+        self.drawn.clear()
+        width = max(self.canvas.winfo_width(), self.cell_width)
+        self.columns = max(width // self.cell_width, 1)
+        lines = -(-len(self.rows) // self.columns)
+        self.canvas.configure(scrollregion=(0, 0, width, lines * self.cell_height))
+        self.canvas.configure(yscrollincrement=self.cell_height // 4)
+        self.draw_visible()
+        self.show_status()
+
+    def visible(self):
+        """grid positions of the rows in view"""
+        lines = -(-len(self.rows) // self.columns)
+        total = lines * self.cell_height
+        top, bottom = self.canvas.yview()
+        first = int(top * total) // self.cell_height
+        last = min(-(-int(bottom * total) // self.cell_height), lines)
+        return range(
+            first * self.columns, min(last * self.columns, len(self.rows))
+        )
+
+    def draw_visible(self):
+        """create the cells scrolled into view, drop the ones scrolled out"""
+        wanted = self.visible()
+        for i in [i for i in self.drawn if i not in wanted]:
+            self.canvas.delete(*self.drawn.pop(i)[0])
+        for i in wanted:
+            if i not in self.drawn:
+                self.draw_cell(i)
+        self.thumbs.forget({self.rows[i][0] for i in wanted})
+
+    def draw_cell(self, i, thumbnail=None):
+        """one grid cell: thumbnail or placeholder, name and flags"""
+        if i in self.drawn:
+            self.canvas.delete(*self.drawn.pop(i)[0])
+        path, mtime, static, keep, used = self.rows[i]
+        left = (i % self.columns) * self.cell_width
+        top = (i // self.columns) * self.cell_height
+        thumb_width, thumb_height = thumbnails.THUMBNAIL_SIZE
+        center = (left + self.cell_width // 2, top + 8 + thumb_height // 2)
+        outline = "yellow" if path == self.selected else "gray40"
+        items = [
+            self.canvas.create_rectangle(
+                left + 4,
+                top + 4,
+                left + self.cell_width - 4,
+                top + self.cell_height - 4,
+                outline=outline,
+                width=2,
+                tags="cell",
+            )
+        ]
+        image = None
+        thumbnail = thumbnail or self.thumbs.request(path, mtime)
+        if thumbnail:
+            try:
+                image = tk.PhotoImage(file=thumbnail)
+            except tk.TclError:  # evicted meanwhile, or not a PNG Tk reads
+                image = None
+        if image is not None:
+            items.append(self.canvas.create_image(*center, image=image, tags="cell"))
+        else:
+            items.append(
+                self.canvas.create_text(
+                    *center, text="...", fill="gray60", tags="cell"
+                )
+            )
+        flags = ("static " if static else "") + ("kept " if keep else "")
+        flags += "seen" if used else ""
+        name = os.path.basename(path)
+        if len(name) > 22:
+            name = name[:10] + "..." + name[-9:]
+        items.append(
+            self.canvas.create_text(
+                left + self.cell_width // 2,
+                top + thumb_height + 18,
+                text=f"{name} {flags}".strip(),
+                fill="white",
+                font=("Helvetica", 8),
+                tags="cell",
+            )
+        )
+        self.drawn[i] = (items, image)
+
+    def poll(self):
+        """Tk timer: put finished thumbnails in place, pick up a rescan"""
+        for path, thumbnail in self.thumbs.finished():
+            i = self.position.get(path)
+            if i is not None and i in self.drawn and thumbnail:
+                self.draw_cell(i, thumbnail)
+        if self.synced.is_set():
+            self.synced.clear()
+            self.load_rows()
+        self.after(self.poll_ms, self.poll)
+
+    def show_status(self):
+        """row count and the selected image"""
+        text = f"{len(self.rows)} images"
+        if self.selected:
+            text += f" - {self.selected}"
+        self.status.configure(text=text)
+
+    def on_scroll(self, first, last):
+        """yscrollcommand: move the scrollbar, draw what came into view"""
+        self.scrollbar.set(first, last)
+        self.draw_visible()
+
+    def on_resize(self, event):
+        """a new width may fit another column count"""
+        if max(event.width, self.cell_width) // self.cell_width != self.columns:
+            self.relayout()
+        else:
+            self.draw_visible()
+
+    def on_wheel(self, event):
+        """Windows and macOS wheel, X11 sends buttons 4 and 5"""
+        self.canvas.yview_scroll(-1 if event.delta > 0 else 1, "units")
+
+    def on_click(self, event):
+        """select the image under the pointer"""
+        column = int(self.canvas.canvasx(event.x)) // self.cell_width
+        i = int(self.canvas.canvasy(event.y)) // self.cell_height * self.columns
+        i += column
+        if column >= self.columns or i >= len(self.rows):
+            return
+        previous = self.position.get(self.selected)
+        self.selected = self.rows[i][0]
+        for j in (previous, i):
+            if j is not None and j in self.drawn:
+                self.draw_cell(j)
+        self.show_status()
+
+    def update_row(self, path, **changes):
+        """reflect an action on one row without reloading the grid"""
+        i = self.position[path]
+        row = dict(zip(("path", "mtime", "static", "keep", "used"), self.rows[i]))
+        row.update(changes)
+        self.rows[i] = tuple(row.values())
+        if i in self.drawn:
+            self.draw_cell(i)
+
+    def favourite(self):
+        """keep the selected image forever, or stop keeping it"""
+        if self.selected is None:
+            return
+        _, _, static, keep, _ = self.rows[self.position[self.selected]]
+        if static:
+            return
+        self.wm.keep_forever(self.selected, not keep)
+        self.update_row(self.selected, keep=int(not keep))
+
+    def ban(self):
+        """never show the selected image again"""
+        if self.selected is None:
+            return
+        self.wm.ban(self.selected)
+        self.update_row(self.selected, keep=0, used=1)
+
+    def delete(self):
+        """remove the selected image from disk"""
+        if self.selected is None:
+            return
+        if not messagebox.askyesno("Delete", f"Delete {self.selected}?", parent=self):
+            return
+        self.wm.delete_image(self.selected)
+        self.selected = None
+        self.load_rows()
+
+    def on_destroy(self, event):
+        """stop the thumbnail workers with the window"""
+        if event.widget is self:
+            self.thumbs.close()
+
+
 if __name__ == "__main__":
     ROOT = tk.Tk()
     APP = ConfigWindow(master=ROOT)
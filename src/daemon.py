@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+"""
+Resident rotation daemon, an alternative to running wallpaper.py from cron.
+
+Keeps config, desktop backend, gallery index and HTTP pool warm, rotates on
+an internal schedule, refills the gallery in the background and listens on
+a unix socket in the config dir for next, pause, resume, status and stop.
+"""
+
+from __future__ import print_function
+
+import os
+import sys
+import json
+import time
+import socket
+import threading
+import socketserver
+
+import wallpaper
+import refill
+import metrics
+
+SOCKET_NAME = "daemon.sock"
+COMMANDS = ("next", "pause", "resume", "status", "stop")
+
+
+class RotationDaemon:
+    """scheduler around a warm Wallpaper instance"""
+
+    def __init__(self, interval=None):
+        self.wm = wallpaper.Wallpaper()
+        self.interval = interval or self.wm.conf.rotation_interval
+        self.paused = False
+        self.current = None
+        self.last_rotation = 0.0
+        self.next_rotation = time.time()
+        self.wakeup = threading.Event()
+        self.stopping = threading.Event()
+        self.rotate_lock = threading.Lock()
+        self.refill_lock = threading.Lock()
+        self.refilling = False
+        self.server = None
+
+    def rotate(self):
+        """set the head of the ready queue, refill in the background when it runs low"""
+        with self.rotate_lock:
+            self.current = self.wm.rotate() or self.current
+            self.last_rotation = time.time()
+            self.next_rotation = self.last_rotation + self.interval
+        if self.wm.needs_refill():
+            self.refill()
+        metrics.export()
+
+    def refill(self):
+        """start a gallery refill unless one is already running"""
+        with self.refill_lock:
+            if self.refilling:
+                return False
+            self.refilling = True
+        threading.Thread(target=self.run_refill, daemon=True).start()
+        return True
+
+    def run_refill(self):
+        """background thread body"""
+        try:
+            # shares the cross process lock with cron triggered refills
+            refill.mark_pending(self.wm.conf.config_dir)
+            refill.refill_locked(self.wm)
+        except (OSError, ValueError, IndexError) as error:
+            print(f"Refill failed: {error}")
+        finally:
+            metrics.export()
+            with self.refill_lock:
+                self.refilling = False
+
+    def status(self):
+        """what the daemon is doing"""
+        return {
+            "pid": os.getpid(),
+            "paused": self.paused,
+            "interval": self.interval,
+            "current": self.current,
+            "last_rotation": self.last_rotation,
+            "next_rotation": None if self.paused else self.next_rotation,
+            "refilling": self.refilling,
+            "unused_images": self.wm.index.count(used=False),
+            "ready": len(self.wm.ready),
+        }
+
+    def handle(self, command):
+        """run one control command, returns the reply"""
+        if command == "next":
+            self.next_rotation = time.time()
+            self.wakeup.set()
+            return {"ok": True}
+        if command == "pause":
+            self.paused = True
+            return {"ok": True}
+        if command == "resume":
+            self.paused = False
+            self.next_rotation = max(self.next_rotation, time.time())
+            self.wakeup.set()
+            return {"ok": True}
+        if command == "status":
+            return self.status()
+        if command == "stop":
+            self.stop()
+            return {"ok": True}
+        return {"ok": False, "error": f"unknown command {command}"}
+
+    def serve_control(self, socket_path):
+        """answer control commands on a unix socket"""
+        daemon = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            """one command per line, one json reply per line"""
+
+            def handle(self):
+                for line in self.rfile:
+                    reply = daemon.handle(line.decode("utf-8").strip())
+                    self.wfile.write((json.dumps(reply) + "\n").encode("utf-8"))
+
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        self.server = socketserver.ThreadingUnixStreamServer(socket_path, Handler)
+        self.server.daemon_threads = True
+        os.chmod(socket_path, 0o600)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def stop(self):
+        """leave the main loop"""
+        self.stopping.set()
+        self.wakeup.set()
+
+    def run(self):
+        """main loop: sleep until the next rotation or a command"""
+        socket_path = os.path.join(self.wm.conf.config_dir, SOCKET_NAME)
+        self.serve_control(socket_path)
+        try:
+            while not self.stopping.is_set():
+                if not self.paused and time.time() >= self.next_rotation:
+                    try:
+                        self.rotate()
+                    except (OSError, ValueError, IndexError) as error:
+                        print(f"Rotation failed: {error}")
+                        self.next_rotation = time.time() + self.interval
+                timeout = None if self.paused else max(self.next_rotation - time.time(), 0)
+                self.wakeup.wait(timeout)
+                self.wakeup.clear()
+        finally:
+            self.server.shutdown()
+            self.server.server_close()
+            os.remove(socket_path)
+
+
+def send(command, config_dir):
+    """send a command to a running daemon, returns its reply"""
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        client.connect(os.path.join(config_dir, SOCKET_NAME))
+        client.sendall((command + "\n").encode("utf-8"))
+        with client.makefile("r", encoding="utf-8") as reply:
+            return json.loads(reply.readline())
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] in COMMANDS:
+        import config
+
+        print(json.dumps(send(sys.argv[1], config.Config().config_dir), indent=2))
+    else:
+        INTERVAL = int(sys.argv[1]) if len(sys.argv) > 1 else None
+        RotationDaemon(INTERVAL).run()
@@ -0,0 +1,184 @@
+"""
+Near duplicate detection with a perceptual hash (dHash) of every image and a
+multi-index hash table for the Hamming distance lookups
+"""
+
+import itertools
+import threading
+from concurrent import futures
+
+HASH_SIZE = 8
+# hashes this many bits apart or closer are the same picture
+DEFAULT_DISTANCE = 6
+
+
+class DuplicateImage(ValueError):
+    """a download turned out to be a picture we already have"""
+
+
+def available():
+    """True if Pillow is installed"""
+    try:
+        import PIL  # pylint: disable=import-outside-toplevel,unused-import
+    except ImportError:
+        return False
+    return True
+
+
+def dhash(file_path, hash_size=HASH_SIZE):
+    """
+    64 bit difference hash: shrink to 9x8 grey pixels and compare every
+    pixel with its right neighbour
+    """
+    from PIL import Image  # pylint: disable=import-outside-toplevel
+
+    with Image.open(file_path) as image:
+        # the JPEG decoder can skip almost all pixels
+        image.draft("L", (hash_size * 8, hash_size * 8))
+        small = image.convert("L").resize((hash_size + 1, hash_size), Image.BILINEAR)
+        pixels = list(small.getdata())
+    value = 0
+    for row in range(hash_size):
+        for col in range(hash_size):
+            left = pixels[row * (hash_size + 1) + col]
+            value = (value << 1) | (left < pixels[row * (hash_size + 1) + col + 1])
+    return value
+
+
+def hamming(first, second):
+    """number of bits that differ"""
+    return bin(first ^ second).count("1")
+
+
+def hash_files(paths, workers=None):
+    """{path: dhash} computed in a process pool, unreadable files are skipped"""
+    done = {}
+    if not paths:
+        return done
+    with futures.ProcessPoolExecutor(workers) as executor:
+        pending = {executor.submit(dhash, path): path for path in paths}
+        for job in futures.as_completed(pending):
+            try:
+                done[pending[job]] = job.result()
+            except Exception as error:  # pylint: disable=broad-except
+                print(f"Could not hash {pending[job]}: {error}")
+    return done
+
+
+class MultiIndex:
+    """
+    Multi-index hashing: the hash is cut into chunks, each with its own
+    table. Two hashes within distance have at least one chunk within
+    distance // chunks of each other, so a lookup only probes those chunk
+    values and compares the few hashes found there.
+    """
+
+    def __init__(self, distance=DEFAULT_DISTANCE, bits=HASH_SIZE * HASH_SIZE):
+        self.distance = distance
+        chunks = min(distance // 2 + 1, bits)
+        radius = distance // chunks
+        self.chunks = []
+        for num in range(chunks):
+            start, end = bits * num // chunks, bits * (num + 1) // chunks
+            flips = [
+                sum(1 << bit for bit in combo)
+                for flipped in range(radius + 1)
+                for combo in itertools.combinations(range(end - start), flipped)
+            ]
+            self.chunks.append((start, (1 << (end - start)) - 1, flips, {}))
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def add(self, value, item):
+        """insert a hash"""
+        self.size += 1
+        for start, mask, _, table in self.chunks:
+            table.setdefault((value >> start) & mask, []).append((value, item))
+
+    def search(self, value, radius=None):
+        """[(distance, item)] of the hashes within radius, closest first"""
+        radius = self.distance if radius is None else min(radius, self.distance)
+        found = {}
+        for start, mask, flips, table in self.chunks:
+            key = (value >> start) & mask
+            for flip in flips:
+                for known, item in table.get(key ^ flip, ()):
+                    distance = hamming(value, known)
+                    if distance <= radius:
+                        found[item] = distance
+        return sorted(((d, item) for item, d in found.items()), key=lambda m: m[0])
+
+    def nearest(self, value):
+        """closest item within distance, None if there is none"""
+        found = self.search(value)
+        return found[0][1] if found else None
+
+
+class Deduplicator:
+    """
+    Known hashes of a gallery, safe to share between the download threads.
+    admit() is the check a download goes through before it is kept.
+    """
+
+    def __init__(self, known=(), distance=DEFAULT_DISTANCE):
+        self.distance = distance
+        self.table = MultiIndex(distance)
+        self.exact = {}
+        self.hashes = {}
+        self.lock = threading.Lock()
+        for path, value in known:
+            self.add(path, value)
+
+    def add(self, path, value):
+        """remember the hash of a kept image"""
+        self.exact.setdefault(value, path)
+        self.table.add(value, path)
+
+    def match(self, value):
+        """path of a known image looking the same, None if it is new"""
+        if value in self.exact:
+            return self.exact[value]
+        return self.table.nearest(value)
+
+    def admit(self, file_path, name=None):
+        """
+        Hash a finished download, raise DuplicateImage if it looks like a
+        known image, otherwise remember it under name (its final path)
+        """
+        value = dhash(file_path)
+        name = name or file_path
+        with self.lock:
+            original = self.match(value)
+            if original is not None:
+                raise DuplicateImage(f"{name} looks like {original}")
+            self.add(name, value)
+            self.hashes[name] = value
+        return True
+
+
+def find_duplicates(hashed, distance=DEFAULT_DISTANCE):
+    """
+    hashed is [(path, hash)] in order of preference, the first of a group
+    of look-alikes is kept. Returns [(duplicate, kept original)].
+    """
+    seen = Deduplicator(distance=distance)
+    duplicates = []
+    for path, value in hashed:
+        original = seen.match(value)
+        if original is None:
+            seen.add(path, value)
+        else:
+            duplicates.append((path, original))
+    return duplicates
+
+
+def to_text(value):
+    """hash as stored in the index"""
+    return f"{value:016x}"
+
+
+def from_text(text):
+    """hash from the index"""
+    return int(text, 16)
@@ -2,51 +2,160 @@
 
 import os
 import sys
+import json
+import time
 import subprocess
 import utils
 
-
-def set_wallpaper_gnomefamily(file_path):
-    """ gnome, unity, cinnamon, awesome-gnome """
+# a different value in any of these means a different login session
+SESSION_VARS = (
+    "DESKTOP_SESSION",
+    "XDG_CURRENT_DESKTOP",
+    "XDG_SESSION_ID",
+    "KDE_FULL_SESSION",
+    "GNOME_DESKTOP_SESSION_ID",
+    "DISPLAY",
+    "WAYLAND_DISPLAY",
+)
+# the ones telling a login apart, cron sets none of them and at most a
+# fixed DISPLAY, the file cache is not used then
+LOGIN_VARS = (
+    "DESKTOP_SESSION",
+    "XDG_CURRENT_DESKTOP",
+    "XDG_SESSION_ID",
+    "KDE_FULL_SESSION",
+    "GNOME_DESKTOP_SESSION_ID",
+)
+# processes that give the desktop away when the environment does not
+DESKTOP_PROCESSES = [("xfce-mcs-manage", "xfce4"), ("ksmserver", "kde")]
+
+# seconds a backend batch may take before its commands are killed
+COMMAND_TIMEOUT = 10
+
+_DETECTED = {}
+
+
+def run_batch(commands, timeout=COMMAND_TIMEOUT, capture=False):
+    """
+    Start every command at once and wait for all of them, killing what is
+    still running at the deadline. Every child is reaped. Returns a list of
+    (returncode, stdout) in order, returncode None if the command could not
+    start or timed out.
+    """
+    started = []
+    for args in commands:
+        try:
+            proc = subprocess.Popen(
+                args,
+                stdin=subprocess.DEVNULL,
+                stdout=subprocess.PIPE if capture else subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+            )
+        except OSError:  # not installed
+            proc = None
+        started.append(proc)
+
+    deadline = time.monotonic() + timeout
+    results = []
+    for proc in started:
+        if proc is None:
+            results.append((None, b""))
+            continue
+        try:
+            out, _ = proc.communicate(timeout=max(deadline - time.monotonic(), 0))
+            results.append((proc.returncode, out or b""))
+        except subprocess.TimeoutExpired:
+            proc.kill()
+            proc.communicate()
+            results.append((None, b""))
+    return results
+
+
+class Backend:
+    """collects the commands run for one setter, their outcome and wall time"""
+
+    def __init__(self, name):
+        self.name = name
+        self.start = time.perf_counter()
+        self.returncodes = []
+        self.outputs = []
+
+    def run(self, *commands, capture=False):
+        """one concurrent batch, True if every command succeeded"""
+        results = run_batch(commands, capture=capture)
+        self.returncodes += [returncode for returncode, _ in results]
+        self.outputs = [out for _, out in results]
+        return all(returncode == 0 for returncode, _ in results)
+
+    def result(self, ok=None):
+        """report of the setter call"""
+        return {
+            "backend": self.name,
+            "ok": all(rc == 0 for rc in self.returncodes) if ok is None else ok,
+            "seconds": time.perf_counter() - self.start,
+            "returncodes": self.returncodes,
+        }
+
+
+def set_wallpaper_gnomefamily(file_path, options=None):
+    """ gnome, unity, cinnamon, awesome-gnome, options sets picture-options too """
+    backend = Backend("gnome")
     uri = "'file://%s'" % file_path
-    try:
-        args = ["gsettings", "set", "org.gnome.desktop.background", "picture-uri", uri]
-        subprocess.Popen(args)
-    except subprocess.CalledProcessError:
-        args = ["dconf", "write", "/org/gnome/desktop/background/picture-uri", uri]
-        subprocess.Popen(args)
+    schema = "org.gnome.desktop.background"
+    commands = [["gsettings", "set", schema, "picture-uri", uri]]
+    if options:
+        commands.append(["gsettings", "set", schema, "picture-options", options])
+    ok = backend.run(*commands)
+    if not ok:
+        key = "/org/gnome/desktop/background/"
+        commands = [["dconf", "write", key + "picture-uri", uri]]
+        if options:
+            commands.append(
+                ["dconf", "write", key + "picture-options", "'%s'" % options]
+            )
+        ok = backend.run(*commands)
+    return backend.result(ok)
 
 
 def set_wallpaper_gnome2(file_path):
     """ gnome2 uses gconftool-2 """
     # From https://bugs.launchpad.net/variety/+bug/1033918
-    try:
-        args = [
-            "gconftool-2",
-            "-t",
-            "string",
-            "--set",
-            "/desktop/gnome/background/picture_filename",
-            '"%s"' % file_path,
-        ]
-        subprocess.Popen(args)
-    except subprocess.CalledProcessError:
-        set_wallpaper_gnomefamily(file_path)
-
-
-def set_wallpaper_mate(file_path):
-    """ mate wm """
-    try:  # MATE >= 1.6
-        # info from http://wiki.mate-desktop.org/docs:gsettings
-        args = [
-            "gsettings",
-            "set",
-            "org.mate.background",
-            "picture-filename",
-            "'%s'" % file_path,
-        ]
-        subprocess.Popen(args)
-    except subprocess.CalledProcessError:
+    backend = Backend("gnome2")
+    args = [
+        "gconftool-2",
+        "-t",
+        "string",
+        "--set",
+        "/desktop/gnome/background/picture_filename",
+        '"%s"' % file_path,
+    ]
+    if backend.run(args):
+        return backend.result()
+    fallback = set_wallpaper_gnomefamily(file_path)
+    fallback["returncodes"] = backend.returncodes + fallback["returncodes"]
+    fallback["seconds"] = time.perf_counter() - backend.start
+    return fallback
+
+
+def set_wallpaper_mate(file_path, options=None):
+    """ mate wm, options sets picture-options too """
+    backend = Backend("mate")
+    # MATE >= 1.6
+    # info from http://wiki.mate-desktop.org/docs:gsettings
+    args = [
+        "gsettings",
+        "set",
+        "org.mate.background",
+        "picture-filename",
+        "'%s'" % file_path,
+    ]
+    commands = [args]
+    if options:
+        commands.append(
+            ["gsettings", "set", "org.mate.background", "picture-options", options]
+        )
+    ok = backend.run(*commands)
+    if not ok:
         # From https://bugs.launchpad.net/variety/+bug/1033918
         args = [
             "mateconftool-2",
@@ -56,23 +165,27 @@ def set_wallpaper_mate(file_path):
             "/desktop/mate/background/picture_filename",
             '"%s"' % file_path,
         ]
-        subprocess.Popen(args)
-
-
-def set_wallpaper_xfce4(file_path):
-    """ not tested """
-    # From http://www.commandlinefu.com/commands/view/2055/change-wallpaper-for-xfce4-4.6.0
-
-    # xfconf-query --channel xfce4-desktop --list|grep image-style|xargs -L1 dirname
-    monitor_paths = subprocess.check_output(
-        "xfconf-query --channel xfce4-desktop --list|grep last-image|xargs -L1 dirname",
-        shell=True,
-    )
-    paths_array = monitor_paths.splitlines()
-
-    for path in paths_array:
-        str_path = path.decode("utf-8")
-        args = [
+        ok = backend.run(args)
+    return backend.result(ok)
+
+
+def xfce4_backdrops(backend):
+    """property folders of every xfce4 monitor and workspace, None on failure"""
+    # xfconf-query --channel xfce4-desktop --list|grep last-image|xargs -L1 dirname
+    listing = ["xfconf-query", "--channel", "xfce4-desktop", "--list"]
+    if not backend.run(listing, capture=True):
+        return None
+    return [
+        os.path.dirname(prop)
+        for prop in backend.outputs[0].decode("utf-8").splitlines()
+        if "last-image" in prop
+    ]
+
+
+def xfce4_commands(str_path, file_path):
+    """set one backdrop to an image, scaled"""
+    return [
+        [
             "xfconf-query",
             "-c",
             "xfce4-desktop",
@@ -80,9 +193,8 @@ def set_wallpaper_xfce4(file_path):
             str_path + "/last-image",
             "-s",
             file_path,
-        ]
-        subprocess.Popen(args)
-        args = [
+        ],
+        [
             "xfconf-query",
             "-c",
             "xfce4-desktop",
@@ -90,11 +202,54 @@ def set_wallpaper_xfce4(file_path):
             str_path + "/image-style",
             "-s",
             "3",
-        ]
-        subprocess.Popen(args)
+        ],
+    ]
+
 
-    args = ["xfdesktop", "--reload"]
-    subprocess.Popen(args)
+def set_wallpaper_xfce4(file_path):
+    """ every monitor in one concurrent batch, then reload """
+    # From http://www.commandlinefu.com/commands/view/2055/change-wallpaper-for-xfce4-4.6.0
+    backend = Backend("xfce4")
+    paths_array = xfce4_backdrops(backend)
+    if paths_array is None:
+        return backend.result()
+    commands = []
+    for str_path in paths_array:
+        commands += xfce4_commands(str_path, file_path)
+    backend.run(*commands)
+    backend.run(["xfdesktop", "--reload"])
+    return backend.result()
+
+
+def xfce4_monitor_image(str_path, assignments):
+    """
+    Image of the monitor a backdrop belongs to: xfce 4.12 names them like
+    /backdrop/screen0/monitorDP-1/workspace0, older ones count monitor0, 1..
+    """
+    for part in str_path.split("/"):
+        if not part.startswith("monitor"):
+            continue
+        name = part[len("monitor") :]
+        for monitor, file_path in assignments:
+            if monitor["name"] == name:
+                return file_path
+        if name.isdigit() and int(name) < len(assignments):
+            return assignments[int(name)][1]
+    return assignments[0][1]
+
+
+def set_wallpapers_xfce4(assignments):
+    """ an image per monitor, assignments is [(monitor, image)] """
+    backend = Backend("xfce4")
+    paths_array = xfce4_backdrops(backend)
+    if paths_array is None:
+        return backend.result()
+    commands = []
+    for str_path in paths_array:
+        commands += xfce4_commands(str_path, xfce4_monitor_image(str_path, assignments))
+    backend.run(*commands)
+    backend.run(["xfdesktop", "--reload"])
+    return backend.result()
 
 
 def set_wallpaper_windows(file_path):
@@ -102,16 +257,25 @@ def set_wallpaper_windows(file_path):
     # From http://stackoverflow.com/questions/1977694/change-desktop-background
     import ctypes
 
-    ctypes.windll.user32.SystemParametersInfoA(20, 0, file_path, 0)
+    backend = Backend("windows")
+    ok = ctypes.windll.user32.SystemParametersInfoA(20, 0, file_path, 0)
+    return backend.result(bool(ok))
 
 
 def set_wallpaper_feh(file_path):
     """ not tested """
-    try:
-        args = ["feh", "--bg-center", file_path]
-        subprocess.Popen(args)
-    except:
+    backend = Backend("feh")
+    if not backend.run(["feh", "--bg-center", file_path]):
         print("Error running feh, please check `feh` is in your $PATH")
+    return backend.result()
+
+
+def set_wallpapers_feh(assignments):
+    """ feh hands the images to the Xinerama screens in order """
+    backend = Backend("feh")
+    if not backend.run(["feh", "--bg-fill"] + [path for _, path in assignments]):
+        print("Error running feh, please check `feh` is in your $PATH")
+    return backend.result()
 
 
 def set_wallpaper_osx(file_path):
@@ -123,53 +287,102 @@ def set_wallpaper_osx(file_path):
     except:
         raise
 
+    backend = Backend("mac")
     try:
         sys_events = app("System Events")
         for desktop in sys_events.desktops.get():
             desktop.picture.set(mactypes.File(file_path))
     except CommandError as exception:
         print(exception.errormessage)
+        return backend.result(False)
+    return backend.result(True)
 
 
 def set_wallpaper_kde(file_path):
     """ kde family"""
     # From http://ubuntuforums.org/archive/index.php/t-803417.html
-    args = 'dcop kdesktop KBackgroundIface setWallpaper 0 "%s" 6' % file_path
-    subprocess.Popen(args, shell=True)
+    backend = Backend("kde")
+    args = ["dcop", "kdesktop", "KBackgroundIface", "setWallpaper", "0", file_path, "6"]
+    backend.run(args)
+    return backend.result()
 
 
 def set_wallpaper_fluxbox(file_path):
     """ fluxbox family"""
-    args = ["fbsetbg", file_path]
-    subprocess.Popen(args)
+    backend = Backend("fluxbox")
+    backend.run(["fbsetbg", file_path])
+    return backend.result()
 
 
 def set_wallpaper_icewm(file_path):
     """icewm fam"""
-    args = ["icewmbg", file_path]
-    subprocess.Popen(args)
+    backend = Backend("icewm")
+    backend.run(["icewmbg", file_path])
+    return backend.result()
 
 
 def set_wallpaper_blackbox(file_path):
     """blackbox family"""
-    args = ["bsetbg", "-full", file_path]
-    subprocess.Popen(args)
+    backend = Backend("blackbox")
+    backend.run(["bsetbg", "-full", file_path])
+    return backend.result()
 
 
 def set_wallpaper_lxde(file_path):
     """lxde family"""
-    args = "pcmanfm --set-wallpaper %s --wallpaper-mode=scaled" % file_path
-    subprocess.Popen(args, shell=True)
+    backend = Backend("lxde")
+    backend.run(["pcmanfm", "--set-wallpaper", file_path, "--wallpaper-mode=scaled"])
+    return backend.result()
 
 
 def set_wallpaper_windowmaker(file_path):
     """windowmaker family"""
-    args = "wmsetbg -s -u %s" % file_path
-    subprocess.Popen(args, shell=True)
+    backend = Backend("windowmaker")
+    backend.run(["wmsetbg", "-s", "-u", file_path])
+    return backend.result()
+
+
+def session_key():
+    """identifies the current login session"""
+    return [sys.platform] + [os.environ.get(var, "") for var in SESSION_VARS]
+
+
+def get_desktop_env(cache_file=None):
+    """
+    Desktop environment for all platforms, cached per login session. An
+    unknown desktop is not cached, it may just not be up yet.
+    """
+    key = session_key()
+    memo_key = tuple(key)
+    if memo_key in _DETECTED:
+        return _DETECTED[memo_key]
+    desktop_env = None
+    if not any(os.environ.get(var) for var in LOGIN_VARS):
+        cache_file = None
+    if cache_file:
+        try:
+            with open(cache_file, "r", encoding="utf-8") as cachef:
+                cached = json.load(cachef)
+            if cached.get("session") == key:
+                desktop_env = cached["desktop_env"]
+        except (OSError, ValueError, KeyError):
+            pass
+    if desktop_env is None:
+        desktop_env = detect_desktop_env()
+        if desktop_env == "unknown":
+            return desktop_env
+        if cache_file:
+            try:
+                with open(cache_file, "w", encoding="utf-8") as cachef:
+                    json.dump({"session": key, "desktop_env": desktop_env}, cachef)
+            except OSError:
+                pass
+    _DETECTED[memo_key] = desktop_env
+    return desktop_env
 
 
-def get_desktop_env():
-    """ Desktop environment for all platforms """
+def detect_desktop_env():
+    """ Desktop environment for all platforms, no caching """
     desktop_env = "unknown"
 
     if sys.platform in ["win32", "cygwin"]:
@@ -196,10 +409,12 @@ def get_desktop_env_linux():
             desktop_env = "gnome2"
         else:
             desktop_env = "gnome3"
-    elif utils.is_running("xfce-mcs-manage"):
-        desktop_env = "xfce4"
-    elif utils.is_running("ksmserver"):
-        desktop_env = "kde"
+    else:
+        running = utils.running_processes([name for name, _ in DESKTOP_PROCESSES])
+        for name, desktop in DESKTOP_PROCESSES:
+            if name in running:
+                desktop_env = desktop
+                break
     return desktop_env
 
 
@@ -246,7 +461,7 @@ def get_desktop_env_linux_session(desktop_session):
 
 def ignore_wallpaper(image_path=""):
     """ for unknown desktop environments, we simply ignore the call"""
-    pass
+    return Backend("unknown").result(False)
 
 
 WMS = {
@@ -272,3 +487,72 @@ WMS = {
     "windowmaker": set_wallpaper_windowmaker,
     "i3": set_wallpaper_gnomefamily,
 }
+
+# desktops that take an image per monitor, the others get a spanned image
+MULTI_WMS = {
+    "xfce4": set_wallpapers_xfce4,
+    "feh": set_wallpapers_feh,
+}
+
+# setters taking picture-options, by gsettings schema; "spanned" stretches
+# one image over all monitors
+PICTURE_OPTIONS = {
+    set_wallpaper_gnomefamily: "org.gnome.desktop.background",
+    set_wallpaper_mate: "org.mate.background",
+}
+
+
+def picture_options(schema):
+    """current picture-options of a schema, None if gsettings cannot tell"""
+    [(returncode, out)] = run_batch(
+        [["gsettings", "get", schema, "picture-options"]], capture=True
+    )
+    if returncode != 0:
+        return None
+    return out.decode("utf-8").strip().strip("'")
+
+
+def set_wallpaper_spanned(desktop_env, file_path, saved_file=None):
+    """
+    one image over every monitor, in spanning mode where there is one. The
+    picture-options it replaces are kept in saved_file for unspan().
+    """
+    setter = WMS[desktop_env]
+    schema = PICTURE_OPTIONS.get(setter)
+    if schema is None:
+        return setter(file_path)
+    if saved_file and not os.path.exists(saved_file):
+        previous = picture_options(schema)
+        if previous and previous != "spanned":
+            try:
+                with open(saved_file, "w", encoding="utf-8") as savedf:
+                    json.dump({"schema": schema, "options": previous}, savedf)
+            except OSError:
+                pass
+    return setter(file_path, options="spanned")
+
+
+def unspan(saved_file):
+    """
+    Before a single image: put back the picture-options set_wallpaper_spanned()
+    replaced, unless the user changed them since. Nothing to do, and no
+    command run, when nothing was spanned.
+    """
+    try:
+        with open(saved_file, "r", encoding="utf-8") as savedf:
+            saved = json.load(savedf)
+        schema, options = saved["schema"], saved["options"]
+    except (OSError, ValueError, KeyError, TypeError):
+        return
+    current = picture_options(schema)
+    if current is None:
+        # gsettings is not answering, try again next time
+        return
+    if current == "spanned":
+        [(returncode, _)] = run_batch(
+            [["gsettings", "set", schema, "picture-options", options]]
+        )
+        if returncode != 0:
+            return
+    os.remove(saved_file)
+
@@ -0,0 +1,111 @@
+"""
+Keep the download gallery within a byte and a file count budget
+"""
+
+import os
+import time
+import gallery
+
+# seconds before an abandoned partial download is removed
+PARTIAL_MAX_AGE = 24 * 3600
+
+
+def key_lru(entry):
+    """least recently used first, never used images count from their download"""
+    return entry["used_at"] or entry["added_at"]
+
+
+def key_fifo(entry):
+    """first downloaded first"""
+    return entry["added_at"]
+
+
+def key_largest(entry):
+    """biggest files first"""
+    return -entry["size"]
+
+
+POLICIES = {
+    "lru": key_lru,
+    "fifo": key_fifo,
+    "largest": key_largest,
+}
+
+
+def entries_from_index(index, directory):
+    """eviction candidates as the gallery index knows them"""
+    return [
+        {"path": path, "size": size, "added_at": added, "used_at": used_at, "used": used}
+        for path, size, added, used_at, used in index.entries(directory)
+    ]
+
+
+def entries_from_disk(directory):
+    """eviction candidates from stat data when there is no index"""
+    return [
+        {"path": path, "size": size, "added_at": mtime, "used_at": None, "used": 0}
+        for path, size, mtime in gallery.scan_dir(directory)
+    ]
+
+
+def plan(entries, max_bytes=None, max_files=None, policy="lru"):
+    """
+    Entries to remove so what is left fits the budgets. Images already seen
+    go before unseen ones, the policy orders within each group.
+    """
+    policy_key = POLICIES[policy]
+    ordered = sorted(entries, key=lambda e: (not e["used"], policy_key(e)))
+    total_bytes = sum(e["size"] for e in entries)
+    total_files = len(entries)
+    evicted = []
+    for entry in ordered:
+        over_bytes = max_bytes is not None and total_bytes > max_bytes
+        over_files = max_files is not None and total_files > max_files
+        if not (over_bytes or over_files):
+            break
+        evicted.append(entry)
+        total_bytes -= entry["size"]
+        total_files -= 1
+    return evicted
+
+
+def remove_stale_partials(directory, max_age=PARTIAL_MAX_AGE):
+    """delete partial downloads nobody resumed"""
+    removed = []
+    limit = time.time() - max_age
+    with os.scandir(directory) as found:
+        for entry in found:
+            if entry.name.endswith(".part") and entry.stat().st_mtime < limit:
+                os.remove(entry.path)
+                removed.append(entry.path)
+    return removed
+
+
+def evict(
+    directory,
+    max_bytes=None,
+    max_files=None,
+    policy="lru",
+    index=None,
+    protected_dirs=(),
+):
+    """remove images from directory until it fits, returns the removed paths"""
+    for protected in protected_dirs:
+        if os.path.realpath(directory) == os.path.realpath(protected):
+            raise ValueError(f"refusing to evict from {protected}")
+    if index is not None:
+        entries = entries_from_index(index, directory)
+    else:
+        entries = entries_from_disk(directory)
+    removed = []
+    for entry in plan(entries, max_bytes, max_files, policy):
+        try:
+            os.remove(entry["path"])
+            removed.append(entry["path"])
+        except FileNotFoundError:
+            removed.append(entry["path"])
+        except PermissionError:
+            continue
+        if index is not None:
+            index.remove(entry["path"])
+    return removed + remove_stale_partials(directory)
@@ -0,0 +1,69 @@
+"""
+Streaming link extraction from HTML, stops reading once it has enough
+"""
+
+import re
+import html
+import time
+
+import metrics
+
+HREF = re.compile(rb"""\bhref\s*=\s*(?:"([^"]*)"|'([^']*)')""", re.IGNORECASE)
+
+
+class AnchorSelector:
+    """
+    Compiled a[class=<css_class>] selector. extract() takes the page in
+    chunks as they arrive and returns after limit hrefs without looking at
+    the rest of the page.
+    """
+
+    def __init__(self, name, css_class, limit=None):
+        self.name = name
+        self.limit = limit
+        self.pattern = re.compile(
+            rb"<a\s[^>]*?\bclass\s*=\s*[\"']"
+            + re.escape(css_class.encode("utf-8"))
+            + rb"[\"'][^>]*>",
+            re.IGNORECASE,
+        )
+
+    def scan(self, buffer, found):
+        """hrefs of the complete tags in buffer, returns where scanning ended"""
+        end = 0
+        for match in self.pattern.finditer(buffer):
+            end = match.end()
+            href = HREF.search(match.group(0))
+            if href is None:
+                continue
+            value = href.group(1) if href.group(1) is not None else href.group(2)
+            found.append(html.unescape(value.decode("utf-8", "replace")))
+            if self.limit is not None and len(found) >= self.limit:
+                return -1
+        return end
+
+    def extract(self, chunks):
+        """hrefs of the matching anchors, reading chunks only as far as needed"""
+        found = []
+        buffer = b""
+        timing = metrics.ENABLED
+        parse_seconds = 0.0
+        read = 0
+        try:
+            for chunk in chunks:
+                buffer += chunk
+                read += len(chunk)
+                start = time.perf_counter() if timing else 0.0
+                end = self.scan(buffer, found)
+                if timing:
+                    parse_seconds += time.perf_counter() - start
+                if end < 0:
+                    return found
+                # keep a tag cut in half by the chunk boundary for the next round
+                cut = buffer.rfind(b"<")
+                buffer = buffer[cut:] if cut >= end else b""
+            return found
+        finally:
+            if timing:
+                metrics.observe("html_parse", parse_seconds, selector=self.name)
+                metrics.count("html_bytes", read, selector=self.name)
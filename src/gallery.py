@@ -0,0 +1,456 @@
+"""
+Persistent index of the images in the gallery folders
+"""
+
+import os
+import time
+import threading
+import sqlite3
+import contextlib
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS images (
+    path TEXT PRIMARY KEY,
+    directory TEXT NOT NULL,
+    size INTEGER NOT NULL DEFAULT 0,
+    mtime REAL NOT NULL DEFAULT 0,
+    provider TEXT NOT NULL DEFAULT '',
+    used INTEGER NOT NULL DEFAULT 0,
+    static INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS images_used ON images (used);
+CREATE TABLE IF NOT EXISTS dirs (
+    path TEXT PRIMARY KEY,
+    mtime REAL NOT NULL
+);
+"""
+
+# columns added after the first release, added to older databases on open
+COLUMNS = [
+    ("added_at", "REAL NOT NULL DEFAULT 0"),
+    ("used_at", "REAL"),
+    ("width", "INTEGER"),
+    ("height", "INTEGER"),
+    ("orientation", "INTEGER"),
+    ("valid", "INTEGER"),
+    ("content_hash", "TEXT"),
+    ("prescaled", "TEXT"),
+    ("phash", "TEXT"),
+    ("keep", "INTEGER NOT NULL DEFAULT 0"),
+    ("blob", "TEXT"),
+]
+
+IMAGE_EXTENSIONS = (".jpg",)
+
+
+def provider_of(file_path, static=False):
+    """socwall-1234.jpg comes from socwall, anything in the static dir is static"""
+    if static:
+        return "static"
+    name = os.path.basename(file_path)
+    if "-" in name:
+        return name.split("-", 1)[0]
+    return ""
+
+
+def scan_dir(directory):
+    """(path, size, mtime) of every image in a folder"""
+    found = []
+    try:
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if not entry.name.endswith(IMAGE_EXTENSIONS) or not entry.is_file():
+                    continue
+                stat = entry.stat()
+                found.append((entry.path, stat.st_size, stat.st_mtime))
+    except FileNotFoundError:
+        pass
+    return found
+
+
+class GalleryIndex:
+    """sqlite index of gallery images, their origin and used state"""
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.lock = threading.RLock()
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        with self.lock, self.conn:
+            self.conn.executescript(SCHEMA)
+            self.migrate()
+
+    def migrate(self):
+        """add the columns missing in databases created by older versions"""
+        existing = {row[1] for row in self.conn.execute("PRAGMA table_info(images)")}
+        for name, declaration in COLUMNS:
+            if name not in existing:
+                self.conn.execute(f"ALTER TABLE images ADD COLUMN {name} {declaration}")
+
+    def close(self):
+        """close the database"""
+        with self.lock:
+            self.conn.close()
+
+    def reconcile(self, directories, used_loader=None):
+        """
+        Bring the index in line with the folders, only for folders whose
+        mtime changed since the last time. directories is a list of
+        (path, static) and used_loader returns the set of used paths, it is
+        only called when a rescan is needed.
+        """
+        used = None
+        rescanned = 0
+        with self.lock, self.conn:
+            for directory, static in directories:
+                try:
+                    dir_mtime = os.stat(directory).st_mtime
+                except FileNotFoundError:
+                    continue
+                row = self.conn.execute(
+                    "SELECT mtime FROM dirs WHERE path = ?", (directory,)
+                ).fetchone()
+                if row is not None and row[0] == dir_mtime:
+                    continue
+                if used is None:
+                    used = used_loader() if used_loader else set()
+                self._rescan(directory, static, used)
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO dirs (path, mtime) VALUES (?, ?)",
+                    (directory, dir_mtime),
+                )
+                rescanned += 1
+        return rescanned
+
+    def _rescan(self, directory, static, used):
+        """replace the rows of one folder with what is on disk"""
+        on_disk = scan_dir(directory)
+        known = {
+            row[0]
+            for row in self.conn.execute(
+                "SELECT path FROM images WHERE directory = ?", (directory,)
+            )
+        }
+        present = set()
+        for path, size, mtime in on_disk:
+            present.add(path)
+            if path in known:
+                # a changed file has to be measured again
+                self.conn.execute(
+                    "UPDATE images SET size = ?, mtime = ?,"
+                    " valid = CASE WHEN mtime = ? THEN valid END,"
+                    " content_hash = CASE WHEN mtime = ? THEN content_hash END,"
+                    " prescaled = CASE WHEN mtime = ? THEN prescaled END,"
+                    " phash = CASE WHEN mtime = ? THEN phash END,"
+                    " blob = CASE WHEN mtime = ? THEN blob END"
+                    " WHERE path = ?",
+                    (size, mtime, mtime, mtime, mtime, mtime, mtime, path),
+                )
+            else:
+                self.conn.execute(
+                    "INSERT INTO images"
+                    " (path, directory, size, mtime, provider, used, static, added_at)"
+                    " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (
+                        path,
+                        directory,
+                        size,
+                        mtime,
+                        provider_of(path, static),
+                        int(path in used),
+                        int(static),
+                        mtime,
+                    ),
+                )
+        self.conn.executemany(
+            "DELETE FROM images WHERE path = ?", [(p,) for p in known - present]
+        )
+
+    def touch_dir(self, directory, before):
+        """
+        Record the folder mtime after changes we indexed ourselves, but only
+        if the index was in line with the folder before them (stored mtime
+        equal to before). Otherwise it stays stale and reconcile rescans, a
+        file deleted by hand must not be hidden by our own writes.
+        """
+        try:
+            dir_mtime = os.stat(directory).st_mtime
+        except FileNotFoundError:
+            return
+        with self.lock, self.conn:
+            self.conn.execute(
+                "UPDATE dirs SET mtime = ? WHERE path = ? AND mtime = ?",
+                (dir_mtime, directory, before),
+            )
+
+    @contextlib.contextmanager
+    def writing(self, *directories):
+        """wrap our own file changes in folders, see touch_dir()"""
+        before = {}
+        for directory in directories:
+            try:
+                before[directory] = os.stat(directory).st_mtime
+            except FileNotFoundError:
+                pass
+        try:
+            yield
+        finally:
+            for directory, mtime in before.items():
+                self.touch_dir(directory, mtime)
+
+    def add(self, file_path, provider="", static=False):
+        """index a freshly written image, see writing() to spare a rescan"""
+        try:
+            stat = os.stat(file_path)
+        except FileNotFoundError:
+            return
+        provider = provider or provider_of(file_path, static)
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO images"
+                " (path, directory, size, mtime, provider, used, static, added_at)"
+                " VALUES (?, ?, ?, ?, ?, 0, ?, ?)",
+                (
+                    file_path,
+                    os.path.dirname(file_path),
+                    stat.st_size,
+                    stat.st_mtime,
+                    provider,
+                    int(static),
+                    time.time(),
+                ),
+            )
+
+    def remove(self, file_path):
+        """forget an image, see writing() to spare a rescan"""
+        self.remove_many([file_path])
+
+    def remove_many(self, file_paths):
+        """forget images in one transaction"""
+        with self.lock, self.conn:
+            self.conn.executemany(
+                "DELETE FROM images WHERE path = ?", [(p,) for p in file_paths]
+            )
+
+    def mark_used(self, file_path, used=True):
+        """flag an image as seen"""
+        with self.lock, self.conn:
+            self.conn.execute(
+                "UPDATE images SET used = ?, used_at = ? WHERE path = ?",
+                (int(used), time.time() if used else None, file_path),
+            )
+
+    def unused_images(self):
+        """paths of all images not seen yet, known broken ones left out"""
+        with self.lock:
+            return [
+                row[0]
+                for row in self.conn.execute(
+                    "SELECT path FROM images WHERE used = 0 AND valid IS NOT 0"
+                )
+            ]
+
+    def unmeasured(self, limit=1000):
+        """paths whose header metadata was not read yet"""
+        with self.lock:
+            return [
+                row[0]
+                for row in self.conn.execute(
+                    "SELECT path FROM images WHERE valid IS NULL LIMIT ?", (limit,)
+                )
+            ]
+
+    def set_meta(self, file_path, meta):
+        """store what imagemeta.read_meta found"""
+        self.set_metas([(file_path, meta)])
+
+    def set_metas(self, measured):
+        """set_meta() for [(path, meta)] in one transaction"""
+        with self.lock, self.conn:
+            self.conn.executemany(
+                "UPDATE images SET width = ?, height = ?, orientation = ?, valid = ?"
+                " WHERE path = ?",
+                [
+                    (
+                        meta["width"],
+                        meta["height"],
+                        meta["orientation"],
+                        int(meta["valid"]),
+                        file_path,
+                    )
+                    for file_path, meta in measured
+                ],
+            )
+
+    def content_hash(self, file_path):
+        """sha256 of an image if it was computed before"""
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT content_hash FROM images WHERE path = ?", (file_path,)
+            ).fetchone()
+        return row[0] if row else None
+
+    def needs_prescale(self, sizes_key, file_paths):
+        """(path, content hash) of valid file_paths without variants for sizes_key"""
+        if not file_paths:
+            return []
+        marks = ", ".join("?" * len(file_paths))
+        with self.lock:
+            return self.conn.execute(
+                "SELECT path, content_hash FROM images WHERE valid = 1"
+                f" AND prescaled IS NOT ? AND path IN ({marks})",
+                (sizes_key, *file_paths),
+            ).fetchall()
+
+    def set_prescaled(self, file_path, content_hash, sizes_key):
+        """remember the variants of an image are made"""
+        with self.lock, self.conn:
+            self.conn.execute(
+                "UPDATE images SET content_hash = ?, prescaled = ? WHERE path = ?",
+                (content_hash, sizes_key, file_path),
+            )
+
+    def clear_prescaled(self, content_hashes):
+        """variants of these contents were evicted, make them again when needed"""
+        with self.lock, self.conn:
+            self.conn.executemany(
+                "UPDATE images SET prescaled = NULL WHERE content_hash = ?",
+                [(content_hash,) for content_hash in content_hashes],
+            )
+
+    def unhashed(self, limit=1000):
+        """valid images without a perceptual hash yet"""
+        with self.lock:
+            return [
+                row[0]
+                for row in self.conn.execute(
+                    "SELECT path FROM images WHERE phash IS NULL AND valid = 1 LIMIT ?",
+                    (limit,),
+                )
+            ]
+
+    def set_phash(self, file_path, phash):
+        """store the perceptual hash, as hex text"""
+        self.set_phashes([(file_path, phash)])
+
+    def set_phashes(self, hashed):
+        """set_phash() for [(path, phash)] in one transaction"""
+        with self.lock, self.conn:
+            self.conn.executemany(
+                "UPDATE images SET phash = ? WHERE path = ?",
+                [(phash, file_path) for file_path, phash in hashed],
+            )
+
+    def phashes(self):
+        """(path, phash) of the hashed images, static and kept then oldest first"""
+        with self.lock:
+            return self.conn.execute(
+                "SELECT path, phash FROM images WHERE phash IS NOT NULL"
+                " ORDER BY static DESC, keep DESC, added_at, path"
+            ).fetchall()
+
+    def set_keep(self, file_path, keep=True):
+        """flag an image to be kept forever, like the static ones"""
+        with self.lock, self.conn:
+            self.conn.execute(
+                "UPDATE images SET keep = ? WHERE path = ?", (int(keep), file_path)
+            )
+
+    def is_kept(self, file_path):
+        """True for images flagged to be kept forever"""
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT keep FROM images WHERE path = ?", (file_path,)
+            ).fetchone()
+        return bool(row and row[0])
+
+    def unstored(self, limit=1000):
+        """(path, content hash) of valid images not in the blob store yet"""
+        with self.lock:
+            return self.conn.execute(
+                "SELECT path, content_hash FROM images"
+                " WHERE blob IS NULL AND valid = 1 LIMIT ?",
+                (limit,),
+            ).fetchall()
+
+    def set_blob(self, file_path, blob):
+        """an image became a link to a blob, its file changed but not its content"""
+        try:
+            mtime = os.stat(file_path).st_mtime
+        except FileNotFoundError:
+            # the marker still goes in, or unstored() would return it forever
+            with self.lock, self.conn:
+                self.conn.execute(
+                    "UPDATE images SET blob = ? WHERE path = ?", (blob, file_path)
+                )
+            return
+        with self.lock, self.conn:
+            self.conn.execute(
+                "UPDATE images SET blob = ?, content_hash = ?, mtime = ? WHERE path = ?",
+                (blob, blob, mtime, file_path),
+            )
+
+    def static_twins(self):
+        """(path, static path) of downloaded images with a static copy"""
+        with self.lock:
+            return self.conn.execute(
+                "SELECT images.path, twin.path FROM images"
+                " JOIN images AS twin ON twin.blob = images.blob AND twin.static = 1"
+                " WHERE images.static = 0 AND images.blob IS NOT NULL"
+            ).fetchall()
+
+    def sized_unused(self, exclude=()):
+        """(path, width, height) of the unseen images known to be valid"""
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT path, width, height FROM images WHERE used = 0 AND valid = 1"
+            ).fetchall()
+        exclude = set(exclude)
+        return [row for row in rows if row[0] not in exclude]
+
+    def entries(self, directory):
+        """(path, size, added_at, used_at, used) of the non static images of a folder"""
+        with self.lock:
+            return self.conn.execute(
+                "SELECT path, size, added_at, used_at, used FROM images"
+                " WHERE directory = ? AND static = 0 AND keep = 0",
+                (directory,),
+            ).fetchall()
+
+    def browse(self):
+        """(path, mtime, static, keep, used) of all images, static first"""
+        with self.lock:
+            return self.conn.execute(
+                "SELECT path, mtime, static, keep, used FROM images"
+                " ORDER BY static DESC, keep DESC, added_at DESC, path"
+            ).fetchall()
+
+    def count(self, directory=None, used=None, kept=None):
+        """number of indexed images, optionally by folder, used and kept state"""
+        query = "SELECT COUNT(*) FROM images WHERE 1 = 1"
+        params = []
+        if directory is not None:
+            query += " AND directory = ?"
+            params.append(directory)
+        if used is not None:
+            query += " AND used = ?"
+            params.append(int(used))
+        if kept is not None:
+            query += " AND (static = 1 OR keep = 1) = ?"
+            params.append(int(kept))
+        with self.lock:
+            return self.conn.execute(query, params).fetchone()[0]
+
+    def random_unused(self, exclude=()):
+        """one random unseen image not in exclude, None if there are none"""
+        where = "used = 0 AND valid IS NOT 0"
+        if exclude:
+            where += f" AND path NOT IN ({', '.join('?' * len(exclude))})"
+        with self.lock:
+            row = self.conn.execute(
+                f"SELECT path FROM images WHERE {where}"
+                " LIMIT 1 OFFSET abs(random()) % max("
+                f"(SELECT COUNT(*) FROM images WHERE {where}), 1)",
+                list(exclude) * 2,
+            ).fetchone()
+        return row[0] if row else None
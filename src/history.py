@@ -0,0 +1,130 @@
+"""
+History of the images already shown, replaces the append-only used_images.log
+"""
+
+import os
+import time
+import sqlite3
+import threading
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS history (
+    path TEXT PRIMARY KEY,
+    used_at REAL NOT NULL,
+    static INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS history_static ON history (static);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value REAL NOT NULL
+);
+"""
+
+# drop entries of files gone from disk at most once a day
+COMPACT_INTERVAL = 24 * 3600
+
+
+class History:
+    """
+    Set of used image paths on disk, membership is an indexed lookup so
+    nothing is read in full on startup
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.lock = threading.RLock()
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        with self.lock, self.conn:
+            self.conn.executescript(SCHEMA)
+
+    def close(self):
+        """close the database"""
+        with self.lock:
+            self.conn.close()
+
+    def __contains__(self, file_path):
+        with self.lock:
+            return (
+                self.conn.execute(
+                    "SELECT 1 FROM history WHERE path = ?", (file_path,)
+                ).fetchone()
+                is not None
+            )
+
+    def __len__(self):
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM history").fetchone()[0]
+
+    def add(self, file_path, static=False):
+        """remember an image as used"""
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO history (path, used_at, static) VALUES (?, ?, ?)",
+                (file_path, time.time(), int(static)),
+            )
+
+    def discard(self, file_paths):
+        """forget images"""
+        with self.lock, self.conn:
+            self.conn.executemany(
+                "DELETE FROM history WHERE path = ?", [(p,) for p in file_paths]
+            )
+
+    def used_paths(self, static=None):
+        """used images, only static or non static ones if asked"""
+        query = "SELECT path FROM history"
+        params = ()
+        if static is not None:
+            query += " WHERE static = ?"
+            params = (int(static),)
+        with self.lock:
+            return [row[0] for row in self.conn.execute(query, params)]
+
+    def import_log(self, logfile_name, static_dir=None):
+        """move the entries of the old used_images.log in and empty it"""
+        if not os.path.exists(logfile_name) or os.path.getsize(logfile_name) == 0:
+            return 0
+        imported = 0
+        with open(logfile_name, "r", encoding="utf-8") as logf, self.lock, self.conn:
+            for line in logf:
+                used_path = line.strip("\n")
+                if not used_path:
+                    continue
+                static = bool(static_dir) and used_path.startswith(static_dir + os.sep)
+                self.conn.execute(
+                    "INSERT OR IGNORE INTO history (path, used_at, static)"
+                    " VALUES (?, ?, ?)",
+                    (used_path, time.time(), int(static)),
+                )
+                imported += 1
+        with open(logfile_name, "w", encoding="utf-8") as truncate_log:
+            truncate_log.write("")
+        return imported
+
+    def compact(self):
+        """drop entries for files that no longer exist"""
+        with self.lock:
+            gone = [
+                (row[0],)
+                for row in self.conn.execute("SELECT path FROM history")
+                if not os.path.exists(row[0])
+            ]
+            with self.conn:
+                self.conn.executemany("DELETE FROM history WHERE path = ?", gone)
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO meta (key, value) VALUES ('compacted', ?)",
+                    (time.time(),),
+                )
+            if gone:
+                self.conn.execute("VACUUM")
+        return len(gone)
+
+    def maybe_compact(self, interval=COMPACT_INTERVAL):
+        """compact when it was not done for interval seconds"""
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT value FROM meta WHERE key = 'compacted'"
+            ).fetchone()
+        if row is not None and time.time() - row[0] < interval:
+            return 0
+        return self.compact()
@@ -0,0 +1,110 @@
+"""
+On-disk cache of HTML responses with conditional revalidation
+"""
+
+import os
+import time
+import sqlite3
+import threading
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    url TEXT PRIMARY KEY,
+    body BLOB NOT NULL,
+    etag TEXT,
+    last_modified TEXT,
+    fetched_at REAL NOT NULL,
+    accessed_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed_at);
+"""
+
+DEFAULT_TTL = 24 * 3600
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+CACHE_NAME = "http.db"
+
+
+def default_path(app_name="wallpaper"):
+    """XDG cache dir of the app"""
+    cache_home = os.environ.get("XDG_CACHE_HOME") or os.path.join(
+        os.path.expanduser("~"), ".cache"
+    )
+    cache_dir = os.path.join(cache_home, app_name)
+    os.makedirs(cache_dir, exist_ok=True)
+    return os.path.join(cache_dir, CACHE_NAME)
+
+
+class ResponseCache:
+    """url -> body plus validators, least recently used entries go first"""
+
+    def __init__(self, db_path=None, max_bytes=DEFAULT_MAX_BYTES):
+        self.db_path = db_path or default_path()
+        self.max_bytes = max_bytes
+        self.lock = threading.RLock()
+        self.conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        with self.lock, self.conn:
+            self.conn.executescript(SCHEMA)
+            self.total = self.conn.execute(
+                "SELECT COALESCE(SUM(LENGTH(body)), 0) FROM responses"
+            ).fetchone()[0]
+
+    def close(self):
+        """close the database"""
+        with self.lock:
+            self.conn.close()
+
+    def lookup(self, url):
+        """(body, etag, last_modified, age in seconds) or None"""
+        with self.lock, self.conn:
+            row = self.conn.execute(
+                "SELECT body, etag, last_modified, fetched_at FROM responses"
+                " WHERE url = ?",
+                (url,),
+            ).fetchone()
+            if row is None:
+                return None
+            self.conn.execute(
+                "UPDATE responses SET accessed_at = ? WHERE url = ?", (time.time(), url)
+            )
+        return row[0], row[1], row[2], time.time() - row[3]
+
+    def store(self, url, body, etag=None, last_modified=None):
+        """keep a response, evicting old ones past max_bytes"""
+        now = time.time()
+        with self.lock, self.conn:
+            old = self.conn.execute(
+                "SELECT LENGTH(body) FROM responses WHERE url = ?", (url,)
+            ).fetchone()
+            self.conn.execute(
+                "INSERT OR REPLACE INTO responses"
+                " (url, body, etag, last_modified, fetched_at, accessed_at)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                (url, body, etag, last_modified, now, now),
+            )
+            self.total += len(body) - (old[0] if old else 0)
+            self.evict()
+
+    def refresh(self, url):
+        """a 304 said the stored body is still good"""
+        now = time.time()
+        with self.lock, self.conn:
+            self.conn.execute(
+                "UPDATE responses SET fetched_at = ?, accessed_at = ? WHERE url = ?",
+                (now, now, url),
+            )
+
+    def evict(self):
+        """drop least recently used entries until under max_bytes, lock held"""
+        while self.total > self.max_bytes:
+            rows = self.conn.execute(
+                "SELECT url, LENGTH(body) FROM responses"
+                " ORDER BY accessed_at LIMIT 32"
+            ).fetchall()
+            if not rows:
+                self.total = 0
+                return
+            for url, size in rows:
+                self.conn.execute("DELETE FROM responses WHERE url = ?", (url,))
+                self.total -= size
+                if self.total <= self.max_bytes:
+                    return
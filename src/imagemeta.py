@@ -0,0 +1,136 @@
+"""
+Image size, orientation and integrity from the file headers, no decoding
+"""
+
+import struct
+
+import utils
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+PNG_END = b"IEND"
+# start of frame markers carry the image size, DHT/JPG/DAC share the range
+SOF_MARKERS = set(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+# EXIF orientations that turn the image by 90 degrees
+ROTATED = (5, 6, 7, 8)
+EXIF_ORIENTATION = 0x0112
+
+
+def exif_orientation(app1):
+    """orientation tag of an APP1 segment, None if there is none"""
+    if not app1.startswith(b"Exif\x00\x00") or len(app1) < 14:
+        return None
+    tiff = app1[6:]
+    order = {b"II": "<", b"MM": ">"}.get(tiff[:2])
+    if order is None:
+        return None
+    ifd = struct.unpack(order + "I", tiff[4:8])[0]
+    if ifd + 2 > len(tiff):
+        return None
+    entries = struct.unpack(order + "H", tiff[ifd : ifd + 2])[0]
+    for num in range(entries):
+        entry = tiff[ifd + 2 + num * 12 : ifd + 14 + num * 12]
+        if len(entry) < 12:
+            return None
+        tag = struct.unpack(order + "H", entry[:2])[0]
+        if tag == EXIF_ORIENTATION:
+            return struct.unpack(order + "H", entry[8:10])[0]
+    return None
+
+
+def jpeg_size(imgf):
+    """(width, height, orientation) walking the marker segments, None if broken"""
+    if imgf.read(2) != utils.JPEG_START:
+        return None
+    orientation = 1
+    while True:
+        if imgf.read(1) != b"\xff":
+            return None
+        marker = imgf.read(1)
+        while marker == b"\xff":  # fill bytes
+            marker = imgf.read(1)
+        if not marker:
+            return None
+        code = marker[0]
+        if code == 0x01 or 0xD0 <= code <= 0xD8:  # no payload
+            continue
+        if code in (0xD9, 0xDA):  # image data before any frame header
+            return None
+        header = imgf.read(2)
+        if len(header) < 2:
+            return None
+        length = struct.unpack(">H", header)[0] - 2
+        if code in SOF_MARKERS:
+            frame = imgf.read(5)
+            if len(frame) < 5:
+                return None
+            height, width = struct.unpack(">HH", frame[1:5])
+            return width, height, orientation
+        if code == 0xE1:
+            found = exif_orientation(imgf.read(length))
+            orientation = found or orientation
+        else:
+            imgf.seek(length, 1)
+
+
+def png_size(imgf):
+    """(width, height, 1) from IHDR, None if broken"""
+    header = imgf.read(24)
+    if len(header) < 24 or header[:8] != PNG_SIGNATURE or header[12:16] != b"IHDR":
+        return None
+    width, height = struct.unpack(">II", header[16:24])
+    return width, height, 1
+
+
+def has_end(imgf, marker):
+    """marker within the last bytes of the file"""
+    imgf.seek(0, 2)
+    size = imgf.tell()
+    imgf.seek(max(size - 32, 0))
+    return marker in imgf.read()
+
+
+def read_meta(file_path):
+    """
+    {"width", "height", "orientation", "valid"}, width and height as shown on
+    screen (EXIF rotation applied). valid is False for unreadable, unknown or
+    truncated files.
+    """
+    meta = {"width": 0, "height": 0, "orientation": 1, "valid": False}
+    try:
+        with open(file_path, "rb") as imgf:
+            head = imgf.read(8)
+            imgf.seek(0)
+            if head.startswith(utils.JPEG_START):
+                size, end = jpeg_size(imgf), utils.JPEG_END
+            elif head == PNG_SIGNATURE:
+                size, end = png_size(imgf), PNG_END
+            else:
+                return meta
+            if size is None:
+                return meta
+            width, height, orientation = size
+            if orientation in ROTATED:
+                width, height = height, width
+            meta.update(
+                width=width,
+                height=height,
+                orientation=orientation,
+                valid=has_end(imgf, end) and width > 0 and height > 0,
+            )
+    except (OSError, struct.error):
+        pass
+    return meta
+
+
+def fit_score(width, height, screen_width, screen_height):
+    """
+    0..1, how well an image covers a screen: penalizes upscaling and aspect
+    ratio mismatch, 1 for an image at least as big with the same shape
+    """
+    if not (width and height and screen_width and screen_height):
+        return 0.0
+    scale = min(1.0, width / screen_width, height / screen_height)
+    ratio = width / height
+    screen_ratio = screen_width / screen_height
+    aspect = min(ratio, screen_ratio) / max(ratio, screen_ratio)
+    return (scale * aspect) ** 2
@@ -0,0 +1,208 @@
+"""
+Span timers and counters, exported as a Prometheus textfile and JSON lines
+in the config dir. Disabled by default, a disabled span is a shared no-op
+object and a disabled counter returns at once.
+"""
+
+import os
+import sys
+import json
+import time
+import threading
+
+PREFIX = "wallpaper_"
+PROM_NAME = "metrics-{job}.prom"
+JSONL_NAME = "metrics.jsonl"
+# spans kept for the next export, older ones are dropped
+MAX_EVENTS = 10000
+# the JSON lines file is rotated to .1 past this size
+MAX_JSONL_BYTES = 16 * 1024 * 1024
+
+ENABLED = False
+_STATE = {"directory": None, "job": None}
+_LOCK = threading.Lock()
+_EXPORT_LOCK = threading.Lock()
+_COUNTERS = {}
+_TIMERS = {}
+_EVENTS = []
+
+
+def enable(directory, job=None):
+    """start collecting, exports go to directory"""
+    global ENABLED  # pylint: disable=global-statement
+    _STATE["directory"] = directory
+    script = os.path.splitext(os.path.basename(sys.argv[0]))[0]
+    _STATE["job"] = job or script or "python"
+    ENABLED = True
+
+
+def disable():
+    """stop collecting, what was collected is kept"""
+    global ENABLED  # pylint: disable=global-statement
+    ENABLED = False
+
+
+def reset():
+    """forget everything collected"""
+    with _LOCK:
+        _COUNTERS.clear()
+        _TIMERS.clear()
+        del _EVENTS[:]
+
+
+def label_key(labels):
+    """hashable, ordered labels"""
+    return tuple(
+        sorted(
+            (k, str(v).lower() if isinstance(v, bool) else str(v))
+            for k, v in labels.items()
+        )
+    )
+
+
+def count(name, value=1, **labels):
+    """add to a counter"""
+    if not ENABLED:
+        return
+    key = (name, label_key(labels))
+    with _LOCK:
+        _COUNTERS[key] = _COUNTERS.get(key, 0) + value
+
+
+def observe(name, seconds, **labels):
+    """add one duration to a timer: count, sum and max"""
+    if not ENABLED:
+        return
+    key = (name, label_key(labels))
+    with _LOCK:
+        timer = _TIMERS.setdefault(key, [0, 0.0, 0.0])
+        timer[0] += 1
+        timer[1] += seconds
+        timer[2] = max(timer[2], seconds)
+
+
+class Span:
+    """times a block, set() adds fields to the event written for it"""
+
+    def __init__(self, name, labels):
+        self.name = name
+        self.labels = labels
+        self.fields = {}
+        self.start = 0.0
+
+    def set(self, **fields):
+        """extra event fields, like bytes or status"""
+        self.fields.update(fields)
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, *_):
+        seconds = time.perf_counter() - self.start
+        labels = dict(self.labels)
+        labels["ok"] = exc_type is None and self.fields.get("ok", True) is not False
+        observe(self.name, seconds, **labels)
+        event = {"ts": time.time(), "span": self.name, "seconds": seconds}
+        event.update(self.labels)
+        event.update(self.fields)
+        if exc_type is not None:
+            event["error"] = exc_type.__name__
+        with _LOCK:
+            if len(_EVENTS) >= MAX_EVENTS:
+                del _EVENTS[0]
+            _EVENTS.append(event)
+        return False
+
+
+class NoSpan:
+    """what span() hands out while disabled"""
+
+    def set(self, **fields):
+        """ignored"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        return False
+
+
+NO_SPAN = NoSpan()
+
+
+def span(name, **labels):
+    """with span("socwall_fetch", kind="image") as s: ... s.set(bytes=n)"""
+    if not ENABLED:
+        return NO_SPAN
+    return Span(name, labels)
+
+
+def prom_labels(key, extra=None):
+    """{a="1",b="2"} or nothing"""
+    pairs = list(key) + list((extra or {}).items())
+    if not pairs:
+        return ""
+    escaped = [
+        (k, v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for k, v in pairs
+    ]
+    return "{" + ",".join(f'{k}="{v}"' for k, v in escaped) + "}"
+
+
+def prometheus_text():
+    """everything collected in the Prometheus text format"""
+    job = {"job": _STATE["job"] or ""}
+    lines = []
+    with _LOCK:
+        counters = sorted(_COUNTERS.items())
+        timers = sorted(_TIMERS.items())
+    for name in sorted({name for (name, _), _ in counters}):
+        lines.append(f"# TYPE {PREFIX}{name}_total counter")
+        for (metric, key), value in counters:
+            if metric == name:
+                lines.append(f"{PREFIX}{name}_total{prom_labels(key, job)} {value}")
+    for name in sorted({name for (name, _), _ in timers}):
+        full = f"{PREFIX}{name}_seconds"
+        lines.append(f"# TYPE {full} summary")
+        for (metric, key), (num, total, _) in timers:
+            if metric == name:
+                labels = prom_labels(key, job)
+                lines.append(f"{full}_count{labels} {num}")
+                lines.append(f"{full}_sum{labels} {total:.6f}")
+        lines.append(f"# TYPE {full}_max gauge")
+        for (metric, key), (_, _, longest) in timers:
+            if metric == name:
+                lines.append(f"{full}_max{prom_labels(key, job)} {longest:.6f}")
+    return "\n".join(lines) + "\n"
+
+
+def export(directory=None):
+    """
+    Rewrite this job's textfile and append the spans since the last export
+    to the JSON lines file. Returns the number of spans written.
+    """
+    if not ENABLED:
+        return 0
+    with _EXPORT_LOCK:
+        return write_files(directory or _STATE["directory"])
+
+
+def write_files(directory):
+    """export() body, one export at a time"""
+    prom_path = os.path.join(directory, PROM_NAME.format(job=_STATE["job"]))
+    with open(prom_path + ".part", "w", encoding="utf-8") as promf:
+        promf.write(prometheus_text())
+    # the textfile collector must never see half a file
+    os.replace(prom_path + ".part", prom_path)
+    with _LOCK:
+        events = list(_EVENTS)
+        del _EVENTS[:]
+    if events:
+        jsonl_path = os.path.join(directory, JSONL_NAME)
+        if os.path.exists(jsonl_path) and os.path.getsize(jsonl_path) > MAX_JSONL_BYTES:
+            os.replace(jsonl_path, jsonl_path + ".1")
+        with open(jsonl_path, "a", encoding="utf-8") as logf:
+            for event in events:
+                logf.write(json.dumps(dict(event, job=_STATE["job"])) + "\n")
+    return len(events)
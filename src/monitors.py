@@ -0,0 +1,104 @@
+"""
+Connected monitors and their resolution
+"""
+
+import re
+
+import desktops
+
+# "DP-1 connected primary 2560x1440+0+0 (normal left ..."
+XRANDR_MONITOR = re.compile(
+    r"^(?P<name>\S+) connected (?P<primary>primary )?"
+    r"(?P<width>\d+)x(?P<height>\d+)\+(?P<x>\d+)\+(?P<y>\d+)"
+)
+
+
+def parse_size(text):
+    """'1920x1080' -> (1920, 1080), None if it is not a size"""
+    match = re.match(r"^\s*(\d+)\s*x\s*(\d+)\s*$", text or "")
+    if match is None:
+        return None
+    return int(match.group(1)), int(match.group(2))
+
+
+def parse_xrandr(output):
+    """monitors in xrandr --current output as dicts, primary first"""
+    found = []
+    for line in output.splitlines():
+        match = XRANDR_MONITOR.match(line)
+        if match is None:
+            continue
+        found.append(
+            {
+                "name": match.group("name"),
+                "primary": bool(match.group("primary")),
+                "width": int(match.group("width")),
+                "height": int(match.group("height")),
+                "x": int(match.group("x")),
+                "y": int(match.group("y")),
+            }
+        )
+    found.sort(key=lambda monitor: not monitor["primary"])
+    return found
+
+
+# "2560x1440+0+0", the config stand-in for one xrandr line
+LAYOUT_MONITOR = re.compile(r"^\s*(\d+)x(\d+)\+(\d+)\+(\d+)\s*$")
+
+
+def parse_layout(text):
+    """
+    Monitors of a 'WxH+X+Y,WxH+X+Y' config value, the first one primary,
+    empty if the value is empty or malformed
+    """
+    found = []
+    for num, part in enumerate((text or "").split(",")):
+        match = LAYOUT_MONITOR.match(part)
+        if match is None:
+            return []
+        width, height, x, y = (int(group) for group in match.groups())
+        found.append(
+            {
+                "name": f"monitor{num}",
+                "primary": num == 0,
+                "width": width,
+                "height": height,
+                "x": x,
+                "y": y,
+            }
+        )
+    return found
+
+
+def detect():
+    """monitors reported by xrandr, empty without X or xrandr"""
+    returncode, output = desktops.run_batch([["xrandr", "--current"]], capture=True)[0]
+    if returncode != 0:
+        return []
+    return parse_xrandr(output.decode("utf-8", "replace"))
+
+
+def primary_size(override=None):
+    """(width, height) of the main monitor, override is a 'WxH' config value"""
+    size = parse_size(override)
+    if size is not None:
+        return size
+    found = detect()
+    if not found:
+        return None
+    return found[0]["width"], found[0]["height"]
+
+
+def layout(override=None):
+    """monitors left to right, top to bottom, override is a layout config value"""
+    found = parse_layout(override) or detect()
+    return sorted(found, key=lambda monitor: (monitor["x"], monitor["y"]))
+
+
+def span_box(found):
+    """(left, top, width, height) of the desktop all monitors cover"""
+    left = min(monitor["x"] for monitor in found)
+    top = min(monitor["y"] for monitor in found)
+    right = max(monitor["x"] + monitor["width"] for monitor in found)
+    bottom = max(monitor["y"] + monitor["height"] for monitor in found)
+    return left, top, right - left, bottom - top
@@ -0,0 +1,308 @@
+"""
+asyncio fetch pipeline: listing page -> detail page -> image body
+
+The stage functions are plain blocking callables (they use the pooled
+requests session), the pipeline runs them in a bounded thread pool and
+connects them with bounded queues so parsing overlaps network I/O.
+"""
+
+import time
+import asyncio
+import threading
+from concurrent import futures
+import throttle
+
+DEFAULT_CONCURRENCY = 10
+FETCH_ERRORS = (OSError, IndexError, KeyError, ValueError)
+# seconds a reserved slot holds up the others, a stuck provider then no
+# longer keeps the rest from filling the quota
+SLOT_PATIENCE = 5.0
+# seconds the end of a run waits for calls still running
+STOP_GRACE = 1.0
+
+
+def transient(error):
+    """
+    worth retrying and counted against the site: connection errors,
+    timeouts, 429 and 5xx. Any other HTTP status is the request's fault.
+    """
+    # requests' HTTPError carries the response, no requests import needed
+    status = getattr(getattr(error, "response", None), "status_code", None)
+    if status is not None:
+        return status == 429 or status >= 500
+    return isinstance(error, OSError)
+
+
+class Stopped(Exception):
+    """a stage call that was still queued when the pipeline ended"""
+
+
+class Quota:
+    """
+    Number of successful images. A resolve reserves a slot before it starts
+    and its body fetch keeps it, so no more than the target is resolved or
+    written while every owner moves on. The slots of an owner that gave
+    none back for patience seconds, since its first reservation, are no
+    longer waited for, others may then go past the target. A failed resolve
+    or fetch gives its slot back.
+    """
+
+    def __init__(self, target=None, patience=SLOT_PATIENCE):
+        self.target = target
+        self.patience = patience
+        self.done = 0
+        # slot -> owner, owner -> when it last gave a slot back
+        self.slots = {}
+        self.active = {}
+        self.next_slot = 1
+        self.cond = asyncio.Condition()
+        self.filled = asyncio.Event()
+        if self.full:
+            self.filled.set()
+
+    @property
+    def full(self):
+        """target reached"""
+        return self.target is not None and self.done >= self.target
+
+    def held(self):
+        """(slots still waited for, seconds until the first of them is not)"""
+        if self.patience is None:
+            return len(self.slots), None
+        now = time.monotonic()
+        waited = [
+            self.active[owner]
+            for owner in self.slots.values()
+            if now - self.active[owner] < self.patience
+        ]
+        if not waited:
+            return 0, None
+        return len(waited), min(waited) + self.patience - now
+
+    async def wake(self):
+        """let waiters look at the slots again"""
+        async with self.cond:
+            self.cond.notify_all()
+
+    async def reserve(self, owner=None):
+        """wait for a free slot and return it, None once the quota is full"""
+        loop = asyncio.get_running_loop()
+        async with self.cond:
+            while self.target is not None and not self.full:
+                held, timeout = self.held()
+                if self.done + held < self.target:
+                    break
+                # not wait_for(), it can swallow a cancellation on 3.11
+                wakeup = None
+                if timeout is not None:
+                    wakeup = loop.call_later(
+                        timeout, lambda: loop.create_task(self.wake())
+                    )
+                try:
+                    await self.cond.wait()
+                finally:
+                    if wakeup is not None:
+                        wakeup.cancel()
+            if self.full:
+                return None
+            slot = self.next_slot
+            self.next_slot += 1
+            self.slots[slot] = owner
+            self.active.setdefault(owner, time.monotonic())
+            return slot
+
+    async def release(self, slot, success):
+        """give back a slot"""
+        async with self.cond:
+            self.active[self.slots.pop(slot)] = time.monotonic()
+            if success:
+                self.done += 1
+            if self.full:
+                self.filled.set()
+            self.cond.notify_all()
+
+
+async def join(executor, timeout):
+    """shut executor down, waiting up to timeout seconds for running calls"""
+    loop = asyncio.get_running_loop()
+    joined = loop.create_future()
+
+    def shutdown():
+        executor.shutdown(wait=True, cancel_futures=True)
+        try:
+            loop.call_soon_threadsafe(
+                lambda: joined.done() or joined.set_result(None)
+            )
+        except RuntimeError:  # the loop is gone already
+            pass
+
+    threading.Thread(target=shutdown, daemon=True).start()
+    await asyncio.wait([joined], timeout=timeout)
+
+
+async def run_pipeline(
+    pages,
+    list_page,
+    resolve,
+    fetch,
+    quota=None,
+    concurrency=DEFAULT_CONCURRENCY,
+    queue_size=None,
+    errors=FETCH_ERRORS,
+    on_error=None,
+    seeds=(),
+    counter=None,
+    limiter=None,
+    adaptive=None,
+    breaker=None,
+    retries=0,
+):
+    """
+    Feed every page through list_page(page) -> [ref], resolve(ref) -> job
+    and fetch(job) -> result until pages run out or quota results are in.
+    Refs already known (seeds) go first without a listing fetch. Several
+    pipelines can share one Quota as counter, a limiter (throttle.TokenBucket)
+    paces every stage call. Requests in flight follow adaptive
+    (throttle.AIMDLimit, fixed at concurrency when not given), network
+    errors are retried with jittered backoff and an open breaker
+    (throttle.CircuitBreaker) ends the run. Returns the list of fetch results.
+    """
+    loop = asyncio.get_running_loop()
+    adaptive = adaptive or throttle.AIMDLimit(concurrency, concurrency, concurrency)
+    workers = adaptive.maximum
+    executor = futures.ThreadPoolExecutor(workers)
+    queue_size = queue_size or workers
+    refs = asyncio.Queue(queue_size)
+    jobs = asyncio.Queue(queue_size)
+    counter = counter or Quota(quota)
+    tripped = asyncio.Event()
+    # set on the way out, threads must not start new requests after that
+    stopping = threading.Event()
+    # this run's slots in a shared quota
+    owner = object()
+    results = []
+
+    def paced(func, arg, pace):
+        if pace and limiter is not None:
+            limiter.acquire()
+        if stopping.is_set():
+            raise Stopped()
+        start = time.perf_counter()
+        return func(arg), time.perf_counter() - start
+
+    async def call(stage, func, arg, pace):
+        await adaptive.acquire()
+        start = time.perf_counter()
+        success = False
+        try:
+            result, seconds = await loop.run_in_executor(executor, paced, func, arg, pace)
+            success = True
+            return result
+        finally:
+            if not success:
+                seconds = time.perf_counter() - start
+            await adaptive.release(stage, seconds, success)
+
+    async def guarded(stage, func, arg, pace=True):
+        attempt = 0
+        while True:
+            try:
+                result = await call(stage, func, arg, pace)
+                if breaker is not None:
+                    breaker.success()
+                return True, result
+            except errors as error:  # pylint: disable=catching-non-exception
+                retry = transient(error) and attempt < retries
+                if breaker is not None and transient(error):
+                    breaker.failure()
+                    if breaker.open:
+                        tripped.set()
+                        retry = False
+                if not retry:
+                    if on_error:
+                        on_error(error)
+                    return False, None
+            await asyncio.sleep(throttle.backoff(attempt))
+            attempt += 1
+
+    async def lister():
+        for ref in seeds:
+            await refs.put(ref)
+        for page in pages:
+            if counter.full:
+                break
+            success, found = await guarded("list", list_page, page)
+            if not success:
+                continue
+            for ref in found:
+                await refs.put(ref)
+        for _ in range(workers):
+            await refs.put(None)
+
+    async def resolver():
+        while True:
+            ref = await refs.get()
+            if ref is None:
+                return
+            # a detail page is only worth fetching for a free slot, resolvers
+            # wait here while queued and running jobs cover the quota
+            slot = await counter.reserve(owner)
+            if slot is None:
+                continue
+            success, job = await guarded("resolve", resolve, ref)
+            if success:
+                await jobs.put((slot, job))
+            else:
+                await counter.release(slot, False)
+
+    async def fetcher():
+        while True:
+            slot_job = await jobs.get()
+            if slot_job is None:
+                return
+            slot, job = slot_job
+            # the slot was reserved by the resolver
+            if limiter is not None:
+                await loop.run_in_executor(executor, limiter.acquire)
+            success, result = await guarded("fetch", fetch, job, pace=False)
+            if success:
+                results.append(result)
+            await counter.release(slot, success)
+
+    async def stages():
+        fetchers = [asyncio.ensure_future(fetcher()) for _ in range(workers)]
+        try:
+            await asyncio.gather(lister(), *[resolver() for _ in range(workers)])
+            for _ in fetchers:
+                await jobs.put(None)
+            await asyncio.gather(*fetchers)
+        finally:
+            # when the quota fills first the fetchers must not outlive the executor
+            for task in fetchers:
+                task.cancel()
+            await asyncio.gather(*fetchers, return_exceptions=True)
+
+    tasks = [
+        asyncio.ensure_future(stages()),
+        asyncio.ensure_future(counter.filled.wait()),
+        asyncio.ensure_future(tripped.wait()),
+    ]
+    try:
+        await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        # nothing new starts, calls already running get STOP_GRACE seconds
+        # to finish; waiting off the loop keeps the other providers'
+        # pipelines going meanwhile, a call stuck longer finishes on its own
+        stopping.set()
+        await join(executor, STOP_GRACE)
+    if tripped.is_set() and on_error:
+        on_error(IOError("too many failures in a row, refill stopped early"))
+    return results
+
+
+def download(pages, list_page, resolve, fetch, quota=None, **kwargs):
+    """blocking wrapper around run_pipeline"""
+    return asyncio.run(run_pipeline(pages, list_page, resolve, fetch, quota, **kwargs))
@@ -0,0 +1,165 @@
+"""
+Display sized copies of the wallpapers, made in a process pool and kept in a
+content keyed cache so the desktop never has to scale a huge original
+"""
+
+import os
+import hashlib
+from concurrent import futures
+
+VARIANT_QUALITY = 90
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+HASH_CHUNK = 1024 * 1024
+
+
+def available():
+    """True if Pillow is installed"""
+    try:
+        import PIL  # pylint: disable=import-outside-toplevel,unused-import
+    except ImportError:
+        return False
+    return True
+
+
+def file_sha256(file_path):
+    """hex digest of a file"""
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as imgf:
+        for chunk in iter(lambda: imgf.read(HASH_CHUNK), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def variant_path(cache_dir, content_hash, size):
+    """where the variant of some content for a resolution lives"""
+    return os.path.join(cache_dir, f"{content_hash}-{size[0]}x{size[1]}.jpg")
+
+
+def variant_hash(file_path):
+    """content hash a variant was made from"""
+    return os.path.basename(file_path).rsplit("-", 1)[0]
+
+
+def cover_size(width, height, size):
+    """scaled dimensions of a width x height image covering size"""
+    scale = max(size[0] / width, size[1] / height)
+    return max(size[0], round(width * scale)), max(size[1], round(height * scale))
+
+
+def cover(image, size):
+    """scale and center crop so the image fills size exactly"""
+    from PIL import Image  # pylint: disable=import-outside-toplevel
+
+    scaled = cover_size(image.width, image.height, size)
+    image = image.convert("RGB").resize(scaled, Image.LANCZOS)
+    left = (image.width - size[0]) // 2
+    top = (image.height - size[1]) // 2
+    return image.crop((left, top, left + size[0], top + size[1]))
+
+
+def make_variants(file_path, sizes, cache_dir, content_hash=None):
+    """
+    Worker: write the missing variants of one image, never upscaling.
+    Returns (content hash, variant paths made or already there).
+    """
+    from PIL import Image, ImageOps  # pylint: disable=import-outside-toplevel
+
+    content_hash = content_hash or file_sha256(file_path)
+    made = []
+    missing = []
+    for size in sizes:
+        target = variant_path(cache_dir, content_hash, size)
+        if os.path.exists(target):
+            made.append(target)
+        else:
+            missing.append((size, target))
+    if not missing:
+        return content_hash, made
+
+    with Image.open(file_path) as original:
+        rotated = original.getexif().get(0x0112, 1) in (5, 6, 7, 8)
+        width, height = original.size
+        if rotated:
+            width, height = height, width
+        # covering a size the image is smaller than in either dimension
+        # would upscale, the desktop may as well scale the original then
+        missing = [(s, t) for s, t in missing if width >= s[0] and height >= s[1]]
+        if not missing:
+            return content_hash, made
+        # the JPEG decoder can skip most pixels of a big original
+        need = [cover_size(width, height, size) for size, _ in missing]
+        need = (max(n[0] for n in need), max(n[1] for n in need))
+        original.draft("RGB", (need[1], need[0]) if rotated else need)
+        image = ImageOps.exif_transpose(original)
+        for size, target in missing:
+            partial = target + ".part"
+            cover(image, size).save(partial, "JPEG", quality=VARIANT_QUALITY, optimize=True)
+            os.replace(partial, target)
+            made.append(target)
+    return content_hash, made
+
+
+def prescale(jobs, sizes, cache_dir, workers=None, max_bytes=None):
+    """
+    jobs is a list of (path, known content hash or None). Returns
+    ({path: content hash} for the images done, variants evicted), failures
+    are skipped. With max_bytes the cache is trimmed after every image.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    done = {}
+    removed = []
+    if not jobs or not sizes:
+        return done, removed
+    with futures.ProcessPoolExecutor(workers) as executor:
+        pending = {
+            executor.submit(make_variants, path, sizes, cache_dir, content_hash): path
+            for path, content_hash in jobs
+        }
+        for job in futures.as_completed(pending):
+            try:
+                done[pending[job]] = job.result()[0]
+            except Exception as error:  # pylint: disable=broad-except
+                # one broken or hostile image must not stop the others
+                print(f"Could not prescale {pending[job]}: {error}")
+            if max_bytes is not None:
+                removed += evict(cache_dir, max_bytes)
+    return done, removed
+
+
+def sizes_key(sizes):
+    """stable text for a set of resolutions"""
+    return ",".join(f"{w}x{h}" for w, h in sorted(set(sizes)))
+
+
+def lookup(cache_dir, content_hash, size):
+    """variant path if it is there, marked as just used"""
+    if not content_hash:
+        return None
+    target = variant_path(cache_dir, content_hash, size)
+    try:
+        os.utime(target)
+    except OSError:
+        return None
+    return target
+
+
+def evict(cache_dir, max_bytes=DEFAULT_MAX_BYTES):
+    """drop least recently used variants past max_bytes, returns removed paths"""
+    try:
+        with os.scandir(cache_dir) as found:
+            variants = [
+                (entry.stat().st_mtime, entry.stat().st_size, entry.path)
+                for entry in found
+                if entry.is_file()
+            ]
+    except FileNotFoundError:
+        return []
+    total = sum(size for _, size, _ in variants)
+    removed = []
+    for _, size, path in sorted(variants):
+        if total <= max_bytes:
+            break
+        os.remove(path)
+        removed.append(path)
+        total -= size
+    return removed
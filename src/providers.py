@@ -0,0 +1,241 @@
+"""
+Image providers and the refill that fans out over all of them
+"""
+
+import os
+import json
+import asyncio
+import importlib
+import threading
+
+import pipeline
+import throttle
+
+DEFAULT_QUOTA = 10
+# breaker and learned concurrency of every provider, in the config dir
+STATE_NAME = "providers.json"
+
+# provider name -> "module.Class", imported only when enabled
+PROVIDERS = {
+    "socwall": "socwall.SocwallProvider",
+}
+
+
+class Provider:
+    """
+    Interface of an image source. Candidates come from seeds() (refs known
+    without a listing fetch) and from listing pages(), resolve() turns a
+    ref into a download job and fetch() writes the image to the gallery.
+    """
+
+    name = ""
+    # parallel requests to start with, and requests per second
+    concurrency = 4
+    rate = 5.0
+    # adapt the parallel requests up to this many, None keeps them fixed
+    max_concurrency = None
+    # retries of a failed request, failures in a row that end a refill
+    retries = 2
+    failure_threshold = 10
+    # seconds an open breaker keeps the provider out of refills
+    cooldown = 900
+
+    def __init__(self, path):
+        self.path = path
+        # dedup.Deduplicator shared by the providers of a refill
+        self.dedup = None
+        self.limiter = throttle.TokenBucket(self.rate) if self.rate else None
+
+    @property
+    def state(self):
+        """breaker and learned concurrency, shared by every instance of the name"""
+        return state_of(self)
+
+    @property
+    def breaker(self):
+        """throttle.CircuitBreaker of this provider"""
+        return self.state.breaker
+
+    def seeds(self, count):
+        """refs ready to resolve, up to count"""
+        return []
+
+    def pages(self):
+        """listing pages to go through, in order"""
+        return []
+
+    def list_page(self, page):
+        """refs found on a listing page"""
+        raise NotImplementedError
+
+    def resolve(self, ref):
+        """download job for a ref"""
+        raise NotImplementedError
+
+    def fetch(self, job):
+        """download a job into self.path, returns the new image path"""
+        raise NotImplementedError
+
+    def accept(self, partial, dest):
+        """
+        Check a finished download before it is renamed to dest, raises
+        dedup.DuplicateImage for a picture the gallery already has
+        """
+        if self.dedup is not None:
+            self.dedup.admit(partial, dest)
+        return True
+
+    def on_error(self, error):
+        """a stage failed"""
+        print(f"{self.name}: {error}")
+
+    def done(self):
+        """called once the refill is over"""
+
+
+class ProviderState:
+    """what a provider learned, kept across refills and saved between runs"""
+
+    def __init__(self, concurrency, failure_threshold, cooldown):
+        self.concurrency = concurrency
+        self.breaker = throttle.CircuitBreaker(failure_threshold, cooldown)
+
+    def to_dict(self):
+        """state worth saving"""
+        return dict(self.breaker.to_dict(), concurrency=self.concurrency)
+
+    def restore(self, saved):
+        """take over a state saved by to_dict()"""
+        self.concurrency = saved.get("concurrency", self.concurrency)
+        self.breaker.restore(saved)
+
+
+_STATES = {}
+_SAVED = {}
+_STATES_LOCK = threading.Lock()
+
+
+def state_of(provider):
+    """the ProviderState of a provider's name, made on first use"""
+    with _STATES_LOCK:
+        state = _STATES.get(provider.name)
+        if state is None:
+            state = ProviderState(
+                provider.concurrency, provider.failure_threshold, provider.cooldown
+            )
+            if provider.name in _SAVED:
+                state.restore(_SAVED[provider.name])
+            _STATES[provider.name] = state
+        return state
+
+
+def load_states(directory):
+    """pick up what earlier runs, cron ones included, saved in directory"""
+    try:
+        with open(os.path.join(directory, STATE_NAME), encoding="utf-8") as statef:
+            saved = json.load(statef)
+    except (OSError, ValueError):
+        return
+    with _STATES_LOCK:
+        _SAVED.update(saved)
+        for name, state in _STATES.items():
+            if name in saved:
+                state.restore(saved[name])
+
+
+def save_states(directory):
+    """write every known provider state to directory"""
+    with _STATES_LOCK:
+        _SAVED.update({name: state.to_dict() for name, state in _STATES.items()})
+        saved = dict(_SAVED)
+    state_path = os.path.join(directory, STATE_NAME)
+    with open(state_path + ".part", "w", encoding="utf-8") as statef:
+        json.dump(saved, statef)
+    os.replace(state_path + ".part", state_path)
+
+
+def load(name, path):
+    """instance of a registered provider"""
+    module_name, class_name = PROVIDERS[name].rsplit(".", 1)
+    return getattr(importlib.import_module(module_name), class_name)(path)
+
+
+def enabled(names, path, dedup=None):
+    """instances of the providers configured, unknown names are skipped"""
+    found = []
+    for name in names:
+        if name not in PROVIDERS:
+            print(f"Unknown image provider {name}")
+            continue
+        provider = load(name, path)
+        provider.dedup = dedup
+        found.append(provider)
+    return found
+
+
+async def run_provider(provider, counter, count):
+    """one provider's pipeline, feeding the shared quota"""
+    state = provider.state
+    if state.breaker.open:
+        provider.on_error(IOError("failing recently, skipped"))
+        return []
+    loop = asyncio.get_running_loop()
+    seeds = await loop.run_in_executor(None, provider.seeds, count)
+    pages = await loop.run_in_executor(None, provider.pages)
+    adaptive = None
+    if provider.max_concurrency:
+        adaptive = throttle.AIMDLimit(
+            state.concurrency, maximum=provider.max_concurrency
+        )
+    results = await pipeline.run_pipeline(
+        pages,
+        provider.list_page,
+        provider.resolve,
+        provider.fetch,
+        concurrency=state.concurrency,
+        on_error=provider.on_error,
+        seeds=seeds,
+        counter=counter,
+        limiter=provider.limiter,
+        adaptive=adaptive,
+        breaker=state.breaker,
+        retries=provider.retries,
+    )
+    if adaptive is not None:
+        # the next refill starts from what was learned
+        state.concurrency = adaptive.current
+    return [(provider.name, result) for result in results]
+
+
+async def run_all(providers, n_images):
+    """every provider at once, stops when n_images arrived in total"""
+    counter = pipeline.Quota(n_images)
+    outcomes = await asyncio.gather(
+        *[run_provider(provider, counter, n_images) for provider in providers],
+        return_exceptions=True,
+    )
+    downloaded = []
+    for provider, outcome in zip(providers, outcomes):
+        if isinstance(outcome, BaseException):
+            # one provider going down does not stop the others
+            provider.on_error(outcome)
+        else:
+            downloaded += outcome
+        provider.done()
+    return downloaded
+
+
+def fetch_all(providers, n_images=DEFAULT_QUOTA, state_dir=None):
+    """
+    Refill from all providers, returns [(provider name, image path)].
+    Provider states are read from and saved to state_dir if given.
+    """
+    if not providers:
+        return []
+    if state_dir is not None:
+        load_states(state_dir)
+    try:
+        return asyncio.run(run_all(providers, n_images))
+    finally:
+        if state_dir is not None:
+            save_states(state_dir)
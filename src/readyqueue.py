@@ -0,0 +1,107 @@
+"""
+Persisted queue of the next wallpapers, already picked, checked and prescaled
+so a rotation only has to pop the head and call the desktop
+"""
+
+import os
+import json
+import contextlib
+
+try:
+    import fcntl
+except ImportError:  # Windows, writes are still atomic
+    fcntl = None
+
+DEFAULT_SIZE = 5
+DEFAULT_LOW_WATER = 2
+
+
+class ReadyQueue:
+    """list of {"path", "display"} entries in a json file"""
+
+    def __init__(self, file_name, size=DEFAULT_SIZE, low_water=DEFAULT_LOW_WATER):
+        self.file_name = file_name
+        self.size = size
+        self.low_water = low_water
+
+    @contextlib.contextmanager
+    def locked(self):
+        """exclusive access for a read-modify-write across processes"""
+        with open(self.file_name + ".lock", "a+", encoding="utf-8") as lockf:
+            if fcntl:
+                fcntl.flock(lockf.fileno(), fcntl.LOCK_EX)
+            yield
+
+    def load(self):
+        """entries in order, empty if the file is missing or broken"""
+        try:
+            with open(self.file_name, "r", encoding="utf-8") as queuef:
+                entries = json.load(queuef)
+        except (OSError, ValueError):
+            return []
+        return [e for e in entries if isinstance(e, dict) and "path" in e]
+
+    def save(self, entries):
+        """replace the file atomically"""
+        partial = self.file_name + ".part"
+        with open(partial, "w", encoding="utf-8") as queuef:
+            json.dump(entries, queuef)
+        os.replace(partial, self.file_name)
+
+    def __len__(self):
+        return len(self.load())
+
+    def is_low(self):
+        """True when it is time to refill"""
+        return len(self) < self.low_water
+
+    def pop(self):
+        """head entry whose image still exists, None if the queue ran dry"""
+        with self.locked():
+            entries = self.load()
+            while entries:
+                entry = entries.pop(0)
+                if os.path.exists(entry["path"]):
+                    self.save(entries)
+                    if entry.get("display") and not os.path.exists(entry["display"]):
+                        entry["display"] = entry["path"]
+                    return entry
+            self.save(entries)
+        return None
+
+    def fill(self, pick, prepare=None):
+        """
+        Add entries up to size. pick(exclude) returns a path not in exclude
+        or None, prepare(path) returns the file to hand to the desktop.
+        Returns the number of entries added.
+        """
+        with self.locked():
+            entries = [e for e in self.load() if os.path.exists(e["path"])]
+            added = 0
+            while len(entries) < self.size:
+                path = pick([e["path"] for e in entries])
+                if path is None:
+                    break
+                display = prepare(path) if prepare else path
+                entries.append({"path": path, "display": display})
+                added += 1
+            self.save(entries)
+        return added
+
+    def paths(self):
+        """images queued, in order"""
+        return [e["path"] for e in self.load()]
+
+    def refresh(self, prepare):
+        """hand prepare(path) to the desktop for every entry from now on"""
+        with self.locked():
+            entries = self.load()
+            for entry in entries:
+                entry["display"] = prepare(entry["path"])
+            self.save(entries)
+
+    def discard(self, paths):
+        """drop entries, for images that were removed"""
+        paths = set(paths)
+        with self.locked():
+            self.save([e for e in self.load() if e["path"] not in paths])
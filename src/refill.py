@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+Gallery refill as a detached background job.
+
+A lock file in the config dir makes sure only one refill runs at a time,
+a pending marker coalesces triggers: whoever holds the lock keeps refilling
+while somebody asked for it, everybody else just leaves the marker.
+"""
+
+from __future__ import print_function
+
+import os
+import sys
+import subprocess
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+LOCK_NAME = "refill.lock"
+PENDING_NAME = "refill.pending"
+LOG_NAME = "refill.log"
+
+
+class RefillLock:
+    """non blocking exclusive lock on a file, released on close or process exit"""
+
+    def __init__(self, lock_path):
+        self.lock_path = lock_path
+        self.lockf = None
+
+    def acquire(self):
+        """True if we got the lock"""
+        self.lockf = open(self.lock_path, "a+", encoding="utf-8")
+        try:
+            if fcntl:
+                fcntl.flock(self.lockf.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            else:
+                msvcrt.locking(self.lockf.fileno(), msvcrt.LK_NBLCK, 1)
+        except OSError:
+            self.lockf.close()
+            self.lockf = None
+            return False
+        return True
+
+    def release(self):
+        """let the next refill in"""
+        if self.lockf is not None:
+            self.lockf.close()
+            self.lockf = None
+
+    def __enter__(self):
+        return self.acquire()
+
+    def __exit__(self, *_):
+        self.release()
+
+
+def lock_path(config_dir):
+    """refill lock file"""
+    return os.path.join(config_dir, LOCK_NAME)
+
+
+def pending_path(config_dir):
+    """refill requested marker"""
+    return os.path.join(config_dir, PENDING_NAME)
+
+
+def mark_pending(config_dir):
+    """ask for a refill"""
+    with open(pending_path(config_dir), "a", encoding="utf-8"):
+        pass
+
+
+def take_pending(config_dir):
+    """True if a refill was asked for, clearing the request"""
+    try:
+        os.remove(pending_path(config_dir))
+        return True
+    except FileNotFoundError:
+        return False
+
+
+def is_running(config_dir):
+    """True while some process holds the refill lock"""
+    probe = RefillLock(lock_path(config_dir))
+    if probe.acquire():
+        probe.release()
+        return False
+    return True
+
+
+def refill_locked(wm):
+    """
+    Run wm.gallery_maintenance() for every pending request, unless another
+    process is refilling already. Returns the number of refills done here.
+    """
+    config_dir = wm.conf.config_dir
+    done = 0
+    while True:
+        with RefillLock(lock_path(config_dir)) as locked:
+            if not locked:
+                return done
+            while take_pending(config_dir):
+                wm.gallery_maintenance()
+                done += 1
+        # a request that came in while releasing would be lost otherwise
+        if not os.path.exists(pending_path(config_dir)):
+            return done
+
+
+def request_refill(config_dir):
+    """
+    Ask for a refill and return at once, a detached process is started
+    only if no refill is already running to pick up the request
+    """
+    mark_pending(config_dir)
+    if is_running(config_dir):
+        return None
+    kwargs = {}
+    if fcntl:
+        kwargs["start_new_session"] = True
+    else:
+        kwargs["creationflags"] = subprocess.DETACHED_PROCESS
+    with open(os.path.join(config_dir, LOG_NAME), "a", encoding="utf-8") as logf:
+        return subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__)],
+            stdin=subprocess.DEVNULL,
+            stdout=logf,
+            stderr=subprocess.STDOUT,
+            close_fds=True,
+            **kwargs,
+        )
+
+
+if __name__ == "__main__":
+    import wallpaper
+    import metrics
+
+    refill_locked(wallpaper.Wallpaper())
+    metrics.export()
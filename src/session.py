@@ -0,0 +1,260 @@
+"""
+Shared, pooled keep-alive HTTP sessions for the image providers
+"""
+
+import os
+import time
+import threading
+from urllib.parse import urlsplit
+import requests
+from requests.adapters import HTTPAdapter
+
+import metrics
+
+CONNECT_TIMEOUT = 5
+READ_TIMEOUT = 30
+
+CHUNK_SIZE = 64 * 1024
+# chunks fed to extractors, small so they can stop early
+HTML_CHUNK_SIZE = 8 * 1024
+# after an early stop, read at most this much more to keep the connection
+DRAIN_LIMIT = 64 * 1024
+PARTIAL_SUFFIX = ".part"
+
+_SESSIONS = {}
+_SESSIONS_LOCK = threading.Lock()
+
+
+class DownloadError(IOError):
+    """download incomplete or corrupt, the partial file is kept when resumable"""
+
+
+def http_status(error):
+    """status code of the response behind an HTTPError, None for other errors"""
+    return getattr(getattr(error, "response", None), "status_code", None)
+
+
+def content_total(response, offset):
+    """full size of the resource from Content-Range or Content-Length, None if unknown"""
+    content_range = response.headers.get("Content-Range", "")
+    if response.status_code == 206 and "/" in content_range:
+        total = content_range.rsplit("/", 1)[1]
+        return int(total) if total.isdigit() else None
+    length = response.headers.get("Content-Length")
+    if length is not None and length.isdigit():
+        return offset + int(length)
+    return None
+
+
+def drain(response, limit=DRAIN_LIMIT):
+    """
+    Read what is left of a small response so its connection goes back to
+    the pool, big leftovers are cheaper to drop with the connection
+    """
+    read = 0
+    # straight from the socket: iter_content() raises once the selector
+    # already read the whole body
+    for chunk in response.raw.stream(HTML_CHUNK_SIZE, decode_content=False):
+        read += len(chunk)
+        if read > limit:
+            return False
+    return True
+
+
+class PooledSession:
+    """
+    requests.Session with a connection pool sized for a thread pool,
+    default timeouts and per request timing
+    """
+
+    def __init__(self, pool_size, headers=None, timeout=(CONNECT_TIMEOUT, READ_TIMEOUT)):
+        self.timeout = timeout
+        self.session = requests.Session()
+        # pool_block makes extra threads wait for a pooled connection
+        # instead of opening throw away ones
+        self.adapter = HTTPAdapter(
+            pool_connections=1, pool_maxsize=pool_size, pool_block=True
+        )
+        self.session.mount("http://", self.adapter)
+        self.session.mount("https://", self.adapter)
+        self.session.headers.update(headers or {})
+        self.session.headers["Connection"] = "keep-alive"
+        self.lock = threading.Lock()
+        # running totals, a resident daemon keeps its sessions for days
+        self.requests = 0
+        self.errors = 0
+        self.seconds = 0.0
+        # httpcache.ResponseCache for extract, set by the provider
+        self.cache = None
+        self.cache_hits = 0
+
+    def get(self, url, **kwargs):
+        """timed GET, time is measured up to the response headers"""
+        kwargs.setdefault("timeout", self.timeout)
+        start = time.perf_counter()
+        try:
+            response = self.session.get(url, **kwargs)
+        except requests.RequestException:
+            self.record(url, None, time.perf_counter() - start)
+            raise
+        self.record(url, response.status_code, time.perf_counter() - start)
+        return response
+
+    def extract(self, url, selector, ttl=None):
+        """
+        selector.extract() run on the page as it streams in. The extracted
+        values are cached per url and selector, used as they are while
+        younger than ttl seconds and revalidated with
+        If-None-Match/If-Modified-Since when older.
+        """
+        key = url + "#" + selector.name
+        cached = self.cache.lookup(key) if self.cache is not None else None
+        if cached is not None and ttl is not None and cached[3] < ttl:
+            with self.lock:
+                self.cache_hits += 1
+            return cached[0].decode("utf-8").split("\n") if cached[0] else []
+        headers = {}
+        if cached is not None:
+            if cached[1]:
+                headers["If-None-Match"] = cached[1]
+            if cached[2]:
+                headers["If-Modified-Since"] = cached[2]
+        response = self.get(url, headers=headers, stream=True)
+        try:
+            if response.status_code == 304 and cached is not None:
+                self.cache.refresh(key)
+                return cached[0].decode("utf-8").split("\n") if cached[0] else []
+            response.raise_for_status()
+            found = selector.extract(response.iter_content(HTML_CHUNK_SIZE))
+            drain(response)
+        finally:
+            response.close()
+        if self.cache is not None:
+            self.cache.store(
+                key,
+                "\n".join(found).encode("utf-8"),
+                response.headers.get("ETag"),
+                response.headers.get("Last-Modified"),
+            )
+        return found
+
+    def download(self, url, dest, validate=None):
+        """
+        Stream url into dest.part, resuming with a Range request if a partial
+        file is there, check the size and validate(path) then rename into dest.
+        A ValueError from validate drops the partial file and is passed on.
+        """
+        partial = dest + PARTIAL_SUFFIX
+        offset = os.path.getsize(partial) if os.path.exists(partial) else 0
+        headers = {"Range": f"bytes={offset}-"} if offset else {}
+        response = self.get(url, stream=True, headers=headers)
+        try:
+            if response.status_code == 416:
+                # nothing left to send, the partial file may be complete already
+                total = offset
+            else:
+                response.raise_for_status()
+                resumed = response.status_code == 206 and response.headers.get(
+                    "Content-Range", ""
+                ).startswith(f"bytes {offset}-")
+                if not resumed:
+                    offset = 0
+                total = content_total(response, offset)
+                timing = metrics.ENABLED
+                write_seconds = 0.0
+                written = 0
+                with open(partial, "ab" if resumed else "wb") as outf:
+                    for chunk in response.iter_content(CHUNK_SIZE):
+                        if timing:
+                            start = time.perf_counter()
+                            outf.write(chunk)
+                            write_seconds += time.perf_counter() - start
+                        else:
+                            outf.write(chunk)
+                        written += len(chunk)
+                metrics.observe("file_write", write_seconds)
+                metrics.count("download_bytes", written)
+        finally:
+            # give the connection back to the pool
+            response.close()
+
+        size = os.path.getsize(partial)
+        if total is not None and size < total:
+            raise DownloadError(f"{url}: got {size} of {total} bytes, will resume")
+        try:
+            with metrics.span("validate"):
+                valid = (total is None or size == total) and (
+                    validate is None or validate(partial)
+                )
+        except ValueError:
+            # rejected by the validator (a duplicate), no point in resuming it
+            os.remove(partial)
+            raise
+        if not valid:
+            os.remove(partial)
+            raise DownloadError(f"{url}: corrupt download discarded")
+        os.replace(partial, dest)
+        return dest
+
+    def record(self, url, status, seconds):
+        """count one request and its time"""
+        with self.lock:
+            self.requests += 1
+            self.errors += status is None or status >= 400
+            self.seconds += seconds
+        if metrics.ENABLED:
+            host = urlsplit(url).netloc
+            metrics.count("http_responses", host=host, status=status or "error")
+            metrics.observe("http_headers", seconds, host=host)
+
+    def connections_opened(self):
+        """number of TCP connections opened so far"""
+        pools = self.adapter.poolmanager.pools
+        opened = 0
+        for key in list(pools.keys()):
+            try:
+                opened += pools[key].num_connections
+            except KeyError:
+                pass
+        return opened
+
+    def stats(self):
+        """summary of requests made and connections needed for them"""
+        with self.lock:
+            requests_made, errors, total = self.requests, self.errors, self.seconds
+        return {
+            "requests": requests_made,
+            "errors": errors,
+            "connections": self.connections_opened(),
+            "cache_hits": self.cache_hits,
+            "seconds": total,
+            "avg_seconds": total / requests_made if requests_made else 0.0,
+        }
+
+    def reset_stats(self):
+        """start the totals over"""
+        with self.lock:
+            self.requests = 0
+            self.errors = 0
+            self.seconds = 0.0
+            self.cache_hits = 0
+
+    def close(self):
+        """close pooled connections"""
+        self.session.close()
+
+
+def get_session(name, pool_size, headers=None):
+    """one shared session per provider name"""
+    with _SESSIONS_LOCK:
+        if name not in _SESSIONS:
+            _SESSIONS[name] = PooledSession(pool_size, headers)
+        return _SESSIONS[name]
+
+
+def close_all():
+    """close every shared session"""
+    with _SESSIONS_LOCK:
+        for pooled in _SESSIONS.values():
+            pooled.close()
+        _SESSIONS.clear()
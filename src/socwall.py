@@ -1,93 +1,255 @@
 #!/usr/bin/env python3
 """ Parse and download wallpapers from socwall.com """
 
-import shutil
-import random
-from concurrent import futures
-import requests
-from lxml import html
+import os
+import glob
+import threading
+import session
+import pipeline
+import catalog
+import providers
+import httpcache
+import extract
+import utils
+import dedup
+import metrics
 
 SOCWALL_VERBOSE = True
 SOCWALL_DOMAIN = "http://www.socwall.com/"
 
-# TODO: find the number of pages available
+# first guess for the number of pages, the real one is discovered and cached
 SOCWALL_MAX = 709
+SOCWALL_CATALOG = ".socwall.db"
 
 
+# requests in flight to start with, adapted up to SOCWALL_MAX_EXECUTORS
 SOCWALL_EXECUTORS = 10
+SOCWALL_MAX_EXECUTORS = 32
+# requests per second
+SOCWALL_RATE = 10
 HEADERS = {
     "User-Agent": "Mozilla/5.0 (Windows NT 6.1) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/41.0.2228.0 Safari/537.36"
 }
 
+# how long pages are used from the cache before revalidating them
+LISTING_TTL = 24 * 3600
+DETAIL_TTL = 30 * 24 * 3600
 
-def download_img(img_name, path):
-    """Download one specific image"""
-    image_id = img_name.split("/")[2]
+IMAGE_LINKS = extract.AnchorSelector("socwall-images", "image")
+DOWNLOAD_LINK = extract.AnchorSelector("socwall-download", "download", limit=1)
+
+_CATALOGS = {}
+_CATALOGS_LOCK = threading.Lock()
+
+
+def get_session():
+    """pooled session shared by every socwall download thread"""
+    pooled = session.get_session(SOCWALL_DOMAIN, SOCWALL_MAX_EXECUTORS, HEADERS)
+    if pooled.cache is None:
+        pooled.cache = httpcache.ResponseCache()
+    return pooled
+
+
+def print_stats():
+    """connection reuse report"""
+    stats = get_session().stats()
+    print(
+        f"socwall: {stats['requests']} requests over {stats['connections']}"
+        f" connections, {stats['avg_seconds']:.3f}s avg to headers,"
+        f" {stats['cache_hits']} pages from cache"
+    )
+
+
+def get_catalog(path):
+    """catalog of socwall ids, kept in the gallery folder"""
+    with _CATALOGS_LOCK:
+        if path not in _CATALOGS:
+            db_path = os.path.join(path, SOCWALL_CATALOG)
+            is_new = not os.path.exists(db_path)
+            _CATALOGS[path] = catalog.Catalog(db_path)
+            if is_new:
+                # images downloaded before the catalog existed
+                for old in glob.glob(os.path.join(path, "socwall-*.jpg")):
+                    image_id = os.path.basename(old)[len("socwall-") : -len(".jpg")]
+                    _CATALOGS[path].mark_downloaded(image_id)
+        return _CATALOGS[path]
+
+
+def image_href(image_id):
+    """link to the detail page of an image"""
+    return f"/desktop-wallpaper/{image_id}/wallpaper/"
+
+
+def image_id_of(img_name):
+    """/desktop-wallpaper/<id>/... -> id"""
+    return img_name.split("/")[2]
+
+
+def list_page(num):
+    """image links (/desktop-wallpaper/<id>/...) on one listing page"""
+    url = SOCWALL_DOMAIN + f"wallpapers/page:{num}/"
+    with metrics.span("socwall_fetch", kind="listing"):
+        return get_session().extract(url, IMAGE_LINKS, LISTING_TTL)
+
+
+def resolve_img(img_name):
+    """(image_id, image url) from the detail page of an image link"""
+    image_id = image_id_of(img_name)
     img_url = SOCWALL_DOMAIN + f"/desktop-wallpaper/{image_id}/wallpaper/"
-    page = requests.get(img_url, headers=HEADERS)
-    doctree = html.fromstring(page.content)
-    imagepath = doctree.xpath("//a[@class='download']")[0].attrib["href"]
+    with metrics.span("socwall_fetch", kind="detail"):
+        imagepath = get_session().extract(img_url, DOWNLOAD_LINK, DETAIL_TTL)[0]
+    return image_id, SOCWALL_DOMAIN + imagepath
+
+
+def fetch_img(image_id, image_url, path, accept=None):
+    """Download the image body, accept(partial, dest) can still turn it down"""
     if SOCWALL_VERBOSE:
-        print(f"Downloading {SOCWALL_DOMAIN + imagepath}")
-    image = requests.get(SOCWALL_DOMAIN + imagepath, headers=HEADERS, stream=True)
+        print(f"Downloading {image_url}")
     new_image_path = path + "/socwall-" + image_id + ".jpg"
-    with open(new_image_path, "wb+") as outf:
-        shutil.copyfileobj(image.raw, outf)
-    del image
+
+    def validate(partial):
+        if not utils.is_complete_jpeg(partial):
+            return False
+        return accept is None or accept(partial, new_image_path)
+
+    with metrics.span("socwall_fetch", kind="image") as span:
+        get_session().download(image_url, new_image_path, validate=validate)
+        span.set(bytes=os.path.getsize(new_image_path))
     return new_image_path
 
 
+def download_img(img_name, path):
+    """Download one specific image"""
+    image_id, image_url = resolve_img(img_name)
+    return fetch_img(image_id, image_url, path)
+
+
+def report_error(error):
+    """failed stage in the pipeline"""
+    if SOCWALL_VERBOSE:
+        print(f"Download failed: {error}")
+
+
+def catalog_page(cat, num):
+    """list a page and remember its ids"""
+    ids = [image_id_of(href) for href in list_page(num)]
+    cat.add_page(num, ids)
+    return ids
+
+
+def page_count(cat, limiter=None):
+    """
+    number of listing pages, discovered by probing and cached. A page past
+    the last one answers 404, any other failure keeps the known count.
+    """
+
+    def probe(num):
+        if limiter is not None:
+            limiter.acquire()
+        try:
+            return bool(catalog_page(cat, num))
+        except pipeline.FETCH_ERRORS as error:
+            if session.http_status(error) == 404:
+                return False
+            raise
+
+    return cat.page_count(probe, SOCWALL_MAX, pipeline.FETCH_ERRORS)
+
+
+class SocwallProvider(providers.Provider):
+    """socwall.com, candidates come from the catalog first then listing pages"""
+
+    name = "socwall"
+    concurrency = SOCWALL_EXECUTORS
+    max_concurrency = SOCWALL_MAX_EXECUTORS
+    rate = SOCWALL_RATE
+
+    def __init__(self, path, pages=None):
+        super().__init__(path)
+        self.cat = get_catalog(path)
+        self.fixed_pages = pages
+        self.queued = set()
+
+    def seeds(self, count):
+        if self.fixed_pages is not None:
+            return []
+        found = self.cat.sample_unseen(count)
+        self.queued.update(found)
+        return found
+
+    def pages(self):
+        if self.fixed_pages is not None:
+            return self.fixed_pages
+        return self.cat.pages_to_list(page_count(self.cat, self.limiter))
+
+    def list_page(self, page):
+        found = []
+        for image_id in catalog_page(self.cat, page):
+            if image_id not in self.queued and not self.cat.is_downloaded(image_id):
+                self.queued.add(image_id)
+                found.append(image_id)
+        return found
+
+    def resolve(self, ref):
+        return resolve_img(image_href(ref))
+
+    def fetch(self, job):
+        try:
+            new_image_path = fetch_img(job[0], job[1], self.path, self.accept)
+        except dedup.DuplicateImage:
+            # a re-upload, never worth fetching again
+            self.cat.mark_downloaded(job[0])
+            raise
+        self.cat.mark_downloaded(job[0])
+        return new_image_path
+
+    def on_error(self, error):
+        report_error(error)
+
+    def done(self):
+        if SOCWALL_VERBOSE:
+            print_stats()
+
+
 def dl_one(path):
-    """Get one image"""
-    num = random.randint(1, SOCWALL_MAX)
-    url = SOCWALL_DOMAIN + f"wallpapers/page:{num}/"
-    source = requests.get(url, headers=HEADERS)
-    doctree = html.fromstring(source.content)
-    images = doctree.xpath("//a[@class='image']")
-    aref = random.choice(images)
-    return download_img(aref.attrib["href"], path)
+    """
+    Get one image, straight from the catalog when it has unseen ids.
+    Raises IOError when a few listing pages gave no candidate.
+    """
+    cat = get_catalog(path)
+    unseen = cat.sample_unseen(1)
+    if not unseen:
+        # no probing here, this has to be fast
+        known_pages = int(cat.get_meta("page_count") or SOCWALL_MAX)
+        for num in cat.pages_to_list(known_pages)[:3]:
+            try:
+                catalog_page(cat, num)
+            except pipeline.FETCH_ERRORS as error:
+                # a guessed page past the real last one answers 404
+                report_error(error)
+                continue
+            unseen = cat.sample_unseen(1)
+            if unseen:
+                break
+    if not unseen:
+        raise IOError("no unseen socwall image found")
+    image_id, image_url = resolve_img(image_href(unseen[0]))
+    new_image_path = fetch_img(image_id, image_url, path)
+    cat.mark_downloaded(image_id)
+    return new_image_path
 
 
 def dl_page(num, path):
     """Download one page of imgs"""
-    url = SOCWALL_DOMAIN + f"wallpapers/page:{num}/"
-    # print(URL)
-    source = requests.get(url, headers=HEADERS)
-    doctree = html.fromstring(source.content)
-    images = doctree.xpath("//a[@class='image']")
-
-    counter = 0
-
-    with futures.ThreadPoolExecutor(SOCWALL_EXECUTORS) as executor:
-        for aref in images:
-            # print(aref.attrib['href'])
-            executor.submit(download_img, aref.attrib["href"], path)
-            counter += 1
-    return counter
+    provider = SocwallProvider(path, pages=[num])
+    return [img for _, img in providers.fetch_all([provider], None)]
 
 
-def dl_random_images(path, n_images=10):
+def dl_random_images(path, n_images=providers.DEFAULT_QUOTA):
     """
-    download that number of images randomly
+    download that number of images randomly, returns the new image paths
     """
-    page_numbers = []
-    # load previous pages
-    try:
-        with open(path + "/.page_numbers", "r", encoding="utf-8") as logf:
-            # page_numbers = map(lambda s: s.strip(), logf.readlines())
-            page_numbers = [s.strip() for s in logf.readlines()]
-    except PermissionError:
-        print("No previous downloads found")
-
-    while n_images > 0:
-        pagen = random.randint(1, SOCWALL_MAX)
-        while pagen in page_numbers:
-            pagen = random.randint(1, SOCWALL_MAX)
-        num_images = dl_page(pagen, path)
-        if num_images > 0:
-            n_images = n_images - num_images
-            with open(path + "/.page_numbers", "a+", encoding="utf-8") as logf:
-                logf.write(str(pagen) + "\n")
+    return [img for _, img in providers.fetch_all([SocwallProvider(path)], n_images)]
 
 
 # if __name__ == "__main__":
@@ -0,0 +1,159 @@
+"""
+Rate limiting, adaptive concurrency, retries and circuit breaking for the
+image providers
+"""
+
+import time
+import random
+import asyncio
+import threading
+
+
+class TokenBucket:
+    """
+    At most rate requests per second on average with bursts of capacity,
+    acquire() blocks the calling thread until a token is there
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity or max(rate, 1))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def refill(self):
+        """add the tokens earned since the last call, lock held"""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_acquire(self):
+        """take a token if there is one, never blocks"""
+        with self.lock:
+            self.refill()
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return True
+            return False
+
+    def acquire(self):
+        """wait for a token"""
+        while True:
+            with self.lock:
+                self.refill()
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class AIMDLimit:
+    """
+    Number of requests allowed in flight, additive increase while responses
+    are fine, halved (once per round trip) on errors or on responses much
+    slower than usual. Used from a single event loop.
+    """
+
+    def __init__(self, initial, minimum=1, maximum=None, slow_factor=3.0):
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum or initial
+        self.slow_factor = slow_factor
+        self.in_flight = 0
+        self.baselines = {}
+        self.last_decrease = 0.0
+        self.cond = None
+
+    @property
+    def current(self):
+        """whole number of requests allowed right now"""
+        return max(int(self.limit), self.minimum)
+
+    async def acquire(self):
+        """wait for room under the limit"""
+        if self.cond is None:
+            self.cond = asyncio.Condition()
+        async with self.cond:
+            while self.in_flight >= self.current:
+                await self.cond.wait()
+            self.in_flight += 1
+
+    async def release(self, stage, seconds, success):
+        """a request finished, adjust the limit"""
+        async with self.cond:
+            self.in_flight -= 1
+            self.observe(stage, seconds, success)
+            self.cond.notify_all()
+
+    def observe(self, stage, seconds, success):
+        """AIMD step from one response, baselines are kept per stage"""
+        baseline = self.baselines.get(stage)
+        slow = success and baseline is not None and seconds > baseline * self.slow_factor
+        if success and not slow:
+            self.baselines[stage] = seconds if baseline is None else 0.9 * baseline + 0.1 * seconds
+            self.limit = min(self.maximum, self.limit + 1.0 / self.limit)
+            return
+        now = time.monotonic()
+        # one decrease per round trip, the requests in flight saw the same trouble
+        if now - self.last_decrease > (baseline or 1.0):
+            self.limit = max(self.minimum, self.limit / 2)
+            self.last_decrease = now
+
+
+class CircuitBreaker:
+    """
+    Open after threshold failures in a row, closes again after cooldown
+    seconds. Wall clock time, so the state can be saved and reloaded by
+    another process.
+    """
+
+    def __init__(self, threshold=5, cooldown=60):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self.lock = threading.Lock()
+
+    @property
+    def open(self):
+        """True while requests should not be made"""
+        with self.lock:
+            if self.opened_at is None:
+                return False
+            if time.time() - self.opened_at >= self.cooldown:
+                # half open, let the next request find out
+                self.opened_at = None
+                self.failures = self.threshold - 1
+                return False
+            return True
+
+    def success(self):
+        """a request worked"""
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def failure(self):
+        """a request failed"""
+        with self.lock:
+            self.failures += 1
+            if self.failures >= self.threshold:
+                self.opened_at = time.time()
+
+    def to_dict(self):
+        """state worth saving"""
+        with self.lock:
+            return {"failures": self.failures, "opened_at": self.opened_at}
+
+    def restore(self, saved):
+        """take over a state saved by to_dict()"""
+        with self.lock:
+            self.failures = saved.get("failures", 0)
+            self.opened_at = saved.get("opened_at")
+
+
+def backoff(attempt, base=0.5, cap=30.0):
+    """full jitter exponential backoff, seconds to wait before retry attempt + 1"""
+    return random.uniform(0, min(cap, base * 2 ** attempt))
@@ -0,0 +1,122 @@
+"""
+Thumbnails for the gallery browser: made in a process pool, kept as PNG
+(Tk reads those without Pillow) in a size bounded cache keyed by path and
+mtime, handed back through a queue the Tk main loop polls
+"""
+
+import os
+import queue
+import hashlib
+import threading
+import multiprocessing
+from concurrent import futures
+
+import prescale
+
+THUMBNAIL_SIZE = (160, 100)
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+
+
+def cache_key(file_path, mtime):
+    """name of the thumbnail of one version of a file"""
+    return hashlib.sha1(f"{file_path}\0{mtime}".encode("utf-8")).hexdigest()
+
+
+def make_thumbnail(file_path, target, size=THUMBNAIL_SIZE):
+    """Worker: write a PNG thumbnail of file_path to target, returns target"""
+    from PIL import Image, ImageOps  # pylint: disable=import-outside-toplevel
+
+    with Image.open(file_path) as original:
+        # the JPEG decoder can skip most pixels
+        original.draft("RGB", (size[0] * 2, size[1] * 2))
+        image = ImageOps.exif_transpose(original).convert("RGB")
+        image.thumbnail(size)
+        partial = target + ".part"
+        image.save(partial, "PNG")
+    os.replace(partial, target)
+    return target
+
+
+class Thumbnailer:
+    """
+    request() returns a cached thumbnail at once or queues it for the pool,
+    finished() hands out what the workers made since the last call
+    """
+
+    def __init__(self, cache_dir, max_bytes=DEFAULT_MAX_BYTES, workers=None):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+        # forked workers would share the Tk process' X connection
+        self.executor = futures.ProcessPoolExecutor(
+            workers, mp_context=multiprocessing.get_context("spawn")
+        )
+        self.pending = {}
+        # files Pillow could not read, not tried again in this session
+        self.failed = set()
+        self.results = queue.Queue()
+        self.lock = threading.Lock()
+        self.made = 0
+
+    def path_of(self, file_path, mtime):
+        """where the thumbnail of a file version lives"""
+        return os.path.join(self.cache_dir, cache_key(file_path, mtime) + ".png")
+
+    def request(self, file_path, mtime):
+        """thumbnail path if cached, otherwise None and it is being made"""
+        target = self.path_of(file_path, mtime)
+        try:
+            os.utime(target)
+            return target
+        except OSError:
+            pass
+        with self.lock:
+            if file_path not in self.pending and file_path not in self.failed:
+                job = self.executor.submit(make_thumbnail, file_path, target)
+                job.add_done_callback(lambda done: self.finish(file_path, done))
+                self.pending[file_path] = job
+        return None
+
+    def finish(self, file_path, job):
+        """pool callback, runs in a helper thread"""
+        with self.lock:
+            self.pending.pop(file_path, None)
+            if job.cancelled():
+                return
+            self.made += 1
+            evict = self.made % 100 == 0
+        try:
+            self.results.put((file_path, job.result()))
+        except Exception:  # pylint: disable=broad-except
+            # not an image Pillow can read, the browser keeps a placeholder
+            with self.lock:
+                self.failed.add(file_path)
+            self.results.put((file_path, None))
+        if evict:
+            prescale.evict(self.cache_dir, self.max_bytes)
+
+    def finished(self):
+        """[(path, thumbnail or None)] made since the last call"""
+        done = []
+        while True:
+            try:
+                done.append(self.results.get_nowait())
+            except queue.Empty:
+                return done
+
+    def forget(self, wanted):
+        """drop queued work for files that scrolled out of view"""
+        with self.lock:
+            dropped = [
+                job
+                for file_path, job in self.pending.items()
+                if file_path not in wanted
+            ]
+        # cancel() runs finish() right away, which takes the lock
+        for job in dropped:
+            job.cancel()
+
+    def close(self):
+        """stop the workers, queued work is dropped"""
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        prescale.evict(self.cache_dir, self.max_bytes)
@@ -2,20 +2,74 @@
 Utils
 """
 
+import os
 import subprocess
 import re
 
+JPEG_START = b"\xff\xd8"
+JPEG_END = b"\xff\xd9"
+# /proc/<pid>/comm is cut to 15 characters
+COMM_LENGTH = 15
 
-def is_running(process):
-    """True if process is running, string matching"""
+
+def running_processes(names):
+    """Subset of names that are running, all checked in a single pass"""
+    if os.path.isdir("/proc"):
+        return running_processes_proc(names)
+    return running_processes_ps(names)
+
+
+def running_processes_proc(names):
+    """scan /proc/*/comm without forking"""
+    wanted = {name[:COMM_LENGTH]: name for name in names}
+    found = set()
+    with os.scandir("/proc") as entries:
+        for entry in entries:
+            if not entry.name.isdigit():
+                continue
+            try:
+                with open(os.path.join(entry.path, "comm"), "rb") as commf:
+                    comm = commf.read().decode("utf-8", "replace").strip()
+            except OSError:  # process gone or not ours to read
+                continue
+            if comm in wanted:
+                found.add(wanted[comm])
+                if len(found) == len(wanted):
+                    break
+    return found
+
+
+def running_processes_ps(names):
+    """string matching on the process list of ps or tasklist"""
+    patterns = [(name, re.compile(re.escape(name))) for name in names]
+    found = set()
     try:  # Linux/Unix
-        with subprocess.Popen(["ps", "axw"], stdout=subprocess.PIPE) as sout:
-            for proc in sout.stdout:
-                if re.search(process, str(proc)):
-                    return True
-    except subprocess.SubprocessError():  # Windows
-        with subprocess.Popen(["tasklist", "/v"], stdout=subprocess.PIPE) as sout:
-            for proc in sout.stdout:
-                if re.search(process, str(proc)):
-                    return True
-    return False
+        command = ["ps", "axw"]
+        output = subprocess.run(command, stdout=subprocess.PIPE, check=False).stdout
+    except OSError:  # Windows
+        command = ["tasklist", "/v"]
+        output = subprocess.run(command, stdout=subprocess.PIPE, check=False).stdout
+    for proc in output.decode("utf-8", "replace").splitlines():
+        for name, pattern in patterns:
+            if name not in found and pattern.search(proc):
+                found.add(name)
+    return found
+
+
+def is_running(process):
+    """True if process is running"""
+    return process in running_processes([process])
+
+
+def is_complete_jpeg(file_path):
+    """JPEG start of image marker at the head and end of image near the tail"""
+    try:
+        with open(file_path, "rb") as imgf:
+            if imgf.read(2) != JPEG_START:
+                return False
+            size = os.fstat(imgf.fileno()).st_size
+            # some encoders pad a few bytes after the end marker
+            imgf.seek(max(size - 32, 2))
+            return JPEG_END in imgf.read()
+    except OSError:
+        return False
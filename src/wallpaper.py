@@ -5,21 +5,28 @@ from __future__ import print_function
 
 import os
 import sys
-import glob
 import random
-import subprocess
-
-
-# pylint: disable-msg=W0401
-import socwall
 
 # import utils
 import config
 import desktops
+import gallery
+import eviction
+import history
+import imagemeta
+import monitors
+import readyqueue
+import metrics
+
+# providers, HTTP, Pillow and process pools are imported by the methods that
+# need them, setting a queued wallpaper must not pay for them
+# pylint: disable=import-outside-toplevel
 
 # pylint: disable-msg=C0325
 
 VERBOSE = 1
+# images fitting the screen worse than this are left out in "fit" selection
+MIN_FIT = 0.3
 
 
 class Wallpaper:
@@ -29,98 +36,548 @@ class Wallpaper:
 
     def __init__(self):
         self.conf = config.Config()
+        if self.conf.metrics or os.environ.get("WALLPAPER_METRICS"):
+            metrics.enable(self.conf.config_dir)
+        self.index = gallery.GalleryIndex(self.conf.index_file_name)
+        self.history = history.History(self.conf.history_file_name)
+        self.history.import_log(self.conf.logfile_name, self.conf.wallpaper_static_dir)
+        self.ready = readyqueue.ReadyQueue(
+            self.conf.ready_queue_file_name,
+            self.conf.ready_queue_size,
+            self.conf.ready_queue_low,
+        )
+        self.blobs = None
+        if self.conf.blob_store:
+            import blobstore
+
+            self.blobs = blobstore.BlobStore(self.conf.blob_dir)
+
+    def gallery_dirs(self):
+        """folders indexed as (path, static)"""
+        return [
+            (self.conf.wallpaper_dir, False),
+            (self.conf.wallpaper_static_dir, True),
+        ]
+
+    def sync_index(self):
+        """rescan the gallery folders that changed since the last run"""
+        rescanned = self.index.reconcile(self.gallery_dirs(), lambda: self.history)
+        self.measure_images()
+        return rescanned
+
+    def measure_images(self):
+        """read size and integrity of the images indexed since the last time"""
+        measured = 0
+        pending = self.index.unmeasured()
+        while pending:
+            self.index.set_metas(
+                [(file_path, imagemeta.read_meta(file_path)) for file_path in pending]
+            )
+            measured += len(pending)
+            pending = self.index.unmeasured()
+        return measured
+
+    def screen_sizes(self):
+        """distinct resolutions of the connected monitors, primary first"""
+        override = monitors.parse_size(self.conf.screen_size)
+        if override is not None:
+            return [override]
+        sizes = []
+        found = monitors.parse_layout(self.conf.monitor_layout) or monitors.detect()
+        for monitor in found:
+            size = (monitor["width"], monitor["height"])
+            if size not in sizes:
+                sizes.append(size)
+        return sizes
+
+    def prescale_images(self, file_paths):
+        """
+        make display sized variants of images about to be shown in a process
+        pool, the cache is kept to its size as they come in
+        """
+        import prescale
+
+        if not self.conf.prescale or not prescale.available():
+            return {}
+        sizes = self.screen_sizes()
+        key = prescale.sizes_key(sizes)
+        done, removed = prescale.prescale(
+            self.index.needs_prescale(key, file_paths),
+            sizes,
+            self.conf.variant_dir,
+            max_bytes=self.conf.variant_cache_bytes,
+        )
+        for file_path, content_hash in done.items():
+            self.index.set_prescaled(file_path, content_hash, key)
+        self.index.clear_prescaled({prescale.variant_hash(p) for p in removed})
+        return done
+
+    def hash_images(self):
+        """perceptual hashes of the images indexed since the last time"""
+        import dedup
+
+        if not self.conf.dedup or not dedup.available():
+            return 0
+        hashed = 0
+        pending = self.index.unhashed()
+        while pending:
+            done = dedup.hash_files(pending)
+            # unreadable files get an empty hash so they are not retried
+            self.index.set_phashes(
+                [
+                    (p, "" if done.get(p) is None else dedup.to_text(done[p]))
+                    for p in pending
+                ]
+            )
+            hashed += len(done)
+            pending = self.index.unhashed()
+        return hashed
+
+    def known_hashes(self):
+        """[(path, hash)] of the gallery, preferred originals first"""
+        import dedup
+
+        return [
+            (path, dedup.from_text(phash)) for path, phash in self.index.phashes() if phash
+        ]
+
+    def deduplicator(self):
+        """duplicate check for a refill, None when dedup is off"""
+        import dedup
+
+        if not self.conf.dedup or not dedup.available():
+            return None
+        self.sync_index()
+        self.hash_images()
+        return dedup.Deduplicator(self.known_hashes(), self.conf.dedup_distance)
+
+    def remove_duplicates(self, distance=None):
+        """
+        Batch clean up: remove downloaded images that look like an older or a
+        static one. Static images are never removed, only reported.
+        """
+        import dedup
+
+        if not dedup.available():
+            print("Pillow is needed to find duplicates")
+            return []
+        self.sync_index()
+        self.hash_images()
+        removed = []
+        duplicates = dedup.find_duplicates(
+            self.known_hashes(), distance or self.conf.dedup_distance
+        )
+        with self.index.writing(self.conf.wallpaper_dir):
+            for duplicate, original in duplicates:
+                if self.is_static(duplicate):
+                    print(f"Static duplicate kept: {duplicate} looks like {original}")
+                    continue
+                print(f"Removing duplicate: {duplicate} looks like {original}")
+                try:
+                    os.remove(duplicate)
+                except FileNotFoundError:
+                    pass
+                except PermissionError:
+                    continue
+                removed.append(duplicate)
+            self.index.remove_many(removed)
+        if removed:
+            self.ready.discard(removed)
+        return removed
+
+    def store_blobs(self):
+        """
+        Move new images into the blob store, same content in both galleries
+        ends up stored once and the downloaded twin of a static image goes
+        """
+        if self.blobs is None:
+            return 0
+        stored = 0
+        removed = []
+        with self.index.writing(*[d for d, _ in self.gallery_dirs()]):
+            pending = self.index.unstored()
+            while pending:
+                for file_path, content_hash in pending:
+                    try:
+                        self.index.set_blob(
+                            file_path, self.blobs.ingest(file_path, content_hash)
+                        )
+                        stored += 1
+                    except OSError as error:
+                        if not os.path.lexists(file_path):
+                            # deleted behind the index's back
+                            self.index.remove(file_path)
+                            removed.append(file_path)
+                            continue
+                        print(f"Could not store {file_path}: {error}")
+                        self.index.set_blob(file_path, "")
+                previous, pending = pending, self.index.unstored()
+                if pending == previous:
+                    # nothing could be recorded, the next refill tries again
+                    break
+            for file_path, static_path in self.index.static_twins():
+                print(f"Removing {file_path}, kept as {static_path}")
+                try:
+                    os.remove(file_path)
+                except FileNotFoundError:
+                    pass
+                self.index.remove(file_path)
+                removed.append(file_path)
+        if removed:
+            self.ready.discard(removed)
+        return stored
+
+    def keep_forever(self, image_path, keep=True):
+        """
+        Promote a downloaded image like a static one, a flag in the index
+        instead of a copy in the static folder
+        """
+        self.index.set_keep(image_path, keep)
+        if image_path in self.history:
+            self.history.add(image_path, static=keep)
+
+    def ban(self, image_path):
+        """
+        Never show an image again, a downloaded one is deleted by the next
+        remove_used(), a static one just stays seen
+        """
+        if self.index.is_kept(image_path):
+            self.keep_forever(image_path, False)
+        self.save_used_image(image_path)
+        self.ready.discard([image_path])
+
+    def delete_image(self, image_path):
+        """remove an image from disk and everything that knows about it, static or not"""
+        with self.index.writing(os.path.dirname(image_path)):
+            try:
+                os.remove(image_path)
+            except FileNotFoundError:
+                pass
+            self.index.remove(image_path)
+        self.history.discard([image_path])
+        self.ready.discard([image_path])
+
+    def display_file(self, file_path, size=None):
+        """the prescaled variant of an image for size (main monitor), or the image"""
+        import prescale
+
+        if not self.conf.prescale:
+            return file_path
+        if size is None:
+            sizes = self.screen_sizes()
+            if not sizes:
+                return file_path
+            size = sizes[0]
+        variant = prescale.lookup(
+            self.conf.variant_dir, self.index.content_hash(file_path), size
+        )
+        return variant or file_path
+
+    def pick_fitting(self, exclude=()):
+        """random unseen image weighted by how well it fits the screen"""
+        screen = monitors.primary_size(self.conf.screen_size)
+        if screen is None:
+            return self.index.random_unused(exclude)
+        candidates = []
+        weights = []
+        for path, width, height in self.index.sized_unused(exclude):
+            score = imagemeta.fit_score(width, height, *screen)
+            if score >= MIN_FIT:
+                candidates.append(path)
+                weights.append(score)
+        if not candidates:
+            # nothing fits, better a stretched image than none
+            return self.index.random_unused(exclude)
+        return random.choices(candidates, weights)[0]
+
+    def pick_unused(self, exclude=()):
+        """unseen image by the configured selection, None if there is none"""
+        if self.conf.selection == "fit":
+            return self.pick_fitting(exclude)
+        return self.index.random_unused(exclude)
+
+    def fill_ready_queue(self):
+        """pick the next wallpapers ahead, then prescale what is queued"""
+        self.sync_index()
+        added = self.ready.fill(self.pick_unused)
+        with metrics.span("prescale"):
+            self.prescale_images(self.ready.paths())
+        self.ready.refresh(self.display_file)
+        return added
+
+    def needs_refill(self):
+        """True when the ready queue ran low"""
+        return self.ready.is_low()
+
+    def next_wallpaper(self):
+        """
+        (image, file to display) from the head of the ready queue, no index
+        scan or download unless the queue ran dry
+        """
+        with metrics.span("select", op="next_wallpaper") as span:
+            entry = self.ready.pop()
+            while entry is not None and entry["path"] in self.history:
+                entry = self.ready.pop()
+            if entry is not None:
+                span.set(source="queue")
+                return entry["path"], entry.get("display") or entry["path"]
+            span.set(source="fallback")
+            img = self.get_random_wallpaper()
+            if img is None:
+                return None, None
+            return img, self.display_file(img)
+
+    def next_wallpapers(self, count):
+        """count distinct images, repeated only when the gallery runs short"""
+        picked = []
+        for _ in range(count * 2):
+            img, _ = self.next_wallpaper()
+            if img and img not in picked:
+                picked.append(img)
+            if len(picked) == count:
+                break
+        if not picked:
+            return []
+        return [picked[num % len(picked)] for num in range(count)]
+
+    def monitor_layout(self):
+        """monitors to give an image each, none unless multi monitor mode is on"""
+        if not self.conf.multi_monitor:
+            return []
+        return monitors.layout(self.conf.monitor_layout)
+
+    def rotate(self):
+        """clean up the used images and set the next wallpaper, returns it"""
+        self.remove_used()
+        layout = self.monitor_layout()
+        if len(layout) > 1:
+            images = self.next_wallpapers(len(layout))
+            if images:
+                self.set_wallpapers(list(zip(layout, images)))
+                return images[0]
+        img, display = self.next_wallpaper()
+        if img is None:
+            print("No wallpaper to set, keeping the current one")
+            return None
+        self.set_wallpaper(img, display)
+        return img
 
     def gallery_maintenance(self):
         """remove used, download new"""
         # self.remove_used()
-        existing_images = len(self.get_existing_images())
-        if existing_images < self.conf.gallery_size:
-            self.download_images()
+        with metrics.span("refill"):
+            existing_images = len(self.get_existing_images())
+            if existing_images < self.conf.gallery_size:
+                self.download_images()
+            with metrics.span("store"):
+                self.enforce_budget()
+                self.store_blobs()
+                if self.blobs is not None:
+                    self.blobs.collect([d for d, _ in self.gallery_dirs()])
+            self.fill_ready_queue()
 
-    def set_wallpaper(self, file_path):
-        """GUI set wallpaper"""
+    def set_wallpaper(self, file_path, display_path=None):
+        """GUI set wallpaper, display_path is a prescaled variant if known"""
         try:
             desktop_env = self.conf.desktop_env
             if desktop_env == "unknown":
                 print("Could not detect desktop environment, not setting wallpaper")
             else:
                 print("setting: ", file_path)
-                desktops.WMS[desktop_env](file_path)
-                self.save_used_image(file_path)
+                with metrics.span("set_wallpaper", backend=desktop_env) as span:
+                    desktops.unspan(self.conf.picture_options_file_name)
+                    result = desktops.WMS[desktop_env](
+                        display_path or self.display_file(file_path)
+                    )
+                    span.set(ok=result["ok"], returncodes=result["returncodes"])
+                if VERBOSE:
+                    print(
+                        f"{result['backend']}: {'ok' if result['ok'] else 'failed'}"
+                        f" in {result['seconds']:.3f}s {result['returncodes']}"
+                    )
+                if result["ok"]:
+                    self.save_used_image(file_path)
         except IndexError:
             print(
                 f"Unexpected error setting wallpaper for {desktop_env}:",
                 sys.exc_info()[0],
             )
 
+    def compose_span(self, tiles):
+        """one image over all monitors out of [(monitor, image)], None without Pillow"""
+        import prescale
+        import compose
+
+        if not prescale.available():
+            return None
+        with metrics.span("compose", monitors=len(tiles)):
+            return compose.compose(
+                [(path, monitor) for monitor, path in tiles],
+                self.conf.span_dir,
+                self.conf.span_cache_bytes,
+            )
+
+    def set_wallpapers(self, assignments):
+        """
+        An image per monitor from [(monitor, image)]: per monitor where the
+        desktop can, as one composed spanned image elsewhere
+        """
+        desktop_env = self.conf.desktop_env
+        if desktop_env == "unknown":
+            print("Could not detect desktop environment, not setting wallpaper")
+            return
+        tiles = [
+            (monitor, self.display_file(img, (monitor["width"], monitor["height"])))
+            for monitor, img in assignments
+        ]
+        print("setting: ", ", ".join(img for _, img in assignments))
+        with metrics.span(
+            "set_wallpaper", backend=desktop_env, monitors=len(tiles)
+        ) as span:
+            if desktop_env in desktops.MULTI_WMS:
+                result = desktops.MULTI_WMS[desktop_env](tiles)
+            else:
+                spanned = self.compose_span(tiles)
+                if spanned is None:
+                    print("Pillow is needed to span images, setting one")
+                    assignments = assignments[:1]
+                    desktops.unspan(self.conf.picture_options_file_name)
+                    result = desktops.WMS[desktop_env](tiles[0][1])
+                else:
+                    result = desktops.set_wallpaper_spanned(
+                        desktop_env, spanned, self.conf.picture_options_file_name
+                    )
+            span.set(ok=result["ok"], returncodes=result["returncodes"])
+        if VERBOSE:
+            print(
+                f"{result['backend']}: {'ok' if result['ok'] else 'failed'}"
+                f" in {result['seconds']:.3f}s {result['returncodes']}"
+            )
+        if result["ok"]:
+            for _, img in assignments:
+                self.save_used_image(img)
+
     def download_images(self, path=""):
-        """download random images"""
-        # TODO: Cycle thru image providers, downloading from each
+        """download random images from every enabled provider at once"""
+        import providers
+        import dedup
+
         if path == "":
             path = self.conf.wallpaper_dir
-        return socwall.dl_random_images(path)
+        checker = self.deduplicator()
+        with self.index.writing(path):
+            with metrics.span("download") as span:
+                new_images = providers.fetch_all(
+                    providers.enabled(self.conf.providers, path, dedup=checker),
+                    state_dir=self.conf.config_dir,
+                )
+                span.set(images=len(new_images))
+            for provider, new_image in new_images:
+                self.index.add(new_image, provider=provider)
+                if checker is not None and new_image in checker.hashes:
+                    self.index.set_phash(
+                        new_image, dedup.to_text(checker.hashes[new_image])
+                    )
+        if new_images:
+            self.measure_images()
+            self.store_blobs()
+        return [new_image for _, new_image in new_images]
 
     def get_existing_images(self):
         """Return a list of img options to choose from"""
-        used_images = []
-        with open(self.conf.logfile_name, "r", encoding="utf-8") as logf:
-            used_images = logf.readlines()
-            used_images = [used.strip("\n") for used in used_images]
-
-        wallpaper_dir = self.conf.wallpaper_dir
-        wallpaper_static_dir = self.conf.wallpaper_static_dir
-        images = glob.glob(wallpaper_dir + "/*.jpg")
-        images += glob.glob(wallpaper_static_dir + "/*.jpg")
-        return [img for img in images if img not in used_images]
+        with metrics.span("select", op="get_existing_images"):
+            self.sync_index()
+            return self.index.unused_images()
 
     def get_random_wallpaper(self):
-        """Returns a random image that has not been seen before"""
-        options = self.get_existing_images()
-        if options:
-            return random.choice(options)
-        return self.dl_one_image()
+        """Returns a random image not seen before, None if there is none"""
+        import pipeline
+
+        with metrics.span("select", op="get_random_wallpaper"):
+            self.sync_index()
+            option = self.pick_unused()
+        if option:
+            return option
+        try:
+            return self.dl_one_image()
+        except pipeline.FETCH_ERRORS as error:
+            print(f"Could not download a wallpaper: {error}")
+            return None
 
     def dl_one_image(self, path=""):
         """Get one image fast"""
+        import socwall
+
         if path == "":
             path = self.conf.wallpaper_dir
-        return socwall.dl_one(path)
+        with self.index.writing(path):
+            new_image = socwall.dl_one(path)
+            self.index.add(new_image, provider="socwall")
+        return new_image
+
+    def is_static(self, image_path):
+        """True for images in the folder that is never cleaned, or kept forever"""
+        if os.path.dirname(image_path) == self.conf.wallpaper_static_dir:
+            return True
+        return self.index.is_kept(image_path)
 
     def save_used_image(self, image_path):
         """Log an image that has been used"""
-        with open(self.conf.logfile_name, "a+", encoding="utf-8") as log:
-            log.write(image_path + "\n")
+        self.history.add(image_path, static=self.is_static(image_path))
+        self.index.mark_used(image_path)
+
+    def evict(self, max_bytes=None, max_files=None, policy=None):
+        """remove downloaded images until the gallery fits, never static ones"""
+        self.sync_index()
+        with self.index.writing(self.conf.wallpaper_dir):
+            removed = eviction.evict(
+                self.conf.wallpaper_dir,
+                max_bytes,
+                max_files,
+                policy or self.conf.eviction_policy,
+                index=self.index,
+                protected_dirs=[self.conf.wallpaper_static_dir],
+            )
+        for filepath in removed:
+            print(f"Removed: {filepath}")
+        if removed:
+            self.ready.discard(removed)
+        return removed
+
+    def enforce_budget(self):
+        """keep the download folder within the configured disk and file budget"""
+        return self.evict(self.conf.gallery_bytes, self.conf.gallery_max_files)
 
     def remove_oldest(self, num):
         """remove a number of images"""
-        fnbytes = subprocess.check_output(
-            f"/bin/ls -tr -S {self.conf.wallpaper_dir}|head -n {num}",
-            shell=True,
-        )
-        fnstr = fnbytes.decode()
-        for filepath in [fn for fn in fnstr.split("\n") if fn != ""]:
-            os.remove(self.conf.wallpaper_dir + "/" + filepath)
-            print(f"Removed: {filepath}")
+        self.sync_index()
+        # kept images are never evicted, so they do not count either
+        count = self.index.count(directory=self.conf.wallpaper_dir, kept=False)
+        return self.evict(max_files=max(count - num, 0), policy="fifo")
 
     def remove_used(self):
-        """remove used images from disk and log"""
-        used_images = []
-        with open(self.conf.logfile_name, "r", encoding="utf-8") as logf:
-            used_images = logf.readlines()
-            used_images = [used.strip("\n") for used in used_images]
-        for used_path in used_images:
-            try:
-                print("removing: ", used_path)
-                os.remove(used_path)
-            except PermissionError:
-                pass
-        with open(self.conf.logfile_name, "w", encoding="utf-8") as truncate_log:
-            truncate_log.write("")
+        """remove used downloaded images from disk and history, static ones stay seen"""
+        removed = []
+        with metrics.span("remove_used") as span:
+            with self.index.writing(self.conf.wallpaper_dir):
+                for used_path in self.history.used_paths(static=False):
+                    try:
+                        print("removing: ", used_path)
+                        os.remove(used_path)
+                        removed.append(used_path)
+                    except FileNotFoundError:
+                        removed.append(used_path)
+                    except PermissionError:
+                        continue
+                self.index.remove_many(removed)
+            self.history.discard(removed)
+            self.history.maybe_compact()
+            span.set(removed=len(removed))
+        return removed
 
 
 if __name__ == "__main__":
-    WM = Wallpaper()
-    WM.remove_used()
-    img = WM.get_random_wallpaper()
-    WM.set_wallpaper(img)
-    WM.gallery_maintenance()
+    # the old entry point, cron jobs calling it without arguments keep working
+    import cli
+
+    sys.exit(cli.main(sys.argv[1:] or ["set-next"]))
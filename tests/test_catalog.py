@@ -0,0 +1,137 @@
+"""
+Page count discovery of the catalog, alone and through socwall against the
+local stand-in
+"""
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "bench"))
+
+# pylint: disable=wrong-import-position
+import standin
+import catalog
+import session
+import socwall
+
+
+class Probe:
+    """pages up to last exist, every probed page is remembered"""
+
+    def __init__(self, last, failing=()):
+        self.last = last
+        self.failing = failing
+        self.probed = []
+
+    def __call__(self, page):
+        self.probed.append(page)
+        if page in self.failing:
+            raise IOError(f"page {page} timed out")
+        return page <= self.last
+
+
+class Counting:
+    """token bucket stand-in counting acquire() calls"""
+
+    def __init__(self):
+        self.acquired = 0
+
+    def acquire(self):
+        """one token"""
+        self.acquired += 1
+
+
+@pytest.mark.parametrize("last", [1, 2, 17, 500, 709, 1000, 3000])
+@pytest.mark.parametrize("hint", [1, 100, 709])
+def test_discover_page_count(last, hint):
+    """finds the last page from any hint in about 2*log2(pages) probes"""
+    probe = Probe(last)
+    assert catalog.discover_page_count(probe, hint) == last
+    assert len(probe.probed) <= 2 * (max(last, hint) + 1).bit_length() + 2
+
+
+def test_discover_without_first_page():
+    """no page at all is an error, not a count of 1"""
+    with pytest.raises(IOError):
+        catalog.discover_page_count(Probe(0), 709)
+
+
+def test_page_count_cached(tmp_path):
+    """the discovered count is stored and used without probing again"""
+    cat = catalog.Catalog(str(tmp_path / "catalog.db"))
+    assert cat.page_count(Probe(300), 709) == 300
+    probe = Probe(400)
+    assert cat.page_count(probe, 709) == 300
+    assert not probe.probed
+
+
+@pytest.mark.parametrize(
+    "probe",
+    [
+        Probe(0),
+        Probe(300, failing=range(1, 10000)),
+        Probe(300, failing=range(2, 709)),
+    ],
+)
+def test_page_count_outage(tmp_path, probe):
+    """failed probes fall back to the hint and store nothing"""
+    cat = catalog.Catalog(str(tmp_path / "catalog.db"))
+    assert cat.page_count(probe, 709) == 709
+    assert cat.get_meta("page_count") is None
+
+
+def test_page_count_outage_keeps_previous(tmp_path):
+    """a stale count is used as is while probing fails"""
+    cat = catalog.Catalog(str(tmp_path / "catalog.db"))
+    cat.set_meta("page_count", 300)
+    with cat.lock, cat.conn:
+        cat.conn.execute("UPDATE meta SET updated = 0")
+    assert cat.page_count(Probe(0), 709) == 300
+    assert cat.get_meta("page_count", catalog.PAGE_COUNT_TTL) is None
+    assert cat.page_count(Probe(320), 709) == 320
+
+
+@pytest.fixture(name="server")
+def fixture_server(monkeypatch, tmp_path):
+    """a stand-in for socwall, its cache in tmp_path"""
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "cache"))
+    server = standin.StandIn(pages=37, image_bytes=4096)
+    monkeypatch.setattr(socwall, "SOCWALL_DOMAIN", server.start())
+    yield server
+    server.stop()
+    session.close_all()
+
+
+def test_socwall_page_count(server, tmp_path):
+    """pages past the last answer 404, every probe takes a token"""
+    cat = catalog.Catalog(str(tmp_path / "catalog.db"))
+    limiter = Counting()
+    assert socwall.page_count(cat, limiter) == 37
+    assert cat.get_meta("page_count") == "37"
+    assert limiter.acquired == server.stats()["requests"]
+
+
+def test_socwall_page_count_outage(server, tmp_path):
+    """a site answering 503 leaves the count unknown instead of 1"""
+    server.error_rate = 1.0
+    cat = catalog.Catalog(str(tmp_path / "catalog.db"))
+    assert socwall.page_count(cat) == socwall.SOCWALL_MAX
+    assert cat.get_meta("page_count") is None
+
+
+def test_session_stats_totals(server):
+    """the session keeps counts, not one entry per request"""
+    pooled = session.PooledSession(2)
+    try:
+        for page in (1, 2, 38, 39):
+            pooled.get(f"{socwall.SOCWALL_DOMAIN}wallpapers/page:{page}/")
+        stats = pooled.stats()
+        assert (stats["requests"], stats["errors"]) == (4, 2)
+        assert stats["avg_seconds"] == stats["seconds"] / 4
+        assert not hasattr(pooled, "timings")
+        pooled.reset_stats()
+        assert pooled.stats()["requests"] == 0
+    finally:
+        pooled.close()
@@ -0,0 +1,122 @@
+"""
+Desktop detection caching, in process and in the config dir
+"""
+
+import os
+import sys
+import json
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+# pylint: disable=wrong-import-position
+import desktops
+
+
+@pytest.fixture(name="detected")
+def fixture_detected(monkeypatch):
+    """no session variables, detection answers what the test sets"""
+    for var in desktops.SESSION_VARS:
+        monkeypatch.delenv(var, raising=False)
+    monkeypatch.setattr(desktops, "_DETECTED", {})
+    answers = []
+    monkeypatch.setattr(desktops, "detect_desktop_env", lambda: answers[-1])
+    return answers
+
+
+def test_login_cached(detected, tmp_path, monkeypatch):
+    """a desktop found in a login session is read back from the file"""
+    cache_file = str(tmp_path / "desktop.json")
+    monkeypatch.setenv("XDG_SESSION_ID", "3")
+    detected.append("xfce4")
+    assert desktops.get_desktop_env(cache_file) == "xfce4"
+    monkeypatch.setattr(desktops, "_DETECTED", {})
+    detected.append("kde")
+    assert desktops.get_desktop_env(cache_file) == "xfce4"
+    # the next login detects again
+    monkeypatch.setenv("XDG_SESSION_ID", "4")
+    assert desktops.get_desktop_env(cache_file) == "kde"
+
+
+def test_unknown_not_cached(detected, tmp_path, monkeypatch):
+    """a cron run before the desktop is up does not stick"""
+    cache_file = str(tmp_path / "desktop.json")
+    monkeypatch.setenv("XDG_SESSION_ID", "3")
+    detected.append("unknown")
+    assert desktops.get_desktop_env(cache_file) == "unknown"
+    assert not os.path.exists(cache_file)
+    detected.append("gnome")
+    assert desktops.get_desktop_env(cache_file) == "gnome"
+
+
+def test_cron_skips_file(detected, tmp_path, monkeypatch):
+    """without login variables every run detects again"""
+    cache_file = str(tmp_path / "desktop.json")
+    monkeypatch.setenv("DISPLAY", ":0")
+    with open(cache_file, "w", encoding="utf-8") as cachef:
+        json.dump(
+            {"session": desktops.session_key(), "desktop_env": "kde"}, cachef
+        )
+    detected.append("xfce4")
+    assert desktops.get_desktop_env(cache_file) == "xfce4"
+    with open(cache_file, encoding="utf-8") as cachef:
+        assert json.load(cachef)["desktop_env"] == "kde"
+
+
+@pytest.fixture(name="gsettings")
+def fixture_gsettings(tmp_path, monkeypatch):
+    """a gsettings on PATH keeping its keys in files, returns the calls log"""
+    bin_dir = tmp_path / "bin"
+    keys = tmp_path / "keys"
+    bin_dir.mkdir()
+    keys.mkdir()
+    script = bin_dir / "gsettings"
+    script.write_text(
+        "#!/bin/sh\n"
+        f'echo "$@" >> {tmp_path}/calls\n'
+        f'key="{keys}/$2.$3"\n'
+        'if [ "$1" = get ]; then cat "$key" 2>/dev/null || echo "\'zoom\'"; fi\n'
+        'if [ "$1" = set ]; then echo "\'$4\'" > "$key"; fi\n'
+    )
+    script.chmod(0o755)
+    monkeypatch.setenv("PATH", f"{bin_dir}:{os.environ['PATH']}")
+    calls = tmp_path / "calls"
+
+    def options(value=None):
+        """read or set the gnome picture-options the way a user would"""
+        target = keys / "org.gnome.desktop.background.picture-options"
+        if value is not None:
+            target.write_text(f"'{value}'\n")
+        return target.read_text().strip().strip("'")
+
+    return calls, options
+
+
+def test_single_image_keeps_picture_options(gsettings, tmp_path):
+    """the user's picture-options come back after spanning, and only then"""
+    calls, options = gsettings
+    saved_file = str(tmp_path / "picture-options.json")
+    options("scaled")
+    desktops.unspan(saved_file)
+    desktops.set_wallpaper_gnomefamily("/x/a.jpg")
+    assert "picture-options" not in calls.read_text()
+
+    desktops.set_wallpaper_spanned("gnome", "/x/s.jpg", saved_file)
+    desktops.set_wallpaper_spanned("gnome", "/x/t.jpg", saved_file)
+    assert options() == "spanned"
+    desktops.unspan(saved_file)
+    assert options() == "scaled"
+    assert not os.path.exists(saved_file)
+
+
+def test_unspan_leaves_user_choice(gsettings, tmp_path):
+    """picture-options changed while spanned are not overwritten"""
+    _, options = gsettings
+    saved_file = str(tmp_path / "picture-options.json")
+    options("scaled")
+    desktops.set_wallpaper_spanned("gnome", "/x/s.jpg", saved_file)
+    options("centered")
+    desktops.unspan(saved_file)
+    assert options() == "centered"
+    assert not os.path.exists(saved_file)
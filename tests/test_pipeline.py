@@ -0,0 +1,65 @@
+"""
+Retries and the circuit breaker of the fetch pipeline, by kind of error
+"""
+
+import os
+import sys
+
+import pytest
+import requests
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+# pylint: disable=wrong-import-position
+import pipeline
+import throttle
+
+
+def http_error(status):
+    """the error raise_for_status() gives for a status"""
+    response = requests.Response()
+    response.status_code = status
+    return requests.HTTPError(f"{status} error", response=response)
+
+
+@pytest.fixture(autouse=True)
+def fixture_no_backoff(monkeypatch):
+    """retry at once"""
+    monkeypatch.setattr(throttle, "backoff", lambda attempt: 0)
+
+
+@pytest.mark.parametrize(
+    "error, transient",
+    [
+        (http_error(404), False),
+        (http_error(403), False),
+        (http_error(429), True),
+        (http_error(503), True),
+        (requests.ConnectionError("refused"), True),
+        (requests.Timeout("read timed out"), True),
+        (ValueError("no download link"), False),
+    ],
+)
+def test_retries_by_error(error, transient):
+    """transient errors are retried and counted, the others reported once"""
+    calls = []
+    reported = []
+    breaker = throttle.CircuitBreaker(threshold=100)
+
+    def fetch(job):
+        calls.append(job)
+        raise error
+
+    results = pipeline.download(
+        [1],
+        lambda page: ["ref"],
+        lambda ref: ref,
+        fetch,
+        on_error=reported.append,
+        breaker=breaker,
+        retries=2,
+    )
+    assert results == []
+    assert reported == [error]
+    assert len(calls) == (3 if transient else 1)
+    assert breaker.failures == (3 if transient else 0)
@@ -0,0 +1,166 @@
+"""
+Refills from several providers at once, against the local stand-in with
+the fake alpha and beta providers of bench/standin.py
+"""
+
+import os
+import sys
+import time
+import threading
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "bench"))
+
+# pylint: disable=wrong-import-position
+import standin
+import pipeline
+import providers
+import session
+
+
+@pytest.fixture(name="server")
+def fixture_server(monkeypatch):
+    """a stand-in serving the fakes, provider states reset"""
+    server = standin.StandIn(pages=5, image_bytes=4096)
+    server.start()
+    monkeypatch.setattr(standin.FakeProvider, "base_url", server.url)
+    monkeypatch.setitem(providers.PROVIDERS, "alpha", "standin.FakeAlpha")
+    monkeypatch.setitem(providers.PROVIDERS, "beta", "standin.FakeBeta")
+    monkeypatch.setattr(providers, "_STATES", {})
+    monkeypatch.setattr(providers, "_SAVED", {})
+    yield server
+    server.stop()
+    session.close_all()
+
+
+class Recorder:
+    """when each paced call of a provider started, by stage"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {"list": [], "resolve": []}
+
+    def record(self, stage):
+        """one paced call"""
+        with self.lock:
+            self.calls[stage].append(time.monotonic())
+
+
+def recording(provider):
+    """provider whose listing and resolve calls are timed"""
+    recorder = Recorder()
+    list_page, resolve = provider.list_page, provider.resolve
+
+    def timed_list(page):
+        recorder.record("list")
+        return list_page(page)
+
+    def timed_resolve(ref):
+        recorder.record("resolve")
+        return resolve(ref)
+
+    provider.list_page, provider.resolve = timed_list, timed_resolve
+    provider.recorder = recorder
+    return provider
+
+
+def images_in(path):
+    """images on disk in a gallery"""
+    return sorted(name for name in os.listdir(path) if name.endswith(".jpg"))
+
+
+def test_quota_met_exactly(server, tmp_path):
+    """the providers share the quota, nothing past it is resolved or downloaded"""
+    enabled = [
+        recording(provider)
+        for provider in providers.enabled(["alpha", "beta"], str(tmp_path))
+    ]
+    downloaded = providers.fetch_all(enabled, 7)
+    assert len(downloaded) == 7
+    resolved = sum(len(p.recorder.calls["resolve"]) for p in enabled)
+    assert resolved == 7
+    assert {name for name, _ in downloaded} <= {"alpha", "beta"}
+    assert images_in(tmp_path) == sorted(
+        os.path.basename(path) for _, path in downloaded
+    )
+    # no request is still on its way once the refill returned
+    requests = server.stats()["requests"]
+    time.sleep(0.3)
+    assert server.stats()["requests"] == requests
+
+
+def test_failing_provider_does_not_stall(server, tmp_path):
+    """alpha fills the quota on its own while beta fails every listing"""
+    alpha, beta = providers.enabled(["alpha", "beta"], str(tmp_path))
+    tried = []
+
+    def broken(page):
+        tried.append(page)
+        raise IOError(f"page {page} unavailable")
+
+    beta.list_page = broken
+    downloaded = providers.fetch_all([alpha, beta], 5)
+    assert tried
+    assert [name for name, _ in downloaded] == ["alpha"] * 5
+    assert len(images_in(tmp_path)) == 5
+
+
+def test_slow_provider_does_not_stall(server, tmp_path):
+    """alpha fills the quota long before beta's first image could arrive"""
+    slow = standin.StandIn(pages=5, image_bytes=4096, latency=2.0)
+    slow.start()
+    try:
+        alpha, beta = providers.enabled(["alpha", "beta"], str(tmp_path))
+        beta.base_url = slow.url
+        start = time.monotonic()
+        downloaded = providers.fetch_all([alpha, beta], 5)
+        seconds = time.monotonic() - start
+    finally:
+        slow.stop()
+    assert [name for name, _ in downloaded] == ["alpha"] * 5
+    # a listing then a download from beta takes at least 4s, the refill
+    # waits at most the stop grace for the request beta has in flight
+    assert seconds < 4.0
+    assert server.stats()["requests"] >= 6
+
+
+def test_stuck_fetch_does_not_stall(server, tmp_path):
+    """a download hanging with its quota slot does not hold alpha back"""
+    alpha, beta = providers.enabled(["alpha", "beta"], str(tmp_path))
+    unstuck = threading.Event()
+
+    def stuck(job):
+        unstuck.wait(30)
+        return job
+
+    beta.fetch = stuck
+    start = time.monotonic()
+    try:
+        downloaded = providers.fetch_all([alpha, beta], 5)
+    finally:
+        unstuck.set()
+    seconds = time.monotonic() - start
+    assert [name for name, _ in downloaded] == ["alpha"] * 5
+    # alpha waits out the slot patience once, the end of the run waits out
+    # the stop grace, not the stuck download
+    assert seconds < 1.5 + pipeline.SLOT_PATIENCE + pipeline.STOP_GRACE
+
+
+def test_rate_limit_per_provider(server, tmp_path):
+    """listing and resolve calls stay within each provider's own rate"""
+    alpha, beta = [
+        recording(provider)
+        for provider in providers.enabled(["alpha", "beta"], str(tmp_path))
+    ]
+    downloaded = providers.fetch_all([alpha, beta], 16)
+    assert len(downloaded) >= 16
+    for provider in (alpha, beta):
+        calls = sorted(sum(provider.recorder.calls.values(), []))
+        assert len(calls) > provider.rate
+        burst = provider.limiter.capacity
+        for first, start in enumerate(calls):
+            for last in range(first + 1, len(calls)):
+                allowed = burst + (calls[last] - start) * provider.rate
+                # small slack for the clock reads around the token bucket
+                assert last - first + 1 <= allowed + 0.1
@@ -0,0 +1,29 @@
+"""
+Import budget of the cron path, the check of bench/bench_import.py as a test
+"""
+
+import os
+import sys
+import statistics
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "bench"))
+
+# pylint: disable=wrong-import-position
+import bench_import
+
+# shared CI runners are noisy, the strict budget is bench/bench_import.py's
+# job unless asked for here
+STRICT = os.environ.get("WALLPAPER_STRICT_IMPORT_BUDGET") == "1"
+BUDGET_MS = bench_import.DEFAULT_BUDGET_MS * (1 if STRICT else 4)
+
+
+def test_startup_imports_within_budget():
+    """cli, wallpaper and refill import without heavy modules, in budget"""
+    timings = []
+    loaded = set()
+    for _ in range(bench_import.RUNS):
+        milliseconds, modules = bench_import.measure()
+        timings.append(milliseconds)
+        loaded.update(modules)
+    assert bench_import.forbidden_loaded(loaded) == []
+    assert statistics.median(timings) <= BUDGET_MS
@@ -0,0 +1,49 @@
+"""
+Thumbnailer queueing, with a single worker kept busy
+"""
+
+import os
+import sys
+import threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+# pylint: disable=wrong-import-position
+import thumbnails
+
+
+def make_images(directory, count):
+    """count small JPEGs"""
+    from PIL import Image  # pylint: disable=import-outside-toplevel
+
+    paths = []
+    for num in range(count):
+        path = os.path.join(directory, f"image-{num}.jpg")
+        Image.new("RGB", (640, 400), (num * 10, 0, 0)).save(path, "JPEG")
+        paths.append(path)
+    return paths
+
+
+def test_forget_queued_work(tmp_path):
+    """forget() drops what is queued behind a busy worker and returns"""
+    paths = make_images(str(tmp_path), 20)
+    thumbnailer = thumbnails.Thumbnailer(str(tmp_path / "cache"), workers=1)
+    try:
+        for path in paths:
+            assert thumbnailer.request(path, os.stat(path).st_mtime) is None
+        forgetting = threading.Thread(
+            target=thumbnailer.forget, args=(set(),), daemon=True
+        )
+        forgetting.start()
+        forgetting.join(10)
+        assert not forgetting.is_alive()
+        # only jobs the worker already started are left
+        with thumbnailer.lock:
+            assert len(thumbnailer.pending) < len(paths)
+        # a forgotten file can be asked for again
+        path = paths[-1]
+        assert thumbnailer.request(path, os.stat(path).st_mtime) is None
+        with thumbnailer.lock:
+            assert path in thumbnailer.pending
+    finally:
+        thumbnailer.close()